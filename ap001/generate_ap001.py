@@ -6,16 +6,96 @@ MANUTENÇÃO CADASTRAL DE ESTABELECIMENTO COMERCIAL
 """
 
 import csv
+import itertools
 import json
+import os
 import random
-from datetime import datetime
-from typing import List, Dict, Optional
+import sys
+from array import array
+from datetime import datetime, timedelta
+from math import gcd
+from typing import List, Dict, Optional, Tuple
 from pathlib import Path
 
+# Módulos compartilhados entre os geradores (pasta common/ na raiz do repositório)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from common.output import OutputFileMixin
 
-class AP001Generator:
+
+class NameSynthesizer:
+    """
+    Sintetizador de razões sociais e nomes fantasia a partir de vocabulários combinatórios
+    
+    O vocabulário é carregado uma única vez (CSV com colunas categoria,termo) e
+    cada nome é montado por índice: um número em [0, total) é decomposto em
+    base mista nos índices de ramo, núcleo, complemento e natureza jurídica.
+    Termos repetidos no arquivo aumentam a frequência com que aparecem.
+    """
+    
+    CATEGORIAS = ('ramo', 'nucleo', 'complemento', 'natureza')
+    
+    def __init__(self, file_path: str):
+        """
+        Args:
+            file_path: Caminho do CSV de vocabulário
+        """
+        termos = {categoria: [] for categoria in self.CATEGORIAS}
+        with open(file_path, 'r', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                categoria = row.get('categoria', '').strip()
+                if categoria in termos:
+                    termos[categoria].append(row.get('termo', '').strip())
+        
+        for categoria in ('ramo', 'nucleo', 'natureza'):
+            if not any(termos[categoria]):
+                raise ValueError(f"Vocabulário {file_path}: nenhum termo na categoria '{categoria}'")
+        if not termos['complemento']:
+            termos['complemento'] = ['']
+        
+        self.ramos = termos['ramo']
+        self.nucleos = termos['nucleo']
+        # Complementos pré-fixados com espaço (vazio = sem complemento)
+        self.complementos = [f" {c}" if c else '' for c in termos['complemento']]
+        self.naturezas = termos['natureza']
+        self.total = len(self.ramos) * len(self.nucleos) * len(self.complementos) * len(self.naturezas)
+        
+        # Permutação fixa dos índices, para que CNPJs vizinhos não tenham nomes parecidos
+        self.passo = self._coprime_step(self.total)
+    
+    @staticmethod
+    def _coprime_step(total: int) -> int:
+        """Retorna um passo próximo de total * 0,618 e primo com total"""
+        passo = max(1, int(total * 0.6180339887))
+        while gcd(passo, total) != 1:
+            passo += 1
+        return passo
+    
+    def names_for(self, indice: int) -> Tuple[str, str]:
+        """
+        Monta (razao_social, nome_fantasia) para um índice
+        
+        O mesmo índice gera sempre os mesmos nomes.
+        """
+        k = (indice * self.passo) % self.total
+        k, r = divmod(k, len(self.ramos))
+        k, n = divmod(k, len(self.nucleos))
+        k, c = divmod(k, len(self.complementos))
+        natureza = self.naturezas[k]
+        nome_fantasia = f"{self.ramos[r]} {self.nucleos[n]}"
+        return f"{nome_fantasia}{self.complementos[c]} {natureza}", nome_fantasia + self.complementos[c]
+    
+    def random_names(self) -> Tuple[str, str]:
+        """Sorteia (razao_social, nome_fantasia) uniformemente entre as combinações"""
+        return self.names_for(random.randrange(self.total))
+
+
+class AP001Generator(OutputFileMixin):
     """Gerador de arquivos AP001 da CERC"""
     
+    # Quantidade de raízes de CNPJ distintas (8 dígitos) e filial usada nos CNPJs gerados
+    ESPACO_RAIZES = 10 ** 8
+    FILIAL = "0001"
+    
     def __init__(self, config_path: str = "generate_ap001.json"):
         """
         Inicializa o gerador com configuração do arquivo JSON
@@ -28,6 +108,41 @@ class AP001Generator:
         self.cnpj_raiz = self.cnpj_credenciadora[:8]
         self.sequence = 1
         self.tipo_leiaute = "CERC-AP001"
+        
+        # Vocabulário de nomes, carregado uma única vez
+        self.sintetizador_nomes = NameSynthesizer(
+            self.config.get('arquivo_vocabulario_nomes', 'vocabulario_nomes.csv')
+        )
+        
+        # Proporção de cada tipo de operação (C = Criar, A = Atualizar, I = Inativar).
+        # Os ativos crescem à razão de C - I por registro; com C <= I a população ativa
+        # não cresce, e A e I passam a se concentrar nos poucos estabelecimentos restantes
+        proporcoes = self.config.get('proporcao_operacoes', {'C': 6, 'A': 3, 'I': 1})
+        self.tipos_operacao = [t for t in ('C', 'A', 'I') if proporcoes.get(t, 0) > 0]
+        if 'C' not in self.tipos_operacao:
+            raise ValueError("proporcao_operacoes: a operação C deve ter proporção maior que zero")
+        self.pesos_operacao = list(itertools.accumulate(proporcoes[t] for t in self.tipos_operacao))
+        
+        # Permutação afim sobre as raízes de CNPJ (8 dígitos): raiz = (a * índice + b) mod 10^8.
+        # Com a primo com 10^8, índices distintos geram raízes distintas, sem guardar CNPJs em memória.
+        # a e b vêm da semente (padrão: o CNPJ da credenciadora), então são os mesmos em toda execução
+        self.semente_cnpj = int(self.config.get('semente_cnpj', self.cnpj_credenciadora))
+        sorteio = random.Random(self.semente_cnpj)
+        self.multiplicador_cnpj = sorteio.randrange(1, self.ESPACO_RAIZES)
+        while gcd(self.multiplicador_cnpj, self.ESPACO_RAIZES) != 1:
+            self.multiplicador_cnpj += 1
+        self.deslocamento_cnpj = sorteio.randrange(self.ESPACO_RAIZES)
+        self._build_check_digit_tables()
+        
+        # Índices dos estabelecimentos ativos, sem ordem (4 bytes por ativo); os índices
+        # de 0 a total_cnpjs_criados - 1 que não estão aqui foram inativados
+        self.ativos = array('I')
+        self.total_cnpjs_criados = 0
+        
+        # Estado persistido de execuções anteriores (continua a sequência de arquivos diários)
+        self.arquivo_estado = self.config.get('arquivo_estado')
+        if self.arquivo_estado and os.path.exists(self.arquivo_estado):
+            self.load_state(self.arquivo_estado)
     
     def _load_config(self, config_path: str) -> Dict:
         """Carrega configuração do arquivo JSON"""
@@ -51,9 +166,6 @@ class AP001Generator:
         date_str = date.strftime("%Y%m%d")
         seq_str = f"{self.sequence:07d}"
         
-        # Cria o diretório se não existir
-        Path(output_dir).mkdir(parents=True, exist_ok=True)
-        
         filename = f"{self.tipo_leiaute}_{self.cnpj_raiz}_{date_str}_{seq_str}.csv"
         return str(Path(output_dir) / filename)
     
@@ -61,50 +173,147 @@ class AP001Generator:
         """Formata CNPJ com zeros à esquerda até 14 dígitos"""
         return cnpj.zfill(14)
     
+    def _build_check_digit_tables(self):
+        """
+        Pré-calcula as somas ponderadas dos dígitos verificadores do CNPJ
+        
+        A raiz é dividida em dois blocos de 4 dígitos; cada tabela guarda a soma
+        ponderada de um bloco para os pesos do 1º e do 2º dígito verificador, de
+        forma que o cálculo por CNPJ se reduz a quatro consultas.
+        """
+        pesos_dv1 = (5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2)
+        pesos_dv2 = (6, 5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2)
+        
+        def tabela(pesos):
+            return [
+                sum(int(d) * p for d, p in zip(f"{bloco:04d}", pesos))
+                for bloco in range(10000)
+            ]
+        
+        self._dv1_alto, self._dv1_baixo = tabela(pesos_dv1[0:4]), tabela(pesos_dv1[4:8])
+        self._dv2_alto, self._dv2_baixo = tabela(pesos_dv2[0:4]), tabela(pesos_dv2[4:8])
+        self._dv1_filial = sum(int(d) * p for d, p in zip(self.FILIAL, pesos_dv1[8:12]))
+        self._dv2_filial = sum(int(d) * p for d, p in zip(self.FILIAL, pesos_dv2[8:12]))
+    
+    def cnpj_from_index(self, indice: int) -> str:
+        """
+        Retorna o CNPJ válido (com dígitos verificadores) associado a um índice
+        
+        Índices distintos em [0, ESPACO_RAIZES) geram CNPJs distintos.
+        
+        Args:
+            indice: Índice do estabelecimento
+        
+        Returns:
+            CNPJ com 14 dígitos
+        """
+        raiz = (self.multiplicador_cnpj * indice + self.deslocamento_cnpj) % self.ESPACO_RAIZES
+        alto, baixo = divmod(raiz, 10000)
+        
+        resto = (self._dv1_alto[alto] + self._dv1_baixo[baixo] + self._dv1_filial) % 11
+        dv1 = 0 if resto < 2 else 11 - resto
+        resto = (self._dv2_alto[alto] + self._dv2_baixo[baixo] + self._dv2_filial + 2 * dv1) % 11
+        dv2 = 0 if resto < 2 else 11 - resto
+        
+        return f"{raiz:08d}{self.FILIAL}{dv1}{dv2}"
+    
     def generate_random_cnpj(self) -> str:
-        """Gera um CNPJ fictício (não válido)"""
-        return f"{random.randint(10000000, 99999999)}{random.randint(1000, 9999)}{random.randint(10, 99)}"
+        """Gera um CNPJ válido aleatório (sem garantia de unicidade)"""
+        return self.cnpj_from_index(random.randrange(self.ESPACO_RAIZES))
+    
+    def load_state(self, file_path: str):
+        """
+        Carrega o estado dos estabelecimentos salvo por save_state
+        
+        O arquivo tem uma linha JSON com a semente da permutação de CNPJs e a
+        quantidade de estabelecimentos criados, seguida dos índices dos ativos
+        (4 bytes cada, little-endian). O estado só vale para a mesma permutação:
+        com outra semente, os índices salvos corresponderiam a outros CNPJs.
+        """
+        with open(file_path, 'rb') as f:
+            cabecalho = json.loads(f.readline().decode('utf-8'))
+            if cabecalho['semente_cnpj'] != self.semente_cnpj:
+                raise ValueError(
+                    f"{file_path}: estado gerado com semente_cnpj {cabecalho['semente_cnpj']}, "
+                    f"diferente da configurada ({self.semente_cnpj})"
+                )
+            self.ativos = array('I', f.read())
+        if sys.byteorder != 'little':
+            self.ativos.byteswap()
+        self.total_cnpjs_criados = cabecalho['total_cnpjs_criados']
+    
+    def save_state(self, file_path: str):
+        """Salva o estado dos estabelecimentos (escrita em arquivo temporário + rename)"""
+        tmp_path = f"{file_path}.{os.getpid()}.tmp"
+        cabecalho = {
+            'semente_cnpj': self.semente_cnpj,
+            'total_cnpjs_criados': self.total_cnpjs_criados,
+        }
+        ativos = self.ativos
+        if sys.byteorder != 'little':
+            ativos = array('I', ativos)
+            ativos.byteswap()
+        with open(tmp_path, 'wb') as f:
+            f.write(json.dumps(cabecalho).encode('utf-8') + b'\n')
+            f.write(ativos.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+    
+    def choose_active_position(self) -> int:
+        """
+        Sorteia um estabelecimento ativo, com a mesma chance para todos
+        
+        Returns:
+            Posição do estabelecimento em ativos (requer ao menos um ativo)
+        """
+        return random.randrange(len(self.ativos))
     
     def generate_random_record(self, referencia_externa: str) -> Dict:
         """
         Gera um registro aleatório baseado na configuração
         
+        Apenas transições válidas são emitidas: C cria um novo estabelecimento (CNPJ
+        inédito), A atualiza e I inativa um estabelecimento ativo. Inativados não
+        recebem novas operações. Na criação e na inativação, os nomes são os do
+        índice do estabelecimento; na atualização, novos nomes são sorteados.
+        
         Args:
             referencia_externa: Referência externa do registro
         
         Returns:
             Dicionário com os dados do estabelecimento comercial
         """
-        # Tipo de operação (C = Criar, A = Atualizar, I = Inativar)
-        tipo_operacao = random.choice(['C', 'A', 'I'])
+        # Tipo de operação (C = Criar, A = Atualizar, I = Inativar); sem estabelecimentos ativos, apenas C
+        if not self.ativos:
+            tipo_operacao = 'C'
+        else:
+            tipo_operacao = random.choices(self.tipos_operacao, cum_weights=self.pesos_operacao)[0]
         
-        # CNPJ fictício do estabelecimento
-        cnpj_ec = self.generate_random_cnpj()
+        if tipo_operacao == 'C':
+            if self.total_cnpjs_criados >= self.ESPACO_RAIZES:
+                raise ValueError("Todas as raízes de CNPJ disponíveis já foram criadas")
+            indice = self.total_cnpjs_criados
+            self.ativos.append(indice)
+            self.total_cnpjs_criados += 1
+        else:
+            posicao = self.choose_active_position()
+            indice = self.ativos[posicao]
+            if tipo_operacao == 'I':
+                # Remoção em O(1): o último ativo ocupa a posição do inativado
+                ultimo = self.ativos.pop()
+                if posicao < len(self.ativos):
+                    self.ativos[posicao] = ultimo
         
-        # Razão social fictícia
-        razoes_sociais = [
-            "Empresa Teste Ltda",
-            "Comercio Exemplo ME",
-            "Servicos Demonstrativos EIRELI",
-            "Negocios Ficticios SA",
-            "Estabelecimento Modelo Ltda"
-        ]
-        razao_social = random.choice(razoes_sociais)
-        
-        # Nome fantasia fictício
-        nomes_fantasia = [
-            "Loja Teste",
-            "Comercio Exemplo",
-            "Servicos Demo",
-            "Negocios Modelo",
-            "Estabelecimento Teste"
-        ]
-        nome_fantasia = random.choice(nomes_fantasia)
+        if tipo_operacao == 'A':
+            razao_social, nome_fantasia = self.sintetizador_nomes.random_names()
+        else:
+            razao_social, nome_fantasia = self.sintetizador_nomes.names_for(indice)
         
         return {
             'tipo_operacao': tipo_operacao,
             'referencia_externa': referencia_externa,
-            'cnpj': cnpj_ec,
+            'cnpj': self.cnpj_from_index(indice),
             'razao_social': razao_social,
             'nome_fantasia': nome_fantasia,
         }
@@ -128,7 +337,8 @@ class AP001Generator:
         ]
     
     def generate_file(self, num_records: int, output_path: Optional[str] = None, 
-                     date: Optional[datetime] = None, output_dir: str = "ap001_output") -> str:
+                     date: Optional[datetime] = None, output_dir: str = "ap001_output",
+                     tamanho_estimado: Optional[int] = None) -> str:
         """
         Gera o arquivo AP001 com registros aleatórios
         
@@ -137,65 +347,109 @@ class AP001Generator:
             output_path: Caminho de saída (opcional, gera automaticamente se não informado)
             date: Data de referência (padrão: data atual)
             output_dir: Diretório de saída (padrão: ap001_output)
+            tamanho_estimado: Tamanho estimado em bytes para pré-alocação do arquivo (opcional)
         
         Returns:
             Caminho do arquivo gerado
         """
         if output_path is None:
             output_path = self.generate_filename(date, output_dir)
+        if not self._is_stream_output(output_path):
+            Path(output_path).parent.mkdir(parents=True, exist_ok=True)
         
         if date is None:
             date = datetime.now()
         
-        records = []
-        for i in range(num_records):
-            referencia_externa = f"REF_{i+1:06d}"
-            record = self.generate_random_record(referencia_externa)
-            records.append(record)
-        
-        with open(output_path, 'w', newline='', encoding='utf-8') as csvfile:
+        # Escreve em arquivo temporário e renomeia ao final (escrita atômica)
+        with self._open_output_atomic(output_path, tamanho_estimado) as csvfile:
             # Usa ponto e vírgula como delimitador conforme especificação CERC
             writer = csv.writer(csvfile, delimiter=';', quoting=csv.QUOTE_MINIMAL)
             
-            # Escreve os registros
-            for record in records:
-                row = self.generate_row(record)
-                writer.writerow(row)
+            # Registros gerados e escritos sob demanda (sem materializar o arquivo em memória)
+            for i in range(num_records):
+                record = self.generate_random_record(f"REF_{i+1:06d}")
+                writer.writerow(self.generate_row(record))
+        
+        # Persiste o estado junto com cada arquivo gerado
+        if self.arquivo_estado:
+            self.save_state(self.arquivo_estado)
         
         return output_path
+    
+    def generate_daily_files(self, num_records: int, num_dias: int, date: Optional[datetime] = None,
+                             output_dir: str = "ap001_output") -> List[str]:
+        """
+        Gera uma sequência de arquivos diários consistentes entre si
+        
+        O estado dos estabelecimentos passa de um dia para o outro, de modo que
+        atualizações e inativações de um dia referenciam estabelecimentos criados
+        (e ainda ativos) em qualquer dia anterior.
+        
+        Args:
+            num_records: Número de registros por arquivo
+            num_dias: Quantidade de dias (arquivos)
+            date: Data do primeiro arquivo (padrão: data atual)
+            output_dir: Diretório de saída (padrão: ap001_output)
+        
+        Returns:
+            Caminhos dos arquivos gerados, em ordem
+        """
+        if date is None:
+            date = datetime.now()
+        
+        arquivos = []
+        for dia in range(num_dias):
+            arquivos.append(self.generate_file(num_records, date=date + timedelta(days=dia), output_dir=output_dir))
+        return arquivos
 
 
 def main():
     """Função principal"""
-    import sys
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Gera arquivo AP001 da CERC")
+    parser.add_argument('quantidade_registros', nargs='?', type=int,
+                        help="Quantidade de registros por arquivo (padrão: valor do JSON ou 10)")
+    parser.add_argument('--dias', type=int, default=1,
+                        help="Quantidade de arquivos diários consecutivos (padrão: 1)")
+    parser.add_argument('--output',
+                        help="Caminho de saída; '-' para stdout ou um pipe nomeado (padrão: ap001_output/<nome CERC>)")
+    args = parser.parse_args()
+    if args.output is not None and args.dias != 1:
+        parser.error("--output só pode ser usado com --dias 1")
     
     try:
         # Inicializa o gerador com configuração
         generator = AP001Generator("generate_ap001.json")
         
         # Número de registros a gerar (prioridade: linha de comando > config > padrão 10)
-        if len(sys.argv) > 1:
-            num_records = int(sys.argv[1])
+        if args.quantidade_registros is not None:
+            num_records = args.quantidade_registros
         else:
             num_records = generator.config.get('quantidade_registros', 10)
         
-        # Gera o arquivo
-        output_file = generator.generate_file(num_records)
+        # Gera os arquivos (um por dia)
+        if args.output is None:
+            output_files = generator.generate_daily_files(num_records, args.dias)
+        else:
+            output_files = [generator.generate_file(num_records, output_path=args.output)]
         
-        print(f"Arquivo AP001 gerado com sucesso: {output_file}")
-        print(f"Total de registros: {num_records}")
-        print(f"CNPJ Credenciadora: {generator.cnpj_credenciadora}")
+        for output_file in output_files:
+            print(f"Arquivo AP001 gerado com sucesso: {output_file}", file=sys.stderr)
+        print(f"Total de registros: {num_records * len(output_files)}", file=sys.stderr)
+        print(f"CNPJ Credenciadora: {generator.cnpj_credenciadora}", file=sys.stderr)
+        print(f"Estabelecimentos criados: {generator.total_cnpjs_criados} (ativos: {len(generator.ativos)})", file=sys.stderr)
         
     except FileNotFoundError as e:
-        print(f"Erro: Arquivo não encontrado - {e}")
-        print("Certifique-se de que o arquivo de configuração existe:")
-        print("  - generate_ap001.json")
+        print(f"Erro: Arquivo não encontrado - {e}", file=sys.stderr)
+        print("Certifique-se de que os arquivos de configuração existem:", file=sys.stderr)
+        print("  - generate_ap001.json", file=sys.stderr)
+        print("  - vocabulario_nomes.csv", file=sys.stderr)
     except Exception as e:
-        print(f"Erro ao gerar arquivo: {e}")
+        print(f"Erro ao gerar arquivo: {e}", file=sys.stderr)
         import traceback
         traceback.print_exc()
 
 
 if __name__ == "__main__":
     main()
-
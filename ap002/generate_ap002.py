@@ -7,15 +7,202 @@ INFORMAÇÕES DAS TRANSAÇÕES DAS UNIDADES DE RECEBÍVEIS
 
 import csv
 import json
+import math
+import os
 import random
+import sys
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+from decimal import Decimal
+from typing import Iterator, List, Dict, Optional, Tuple
 from pathlib import Path
 
+# Módulos compartilhados entre os geradores (pasta common/ na raiz do repositório)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from common.continuous import ContinuousModeMixin, print_continuous_report
+from common.output import OutputFileMixin, ShardedFileMixin
+from common.parquet import ParquetSink
+from common.payments import PaymentCentsMixin
+from common.pools import FixedWidthPool, FixedWidthRecordPool
+from common.profiles import ProfileSchedulerMixin
+from common.sampling import WeightedPoolMixin
+from common.settings import ConfigValidators
 
-class AP002Generator:
+
+class ReplayBuffer:
+    """
+    Amostra por reservatório das linhas já emitidas, para reenvio (replay)
+    
+    Mantém no máximo capacidade linhas, cada linha emitida tendo a mesma chance
+    de estar na amostra, independente do tamanho do fluxo. Usa o Algoritmo L:
+    em vez de um sorteio por linha, sorteia quantas linhas pular até a próxima
+    substituição, então o custo por linha não amostrada é uma comparação.
+    
+    O estado pode ser salvo e recarregado para reenviar linhas de arquivos anteriores,
+    inclusive com outra capacidade: reduzida, a amostra salva é subamostrada de forma
+    uniforme; aumentada, a amostra volta a receber todas as linhas até completar a
+    nova capacidade (as vagas novas ficam com linhas mais recentes).
+    """
+    
+    def __init__(self, capacidade: int):
+        """
+        Args:
+            capacidade: Máximo de linhas mantidas em memória
+        """
+        if capacidade < 1:
+            raise ValueError("replay: capacidade deve ser maior ou igual a 1")
+        self.capacidade = capacidade
+        self.linhas = []
+        self.vistas = 0
+        self.peso = 0.0
+        self.proxima = 0
+    
+    def _start(self):
+        """
+        Sorteia o peso da amostra recém-completada e agenda a próxima substituição
+        
+        O peso é o capacidade-ésimo menor de vistas uniformes (distribuição Beta);
+        com vistas == capacidade, é o sorteio inicial do Algoritmo L.
+        """
+        self.peso = random.betavariate(self.capacidade, self.vistas - self.capacidade + 1)
+        self._schedule(self.vistas - 1)
+    
+    def _schedule(self, posicao: int):
+        """Sorteia a posição da próxima linha a entrar na amostra, após posicao"""
+        salto = int(math.log(1.0 - random.random()) / math.log(1.0 - self.peso)) if self.peso < 1.0 else 0
+        self.proxima = posicao + salto + 1
+    
+    def offer(self, row: List[str]):
+        """Registra uma linha emitida (a lista não deve ser alterada depois)"""
+        posicao = self.vistas
+        self.vistas += 1
+        if len(self.linhas) < self.capacidade:
+            self.linhas.append(row)
+            if len(self.linhas) == self.capacidade:
+                self._start()
+        elif posicao == self.proxima:
+            self.linhas[random.randrange(self.capacidade)] = row
+            self.peso *= math.exp(math.log(1.0 - random.random()) / self.capacidade)
+            self._schedule(posicao)
+    
+    def choose(self) -> Optional[List[str]]:
+        """Sorteia uma linha da amostra (None se nenhuma linha foi emitida)"""
+        if not self.linhas:
+            return None
+        return random.choice(self.linhas)
+    
+    def load(self, file_path: str):
+        """
+        Carrega o estado salvo por save
+        
+        O arquivo tem uma linha JSON com o estado do reservatório, seguida das
+        linhas da amostra no leiaute do arquivo (separadas por ponto e vírgula).
+        """
+        with open(file_path, 'r', newline='', encoding='utf-8') as f:
+            cabecalho = json.loads(f.readline())
+            linhas = list(csv.reader(f, delimiter=';'))
+        self.vistas = cabecalho['vistas']
+        if len(linhas) < self.capacidade:
+            # Amostra incompleta ou capacidade aumentada desde o último salvamento:
+            # as próximas linhas entram até completar a capacidade (ver offer)
+            self.linhas = linhas
+            self.peso = 0.0
+            self.proxima = 0
+        elif len(linhas) > self.capacidade or cabecalho['peso'] == 0.0:
+            # Capacidade reduzida desde o último salvamento: uma subamostra uniforme
+            # da amostra salva continua uniforme sobre as linhas já emitidas
+            self.linhas = random.sample(linhas, self.capacidade)
+            self._start()
+        else:
+            self.linhas = linhas
+            self.peso = cabecalho['peso']
+            self.proxima = cabecalho['proxima']
+    
+    def save(self, file_path: str):
+        """Salva o estado do reservatório (escrita em arquivo temporário + rename)"""
+        tmp_path = f"{file_path}.{os.getpid()}.tmp"
+        cabecalho = {'vistas': self.vistas, 'peso': self.peso, 'proxima': self.proxima}
+        with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+            f.write(json.dumps(cabecalho) + '\n')
+            csv.writer(f, delimiter=';', quoting=csv.QUOTE_MINIMAL).writerows(self.linhas)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+
+
+@dataclass(frozen=True)
+class AP002Settings(ConfigValidators):
+    """
+    Configuração do AP002 compilada uma única vez, validada e imutável
+    
+    Os valores usados a cada linha ficam prontos (arranjos em tupla, valor máximo
+    em centavos, prazo de liquidação como timedelta), fora do dicionário do JSON.
+    Uma configuração inválida falha na inicialização, antes de qualquer escrita,
+    listando todos os problemas encontrados.
+    """
+    
+    cnpj_credenciadora: str
+    cnpj_participante: str
+    arquivo_cnpjs_ec: str
+    arquivo_contas: str
+    arranjos_pagamento: Tuple[str, ...]
+    dias_futuros_liquidacao: int
+    prazo_liquidacao: timedelta
+    valor_maximo_centavos: int
+    carteira_padrao: str
+    
+    @classmethod
+    def from_config(cls, config: Dict) -> 'AP002Settings':
+        """
+        Valida a configuração e pré-calcula os valores derivados
+        
+        Raises:
+            ValueError: Configuração inválida (todos os problemas na mensagem)
+        """
+        erros = []
+        dias_futuros = cls._inteiro(config, 'dias_futuros_liquidacao', erros, 0)
+        settings = cls(
+            cnpj_credenciadora=cls._cnpj(config, 'cnpj_credenciadora', erros),
+            cnpj_participante=cls._cnpj(config, 'cnpj_participante', erros),
+            arquivo_cnpjs_ec=cls._texto(config, 'arquivo_cnpjs_ec', erros),
+            arquivo_contas=cls._texto(config, 'arquivo_contas', erros),
+            arranjos_pagamento=cls._arranjos(config, erros),
+            dias_futuros_liquidacao=dias_futuros,
+            prazo_liquidacao=timedelta(days=dias_futuros),
+            # Valores sorteados entre 100,00 e o máximo
+            valor_maximo_centavos=int(round(cls._valor(config, 'valor_maximo_transacao', erros, 100.0) * 100)),
+            carteira_padrao=cls._texto(config, 'carteira_padrao', erros, 'Carteira1'),
+        )
+        cls._raise_if_invalid(erros)
+        return settings
+
+
+class AP002Generator(OutputFileMixin, ShardedFileMixin, WeightedPoolMixin, PaymentCentsMixin,
+                     ContinuousModeMixin, ProfileSchedulerMixin):
     """Gerador de arquivos AP002 da CERC"""
     
+    # Campos que um perfil (tenant) pode sobrepor à configuração base
+    CAMPOS_PERFIL = ('cnpj_credenciadora', 'cnpj_participante', 'carteira_padrao', 'quantidade_registros')
+    CLASSE_SETTINGS = AP002Settings
+    
+    # Subcampos 1-11 de cada informação de pagamento do campo 15
+    CAMPOS_PAGAMENTO = (
+        'numero_documento_titular', 'tipo_conta', 'compe', 'ispb', 'agencia', 'numero_conta',
+        'valor_a_pagar', 'beneficiario', 'data_liquidacao_efetiva', 'valor_liquidacao_efetiva',
+        'motivo_nao_pagamento',
+    )
+    
+    # Colunas do Parquet, na ordem dos campos 1-16 da linha
+    COLUNAS_LINHA = (
+        'tipo_operacao', 'referencia_externa', 'cnpj_credenciadora', 'cnpj_participante',
+        'usuario_final_recebedor', 'arranjo_pagamento', 'data_liquidacao', 'titular',
+        'valor_constituido_total', 'valor_bloqueado', 'valor_livre', 'valor_onerado',
+        'valor_disponivel', 'valor_transacao', 'pagamentos', 'carteira',
+    )
+    
+    # Linhas sorteadas por lote no modo padrão (valores e divisão dos pagamentos)
+    TAMANHO_LOTE_REGISTROS = 4096
+    
     def __init__(self, config_path: str = "generate_ap002.json"):
         """
         Inicializa o gerador com configuração do arquivo JSON
@@ -24,21 +211,96 @@ class AP002Generator:
             config_path: Caminho para o arquivo JSON de configuração
         """
         self.config = self._load_config(config_path)
-        self.cnpj_credenciadora = self.config['cnpj_credenciadora']
-        self.cnpj_participante = self.config['cnpj_participante']
+        self.settings = AP002Settings.from_config(self.config)
+        self.cnpj_credenciadora = self.settings.cnpj_credenciadora
+        self.cnpj_participante = self.settings.cnpj_participante
         self.cnpj_raiz = self.cnpj_credenciadora[:8]
         self.sequence = 1
         self.tipo_leiaute = "CERC-AP002"
         
         # Carrega listas de dados
-        self.cnpjs_ec = self._load_cnpjs_ec(self.config['arquivo_cnpjs_ec'])
-        self.contas_bancarias = self._load_contas_bancarias(self.config['arquivo_contas'])
+        self.cnpjs_ec = self._load_cnpjs_ec(self.settings.arquivo_cnpjs_ec)
+        self.contas_bancarias = self._load_contas_bancarias(self.settings.arquivo_contas)
+        
+        # Pools em memória compartilhada, lidos sem cópia pelos processos dos perfis
+        # (padrão: ativado quando há perfis configurados)
+        self.memoria_compartilhada = bool(self.config.get('memoria_compartilhada', bool(self.config.get('perfis'))))
+        if self.memoria_compartilhada:
+            self.cnpjs_ec = FixedWidthPool(self.cnpjs_ec)
+            self.contas_bancarias = FixedWidthRecordPool(self.contas_bancarias)
         
         # Validações
         if not self.cnpjs_ec:
-            raise ValueError(f"Nenhum CNPJ de EC encontrado em {self.config['arquivo_cnpjs_ec']}")
+            raise ValueError(f"Nenhum CNPJ de EC encontrado em {self.settings.arquivo_cnpjs_ec}")
         if not self.contas_bancarias:
-            raise ValueError(f"Nenhuma conta bancária encontrada em {self.config['arquivo_contas']}")
+            raise ValueError(f"Nenhuma conta bancária encontrada em {self.settings.arquivo_contas}")
+        
+        # Amostradores ponderados (None = seleção uniforme)
+        self.amostrador_ec = self._build_sampler(
+            self.config.get('distribuicao_cnpjs_ec'), len(self.cnpjs_ec),
+            self.settings.arquivo_cnpjs_ec, chave='cnpj'
+        )
+        self.amostrador_contas = self._build_sampler(
+            self.config.get('distribuicao_contas'), len(self.contas_bancarias),
+            self.settings.arquivo_contas
+        )
+        
+        # Divisão do valor entre as informações de pagamento do campo 15
+        divisao = self.config.get('divisao_pagamentos') or {}
+        self.tipo_divisao = divisao.get('tipo', 'igual')
+        self.concentracao_divisao = float(divisao.get('concentracao', 1.0))
+        if self.tipo_divisao not in ('igual', 'dirichlet') or self.concentracao_divisao <= 0:
+            raise ValueError("divisao_pagamentos: tipo deve ser 'igual' ou 'dirichlet' e concentracao > 0")
+        
+        # Cache de prefixos do leiaute AP002 (campo 15, subcampos 1-11): prefixo (1-6) de
+        # cada conta, indexado pela posição em contas_bancarias, e sufixo (8-11) comum
+        self.prefixos_pagamento, self.sufixo_pagamento = self._render_pagamento_prefixos()
+        if self.memoria_compartilhada:
+            self.prefixos_pagamento = FixedWidthPool(self.prefixos_pagamento)
+        
+        # Quantidade de registros do último arquivo gerado
+        self.total_registros = 0
+        
+        # Perfis (tenants) gerados por generate_profiles
+        self.perfis = self._load_perfis(self.config.get('perfis'))
+        
+        # Reenvio de linhas já emitidas (None = sem replay)
+        replay = self.config.get('replay')
+        self.replay = None
+        self.total_reenviados = 0
+        
+        # Referências externas já usadas por linhas novas (neste processo ou, com o
+        # estado do replay, em execuções anteriores); o próximo arquivo continua daqui
+        self.referencias_emitidas = 0
+        if replay:
+            self.fracao_replay = float(replay.get('fracao', 0.0))
+            self.fracao_alteracao_replay = float(replay.get('fracao_alteracao', 0.0))
+            if not 0.0 <= self.fracao_replay < 1.0 or not 0.0 <= self.fracao_alteracao_replay <= 1.0:
+                raise ValueError("replay: fracao deve estar em [0, 1) e fracao_alteracao em [0, 1]")
+            self.replay = ReplayBuffer(int(replay.get('capacidade', 100000)))
+            arquivo_estado = replay.get('arquivo_estado')
+            if arquivo_estado and os.path.exists(arquivo_estado):
+                self.replay.load(arquivo_estado)
+                self.referencias_emitidas = self.replay.vistas
+    
+    def _setup_profile(self, gerador: 'AP002Generator'):
+        """Ajusta o CNPJ do participante, os contadores e o replay do gerador de um perfil"""
+        gerador.cnpj_participante = gerador.settings.cnpj_participante
+        gerador.total_registros = 0
+        
+        # Replay próprio do perfil, com o estado salvo em um arquivo por raiz de CNPJ
+        gerador.total_reenviados = 0
+        gerador.referencias_emitidas = 0
+        if self.replay is not None:
+            gerador.replay = ReplayBuffer(self.replay.capacidade)
+            arquivo_estado = self.config['replay'].get('arquivo_estado')
+            if arquivo_estado:
+                estado = Path(arquivo_estado)
+                arquivo_estado = str(estado.with_name(f"{estado.stem}_{gerador.cnpj_raiz}{estado.suffix}"))
+                gerador.config['replay'] = {**self.config['replay'], 'arquivo_estado': arquivo_estado}
+                if os.path.exists(arquivo_estado):
+                    gerador.replay.load(arquivo_estado)
+                    gerador.referencias_emitidas = gerador.replay.vistas
     
     def _load_config(self, config_path: str) -> Dict:
         """Carrega configuração do arquivo JSON"""
@@ -82,9 +344,6 @@ class AP002Generator:
         date_str = date.strftime("%Y%m%d")
         seq_str = f"{self.sequence:07d}"
         
-        # Cria o diretório se não existir
-        Path(output_dir).mkdir(parents=True, exist_ok=True)
-        
         filename = f"{self.tipo_leiaute}_{self.cnpj_raiz}_{date_str}_{seq_str}.csv"
         return str(Path(output_dir) / filename)
     
@@ -104,6 +363,22 @@ class AP002Generator:
         """Formata valor decimal com número específico de casas decimais"""
         return f"{value:.{decimals}f}"
     
+    def format_pagamento_info(self, pagamento: Dict) -> List[str]:
+        """Formata os subcampos 1-11 de uma informação de pagamento do campo 15"""
+        return [
+            self.format_cpf(pagamento.get('numero_documento_titular', '12345678901')),
+            pagamento.get('tipo_conta', 'CC'),
+            pagamento.get('compe', '001').zfill(3) if pagamento.get('compe') else '',
+            pagamento.get('ispb', '12345678').zfill(8),
+            pagamento.get('agencia', '1234'),
+            pagamento.get('numero_conta', '123456-7'),
+            self.format_decimal(pagamento.get('valor_a_pagar', 0.0)),
+            pagamento.get('beneficiario', ''),
+            pagamento.get('data_liquidacao_efetiva', ''),
+            pagamento.get('valor_liquidacao_efetiva', ''),
+            pagamento.get('motivo_nao_pagamento', ''),
+        ]
+    
     def format_campo15_lista(self, data: Dict) -> str:
         """
         Formata o campo 15 como lista de Informações de Pagamento
@@ -111,72 +386,85 @@ class AP002Generator:
         
         Formato: "info1;info2;...;info11|info1';info2';...;info11'"
         """
-        pagamentos = data.get('pagamentos', [])
-        if not pagamentos:
-            # Se não houver pagamentos, cria um padrão
-            conta = random.choice(self.contas_bancarias)
-            pagamentos = [{
-                'numero_documento_titular': conta.get('numero_documento_titular', '12345678901'),
-                'tipo_conta': conta.get('tipo_conta', 'CC'),
-                'compe': conta.get('compe', '001'),
-                'ispb': conta.get('ispb', '12345678'),
-                'agencia': conta.get('agencia', '1234'),
-                'numero_conta': conta.get('numero_conta', '123456-7'),
-                'valor_a_pagar': data.get('valor_transacao', 0.0),
-                'beneficiario': '',
-                'data_liquidacao_efetiva': '',
-                'valor_liquidacao_efetiva': '',
-            }]
-        
-        # Formata cada informação de pagamento (subcampos 1-11)
-        pagamentos_formatados = []
-        for pagamento in pagamentos:
-            pagamento_info = [
-                self.format_cpf(pagamento.get('numero_documento_titular', '12345678901')),
-                pagamento.get('tipo_conta', 'CC'),
-                pagamento.get('compe', '001').zfill(3) if pagamento.get('compe') else '',
-                pagamento.get('ispb', '12345678').zfill(8),
-                pagamento.get('agencia', '1234'),
-                pagamento.get('numero_conta', '123456-7'),
-                self.format_decimal(pagamento.get('valor_a_pagar', 0.0)),
-                pagamento.get('beneficiario', ''),
-                pagamento.get('data_liquidacao_efetiva', ''),
-                pagamento.get('valor_liquidacao_efetiva', ''),
-                pagamento.get('motivo_nao_pagamento', ''),
-            ]
-            pagamentos_formatados.append(';'.join(pagamento_info))
+        contas = data.get('contas_pagamento')
+        valores = data.get('valores_pagamento')
+        if contas is None and not data.get('pagamentos'):
+            # Se não houver pagamentos, usa uma conta sorteada com o valor total
+            contas = self.choose_contas_indices(1)
+            valores = [self._to_cents(data.get('valor_transacao', 0.0))]
+        
+        if contas is not None:
+            # Apenas o valor é formatado por linha; o restante vem do cache de prefixos por conta
+            prefixos = self.prefixos_pagamento
+            sufixo = self.sufixo_pagamento
+            return '|'.join([prefixos[c] + self.format_cents(v) + sufixo for c, v in zip(contas, valores)])
+        
+        # Pagamentos informados como dicionários (subcampos 1-11)
+        pagamentos_formatados = [';'.join(self.format_pagamento_info(p)) for p in data['pagamentos']]
         
         # Junta todas as informações separadas por |
         campo15_completo = '|'.join(pagamentos_formatados)
         return campo15_completo
     
-    def generate_random_record(self, referencia_externa: str, num_pagamentos: int = None) -> Dict:
+    def build_pagamento(self, conta: Dict, valor_a_pagar: float) -> Dict:
+        """Monta uma informação de pagamento do campo 15 para a conta informada"""
+        return {
+            'numero_documento_titular': conta.get('numero_documento_titular', '12345678901'),
+            'tipo_conta': conta.get('tipo_conta', 'CC'),
+            'compe': conta.get('compe', '001'),
+            'ispb': conta.get('ispb', '12345678'),
+            'agencia': conta.get('agencia', '1234'),
+            'numero_conta': conta.get('numero_conta', '123456-7'),
+            'valor_a_pagar': valor_a_pagar,
+            'beneficiario': '',
+            'data_liquidacao_efetiva': '',
+            'valor_liquidacao_efetiva': '',
+            'motivo_nao_pagamento': '',
+        }
+    
+    def get_pagamentos(self, data: Dict) -> List[Dict]:
+        """Retorna as informações de pagamento do registro como dicionários"""
+        contas = data.get('contas_pagamento')
+        if contas is None:
+            return data.get('pagamentos', [])
+        return [
+            self.build_pagamento(self.contas_bancarias[c], v / 100)
+            for c, v in zip(contas, data['valores_pagamento'])
+        ]
+    
+    def generate_random_record(self, referencia_externa: str, num_pagamentos: int = None,
+                               valor_transacao_centavos: Optional[int] = None,
+                               valores_pagamento: Optional[List[int]] = None) -> Dict:
         """
         Gera um registro aleatório baseado na configuração
         
         Args:
             referencia_externa: Referência externa do registro
             num_pagamentos: Número de informações de pagamento (padrão: aleatório entre 1 e 3)
+            valor_transacao_centavos: Valor da transação em centavos (padrão: sorteado)
+            valores_pagamento: Valores de cada pagamento em centavos, já divididos
+                (padrão: divisão de valor_transacao_centavos conforme divisao_pagamentos)
         
         Returns:
             Dicionário com os dados da unidade de recebível
         """
         # Seleciona CNPJ de EC aleatório
-        cnpj_ec = random.choice(self.cnpjs_ec)
+        cnpj_ec = self.choose_cnpj_ec()
         
         # Número de pagamentos (padrão: 1 a 3)
         if num_pagamentos is None:
             num_pagamentos = random.randint(1, 3)
         
         # Seleciona contas bancárias aleatórias para pagamentos
-        contas_pagamento = random.sample(self.contas_bancarias, min(num_pagamentos, len(self.contas_bancarias)))
+        contas_pagamento = self.choose_contas_indices(num_pagamentos)
         
         # Calcula data de liquidação (data atual + dias futuros)
-        data_liquidacao = datetime.now() + timedelta(days=self.config['dias_futuros_liquidacao'])
+        data_liquidacao = datetime.now() + self.settings.prazo_liquidacao
         
         # Gera valores aleatórios
-        valor_maximo = self.config['valor_maximo_transacao']
-        valor_transacao = round(random.uniform(100.00, valor_maximo), 2)
+        if valor_transacao_centavos is None:
+            valor_transacao_centavos = random.randint(10000, self.settings.valor_maximo_centavos)
+        valor_transacao = valor_transacao_centavos / 100
         valor_constituido_total = round(valor_transacao * random.uniform(1.0, 1.5), 2)
         valor_bloqueado = round(random.uniform(0.0, valor_constituido_total * 0.3), 2)
         valor_livre = round(valor_constituido_total - valor_bloqueado, 2)
@@ -184,36 +472,14 @@ class AP002Generator:
         valor_disponivel = round(valor_livre - valor_onerado, 2)
         
         # Arranjo de pagamento aleatório
-        arranjo_pagamento = random.choice(self.config['arranjos_pagamento'])
+        arranjo_pagamento = random.choice(self.settings.arranjos_pagamento)
         
         # Tipo de operação (C = Criar, A = Atualizar)
         tipo_operacao = random.choice(['C', 'A'])
         
-        # Prepara lista de pagamentos
-        pagamentos = []
-        valor_restante = valor_transacao
-        for i, conta in enumerate(contas_pagamento):
-            if i == len(contas_pagamento) - 1:
-                # Último pagamento recebe o valor restante
-                valor_pagamento = valor_restante
-            else:
-                # Divide o valor entre os pagamentos
-                valor_pagamento = round(valor_restante / (len(contas_pagamento) - i), 2)
-                valor_restante -= valor_pagamento
-            
-            pagamentos.append({
-                'numero_documento_titular': conta.get('numero_documento_titular', '12345678901'),
-                'tipo_conta': conta.get('tipo_conta', 'CC'),
-                'compe': conta.get('compe', '001'),
-                'ispb': conta.get('ispb', '12345678'),
-                'agencia': conta.get('agencia', '1234'),
-                'numero_conta': conta.get('numero_conta', '123456-7'),
-                'valor_a_pagar': valor_pagamento,
-                'beneficiario': '',
-                'data_liquidacao_efetiva': '',
-                'valor_liquidacao_efetiva': '',
-                'motivo_nao_pagamento': '',
-            })
+        # Divide o valor da transação entre os pagamentos, em centavos exatos
+        if valores_pagamento is None or len(valores_pagamento) != len(contas_pagamento):
+            valores_pagamento = self.split_cents_batch([valor_transacao_centavos], [len(contas_pagamento)])[0]
         
         return {
             'tipo_operacao': tipo_operacao,
@@ -230,8 +496,9 @@ class AP002Generator:
             'valor_onerado': valor_onerado,
             'valor_disponivel': valor_disponivel,
             'valor_transacao': valor_transacao,
-            'carteira': self.config.get('carteira_padrao', 'Carteira1'),
-            'pagamentos': pagamentos,
+            'carteira': self.settings.carteira_padrao,
+            'contas_pagamento': contas_pagamento,
+            'valores_pagamento': valores_pagamento,
         }
     
     def generate_row(self, data: Dict) -> List[str]:
@@ -266,80 +533,436 @@ class AP002Generator:
         campo15 = self.format_campo15_lista(data)
         
         # Campo 16 (carteira)
-        campo16 = data.get('carteira', self.config.get('carteira_padrao', 'Carteira1'))
+        campo16 = data.get('carteira', self.settings.carteira_padrao)
         
         return campos_base + [campo15, campo16]
     
+    def _parquet_schema(self, pa):
+        """Schema Parquet do AP002, com o campo 15 como list<struct>"""
+        valor = pa.decimal128(18, 2)
+        pagamento = pa.struct([
+            (nome, valor if nome == 'valor_a_pagar' else pa.string())
+            for nome in self.CAMPOS_PAGAMENTO
+        ])
+        return pa.schema([
+            ('tipo_operacao', pa.string()),
+            ('referencia_externa', pa.string()),
+            ('cnpj_credenciadora', pa.string()),
+            ('cnpj_participante', pa.string()),
+            ('usuario_final_recebedor', pa.string()),
+            ('arranjo_pagamento', pa.string()),
+            ('data_liquidacao', pa.date32()),
+            ('titular', pa.string()),
+            ('valor_constituido_total', valor),
+            ('valor_bloqueado', valor),
+            ('valor_livre', valor),
+            ('valor_onerado', valor),
+            ('valor_disponivel', valor),
+            ('valor_transacao', valor),
+            ('pagamentos', pa.list_(pagamento)),
+            ('carteira', pa.string()),
+        ])
+    
+    def generate_parquet_record(self, data: Dict) -> Dict:
+        """
+        Converte um registro para a representação colunar do Parquet
+        
+        Os valores são os mesmos escritos no CSV (CNPJs/CPFs formatados, valores com
+        2 casas decimais), porém tipados: datas como date32 e valores como decimal.
+        
+        Args:
+            data: Dicionário com os dados da unidade de recebível
+        
+        Returns:
+            Dicionário coluna -> valor
+        """
+        pagamentos = []
+        for pagamento in self.get_pagamentos(data):
+            info = dict(zip(self.CAMPOS_PAGAMENTO, self.format_pagamento_info(pagamento)))
+            info['valor_a_pagar'] = Decimal(info['valor_a_pagar'])
+            pagamentos.append(info)
+        
+        return {
+            'tipo_operacao': data.get('tipo_operacao', 'C'),
+            'referencia_externa': data.get('referencia_externa', ''),
+            'cnpj_credenciadora': self.format_cnpj(data.get('cnpj_credenciadora', '')),
+            'cnpj_participante': self.format_cnpj(data.get('cnpj_participante', '')),
+            'usuario_final_recebedor': self.format_cpf(data.get('usuario_final_recebedor', '')),
+            'arranjo_pagamento': data.get('arranjo_pagamento', ''),
+            'data_liquidacao': data.get('data_liquidacao', datetime.now()).date(),
+            'titular': self.format_cpf(data.get('titular', '')),
+            'valor_constituido_total': Decimal(self.format_decimal(data.get('valor_constituido_total', 0.0))),
+            'valor_bloqueado': Decimal(self.format_decimal(data.get('valor_bloqueado', 0.0))),
+            'valor_livre': Decimal(self.format_decimal(data.get('valor_livre', 0.0))),
+            'valor_onerado': Decimal(self.format_decimal(data.get('valor_onerado', 0.0))),
+            'valor_disponivel': Decimal(self.format_decimal(data.get('valor_disponivel', 0.0))),
+            'valor_transacao': Decimal(self.format_decimal(data.get('valor_transacao', 0.0))),
+            'pagamentos': pagamentos,
+            'carteira': data.get('carteira', self.settings.carteira_padrao),
+        }
+    
+    def parquet_record_from_row(self, row: List[str]) -> Dict:
+        """
+        Converte uma linha já formatada para a representação colunar do Parquet
+        
+        Usada pelas linhas reenviadas (replay), que existem apenas como linha do CSV.
+        """
+        pagamentos = []
+        for pagamento in row[14].split('|'):
+            info = dict(zip(self.CAMPOS_PAGAMENTO, pagamento.split(';')))
+            info['valor_a_pagar'] = Decimal(info['valor_a_pagar'])
+            pagamentos.append(info)
+        
+        registro = dict(zip(self.COLUNAS_LINHA, row))
+        registro['data_liquidacao'] = datetime.strptime(row[6], "%Y-%m-%d").date()
+        for nome in ('valor_constituido_total', 'valor_bloqueado', 'valor_livre',
+                     'valor_onerado', 'valor_disponivel', 'valor_transacao'):
+            registro[nome] = Decimal(registro[nome])
+        registro['pagamentos'] = pagamentos
+        return registro
+    
+    def _replay_gap(self) -> int:
+        """Sorteia quantas linhas novas emitir até o próximo reenvio (geométrica de parâmetro fracao)"""
+        if self.fracao_replay <= 0.0:
+            return -1
+        return int(math.log(1.0 - random.random()) / math.log(1.0 - self.fracao_replay))
+    
+    def replay_row(self) -> Optional[List[str]]:
+        """
+        Sorteia uma linha já emitida para reenvio
+        
+        A linha mantém a referencia_externa original; com probabilidade
+        fracao_alteracao, tipo_operacao passa a ser A (atualização).
+        """
+        row = self.replay.choose()
+        if row is None:
+            return None
+        if row[0] != 'A' and random.random() < self.fracao_alteracao_replay:
+            row = ['A'] + row[1:]
+        return row
+    
+    def build_aggregated_record(self, referencia_externa: str, cnpj_ec: str, arranjo_pagamento: str,
+                                data_liquidacao: datetime, total_centavos: int) -> Dict:
+        """
+        Monta uma UR a partir do total agregado das suas transações
+        
+        Todos os valores são calculados em centavos inteiros; a conversão para reais
+        acontece apenas no dicionário de saída, e a formatação com 2 casas decimais
+        reproduz exatamente os centavos calculados.
+        
+        Args:
+            referencia_externa: Referência externa do registro
+            cnpj_ec: Usuário final recebedor / titular da UR
+            arranjo_pagamento: Arranjo de pagamento da UR
+            data_liquidacao: Data de liquidação da UR
+            total_centavos: Soma das transações da UR, em centavos
+        
+        Returns:
+            Dicionário com os dados da unidade de recebível
+        """
+        bloqueado = random.randint(0, total_centavos * 3 // 10)
+        livre = total_centavos - bloqueado
+        onerado = random.randint(0, livre * 8 // 10)
+        disponivel = livre - onerado
+        
+        # Pagamentos somam exatamente o total da UR
+        contas_pagamento = self.choose_contas_indices(random.randint(1, 3))
+        valores_pagamento = self.split_cents_batch([total_centavos], [len(contas_pagamento)])[0]
+        
+        return {
+            'tipo_operacao': 'C',
+            'referencia_externa': referencia_externa,
+            'cnpj_credenciadora': self.cnpj_credenciadora,
+            'cnpj_participante': self.cnpj_participante,
+            'usuario_final_recebedor': cnpj_ec,
+            'arranjo_pagamento': arranjo_pagamento,
+            'data_liquidacao': data_liquidacao,
+            'titular': cnpj_ec,
+            'valor_constituido_total': total_centavos / 100,
+            'valor_bloqueado': bloqueado / 100,
+            'valor_livre': livre / 100,
+            'valor_onerado': onerado / 100,
+            'valor_disponivel': disponivel / 100,
+            'valor_transacao': total_centavos / 100,
+            'carteira': self.settings.carteira_padrao,
+            'contas_pagamento': contas_pagamento,
+            'valores_pagamento': valores_pagamento,
+        }
+    
+    def iter_aggregated_records(self, num_transacoes: int, date: datetime,
+                                inicio_referencia: int = 0) -> Iterator[Dict]:
+        """
+        Gera transações individuais e as agrega em URs por
+        (usuario_final_recebedor, arranjo, data_liquidacao)
+        
+        As transações são distribuídas em dias_captura dias a partir de date, e cada
+        uma liquida em captura + um prazo sorteado de prazos_liquidacao. O acumulador
+        guarda apenas as URs abertas, agrupadas por dia de liquidação: ao fim de cada
+        dia de captura, as URs cuja data de liquidação não pode mais receber
+        transações são emitidas e descartadas da memória.
+        
+        Args:
+            num_transacoes: Quantidade total de transações
+            date: Data de referência (primeiro dia de captura)
+            inicio_referencia: Referências já usadas (as URs são numeradas a partir de inicio_referencia + 1)
+        """
+        modo = self.config['modo_agregacao']
+        dias_captura = int(modo.get('dias_captura', 1))
+        prazos = [int(p) for p in modo.get('prazos_liquidacao', [self.settings.dias_futuros_liquidacao])]
+        if dias_captura < 1 or not prazos or min(prazos) < 0:
+            raise ValueError("modo_agregacao: dias_captura deve ser >= 1 e prazos_liquidacao não negativos")
+        valor_minimo = self._to_cents(modo.get('valor_minimo_transacao', 1.00))
+        valor_maximo = self.settings.valor_maximo_centavos
+        arranjos = self.settings.arranjos_pagamento
+        prazo_minimo = min(prazos)
+        
+        # dia de liquidação (deslocamento a partir de date) -> (cnpj_ec, arranjo) -> total em centavos
+        abertas: Dict[int, Dict[Tuple[str, str], int]] = {}
+        emitidas = inicio_referencia
+        
+        def fechar(dias_liquidacao):
+            nonlocal emitidas
+            for dia_liquidacao in dias_liquidacao:
+                data_liquidacao = date + timedelta(days=dia_liquidacao)
+                for (cnpj_ec, arranjo), total in abertas.pop(dia_liquidacao).items():
+                    emitidas += 1
+                    yield self.build_aggregated_record(
+                        f"REF_{emitidas:06d}", cnpj_ec, arranjo, data_liquidacao, total
+                    )
+        
+        base, resto = divmod(num_transacoes, dias_captura)
+        for dia in range(dias_captura):
+            for _ in range(base + 1 if dia < resto else base):
+                urs = abertas.setdefault(dia + random.choice(prazos), {})
+                chave = (self.choose_cnpj_ec(), random.choice(arranjos))
+                urs[chave] = urs.get(chave, 0) + random.randint(valor_minimo, valor_maximo)
+            
+            # A próxima transação liquida no mínimo em (dia + 1 + prazo_minimo)
+            yield from fechar(sorted(d for d in abertas if d < dia + 1 + prazo_minimo))
+        
+        yield from fechar(sorted(abertas))
+    
+    def iter_random_records(self, num_records: int, inicio_referencia: int = 0) -> Iterator[Dict]:
+        """
+        Gera registros independentes (uma transação por UR)
+        
+        Valores e quantidade de pagamentos são sorteados em lotes de
+        TAMANHO_LOTE_REGISTROS linhas, e a divisão em centavos é feita para o lote inteiro.
+        As referências externas são numeradas a partir de inicio_referencia + 1.
+        """
+        valor_maximo = self.settings.valor_maximo_centavos
+        max_pagamentos = min(3, len(self.contas_bancarias))
+        for inicio in range(0, num_records, self.TAMANHO_LOTE_REGISTROS):
+            quantidade = min(self.TAMANHO_LOTE_REGISTROS, num_records - inicio)
+            totais = [random.randint(10000, valor_maximo) for _ in range(quantidade)]
+            partes = [random.randint(1, max_pagamentos) for _ in range(quantidade)]
+            divisoes = self.split_cents_batch(totais, partes)
+            for j in range(quantidade):
+                yield self.generate_random_record(
+                    f"REF_{inicio_referencia+inicio+j+1:06d}", partes[j], totais[j], divisoes[j]
+                )
+    
+    def write_part(self, output_path: str, num_records: int, inicio_referencia: int,
+                   date: datetime, faixa_horarios: Optional[Tuple[float, float]] = None):
+        """
+        Grava uma parte de um arquivo gerado em partes, com registros aleatórios
+        
+        Args:
+            output_path: Caminho do arquivo da parte
+            num_records: Quantidade de registros da parte
+            inicio_referencia: Quantidade de registros das partes anteriores (numera as referências externas)
+            date: Não usado no AP002 (mantém a assinatura comum da geração em partes)
+            faixa_horarios: Não usado no AP002 (idem)
+        """
+        tamanho_buffer = int(self.config.get('tamanho_buffer_saida_kb', 1024)) * 1024
+        with open(output_path, 'w', newline='', encoding='utf-8', buffering=tamanho_buffer) as f:
+            writer = csv.writer(f, delimiter=';', quoting=csv.QUOTE_MINIMAL)
+            for record in self.iter_random_records(num_records, inicio_referencia):
+                writer.writerow(self.generate_row(record))
+    
+    def _check_sharded_mode(self):
+        """Na geração em partes, só o modo padrão de registros aleatórios é suportado"""
+        if self.config.get('modo_agregacao') or self.replay is not None or self.config.get('gerar_parquet'):
+            raise ValueError("partes_arquivo não é suportado com modo_agregacao, replay ou gerar_parquet")
+    
+    def _sharded_reference_start(self) -> int:
+        """As referências externas do arquivo continuam as dos arquivos anteriores"""
+        return self.referencias_emitidas
+    
+    def _finish_sharded_file(self, num_records: int):
+        """Atualiza os totais do arquivo e a numeração das referências externas"""
+        self.total_registros = num_records
+        self.total_reenviados = 0
+        self.referencias_emitidas += num_records
+    
     def generate_file(self, num_records: int, output_path: Optional[str] = None, 
-                     date: Optional[datetime] = None, output_dir: str = "ap002_output") -> str:
+                     date: Optional[datetime] = None, output_dir: str = "ap002_output",
+                     tamanho_estimado: Optional[int] = None) -> str:
         """
         Gera o arquivo AP002 com registros aleatórios
         
+        No modo de agregação, num_records é a quantidade de transações, e a
+        quantidade de URs efetivamente gerada fica em self.total_registros.
+        
+        Com replay configurado, após cada linha nova uma linha já emitida (neste
+        ou em arquivos anteriores) é reenviada com probabilidade fracao; os
+        reenvios entram em self.total_registros e são contados em self.total_reenviados.
+        
+        As referências externas das linhas novas continuam a numeração dos arquivos
+        anteriores (self.referencias_emitidas, persistida no estado do replay), então
+        uma referência repetida é sempre um reenvio, nunca uma colisão.
+        
         Args:
             num_records: Número de registros a gerar
             output_path: Caminho de saída (opcional, gera automaticamente se não informado)
             date: Data de referência (padrão: data atual)
             output_dir: Diretório de saída (padrão: ap002_output)
+            tamanho_estimado: Tamanho estimado em bytes para pré-alocação do arquivo (opcional)
         
         Returns:
             Caminho do arquivo gerado
         """
         if output_path is None:
             output_path = self.generate_filename(date, output_dir)
+        if not self._is_stream_output(output_path):
+            Path(output_path).parent.mkdir(parents=True, exist_ok=True)
         
         if date is None:
             date = datetime.now()
         
-        records = []
-        for i in range(num_records):
-            referencia_externa = f"REF_{i+1:06d}"
-            record = self.generate_random_record(referencia_externa)
-            records.append(record)
+        # Geração em partes paralelas, concatenadas no arquivo final
+        if int(self.config.get('partes_arquivo', 1)) > 1:
+            return self.generate_sharded_file(num_records, output_path, date)
         
-        with open(output_path, 'w', newline='', encoding='utf-8') as csvfile:
-            # Usa ponto e vírgula como delimitador conforme especificação CERC
-            writer = csv.writer(csvfile, delimiter=';', quoting=csv.QUOTE_MINIMAL)
-            
-            # Escreve os registros
-            for record in records:
-                row = self.generate_row(record)
-                writer.writerow(row)
+        # Registros gerados sob demanda (sem materializar o arquivo inteiro em memória)
+        if self.config.get('modo_agregacao'):
+            records = self.iter_aggregated_records(num_records, date, self.referencias_emitidas)
+        else:
+            records = self.iter_random_records(num_records, self.referencias_emitidas)
+        
+        # Exportação colunar opcional, escrita na mesma passada do CSV
+        parquet_sink = None
+        if self.config.get('gerar_parquet', False):
+            if output_path == '-':
+                raise ValueError("gerar_parquet não é suportado com saída em stdout")
+            parquet_sink = ParquetSink(
+                str(Path(output_path).with_suffix('.parquet')),
+                self._parquet_schema,
+                self.config.get('tamanho_lote_parquet', 65536),
+            )
+        
+        try:
+            # Escreve em arquivo temporário e renomeia ao final (escrita atômica)
+            with self._open_output_atomic(output_path, tamanho_estimado) as csvfile:
+                # Usa ponto e vírgula como delimitador conforme especificação CERC
+                writer = csv.writer(csvfile, delimiter=';', quoting=csv.QUOTE_MINIMAL)
+                
+                # Escreve os registros
+                total_registros = 0
+                total_reenviados = 0
+                proximo_reenvio = self._replay_gap() if self.replay is not None else -1
+                for record in records:
+                    row = self.generate_row(record)
+                    writer.writerow(row)
+                    if parquet_sink is not None:
+                        parquet_sink.append(self.generate_parquet_record(record))
+                    total_registros += 1
+                    
+                    if self.replay is None:
+                        continue
+                    if proximo_reenvio == 0:
+                        reenvio = self.replay_row()
+                        if reenvio is not None:
+                            writer.writerow(reenvio)
+                            if parquet_sink is not None:
+                                parquet_sink.append(self.parquet_record_from_row(reenvio))
+                            total_registros += 1
+                            total_reenviados += 1
+                        proximo_reenvio = self._replay_gap()
+                    else:
+                        proximo_reenvio -= 1
+                    self.replay.offer(row)
+        except BaseException:
+            if parquet_sink is not None:
+                parquet_sink.abort()
+            raise
+        
+        if parquet_sink is not None:
+            parquet_sink.close()
+        
+        self.total_registros = total_registros
+        self.total_reenviados = total_reenviados
+        self.referencias_emitidas += total_registros - total_reenviados
+        
+        # Estado do replay salvo só após o arquivo gravado com sucesso
+        if self.replay is not None and self.config['replay'].get('arquivo_estado'):
+            self.replay.save(self.config['replay']['arquivo_estado'])
         
         return output_path
 
 
 def main():
     """Função principal"""
-    import sys
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Gera arquivo AP002 da CERC")
+    parser.add_argument('quantidade_registros', nargs='?', type=int,
+                        help="Quantidade de registros (padrão: valor do JSON ou 10)")
+    parser.add_argument('--continuo', action='store_true',
+                        help="Gera arquivos continuamente na taxa de modo_continuo (Ctrl+C para parar)")
+    parser.add_argument('--output',
+                        help="Caminho de saída; '-' para stdout ou um pipe nomeado (padrão: ap002_output/<nome CERC>)")
+    args = parser.parse_args()
+    if args.output is not None and args.continuo:
+        parser.error("--output não pode ser usado com --continuo")
     
     try:
         # Inicializa o gerador com configuração
         generator = AP002Generator("generate_ap002.json")
         
         # Número de registros a gerar (prioridade: linha de comando > config > padrão 10)
-        if len(sys.argv) > 1:
-            num_records = int(sys.argv[1])
+        if args.quantidade_registros is not None:
+            num_records = args.quantidade_registros
         else:
             num_records = generator.config.get('quantidade_registros', 10)
         
-        # Gera o arquivo
-        output_file = generator.generate_file(num_records)
+        # Modo contínuo: arquivos publicados na taxa de modo_continuo até Ctrl+C
+        if args.continuo:
+            print_continuous_report(generator.run_continuous(num_records, relatorio=print_continuous_report))
+            return
+        
+        # Modo multi-tenant: um arquivo por perfil, com as listas carregadas uma única vez
+        if generator.perfis:
+            if args.output is not None:
+                parser.error("--output não pode ser usado com perfis")
+            resultados = generator.generate_profiles(args.quantidade_registros)
+            for cnpj_credenciadora, output_file, total in resultados:
+                print(f"Arquivo AP002 gerado com sucesso: {output_file} ({total} registros, credenciadora {cnpj_credenciadora})", file=sys.stderr)
+            print(f"Perfis gerados: {len(resultados)}", file=sys.stderr)
+            return
         
-        print(f"Arquivo AP002 gerado com sucesso: {output_file}")
-        print(f"Total de registros: {num_records}")
-        print(f"CNPJ Credenciadora: {generator.cnpj_credenciadora}")
-        print(f"CNPJ Participante: {generator.cnpj_participante}")
-        print(f"CNPJs de EC disponíveis: {len(generator.cnpjs_ec)}")
-        print(f"Contas bancárias disponíveis: {len(generator.contas_bancarias)}")
+        # Gera o arquivo
+        output_file = generator.generate_file(num_records, output_path=args.output)
+        
+        print(f"Arquivo AP002 gerado com sucesso: {output_file}", file=sys.stderr)
+        print(f"Total de registros: {generator.total_registros}", file=sys.stderr)
+        if int(generator.config.get('partes_arquivo', 1)) > 1:
+            print(f"Partes concatenadas: {generator.config['partes_arquivo']} ({generator.metodo_concatenacao})", file=sys.stderr)
+        if generator.replay is not None:
+            print(f"Linhas reenviadas (replay): {generator.total_reenviados}", file=sys.stderr)
+        print(f"CNPJ Credenciadora: {generator.cnpj_credenciadora}", file=sys.stderr)
+        print(f"CNPJ Participante: {generator.cnpj_participante}", file=sys.stderr)
+        print(f"CNPJs de EC disponíveis: {len(generator.cnpjs_ec)}", file=sys.stderr)
+        print(f"Contas bancárias disponíveis: {len(generator.contas_bancarias)}", file=sys.stderr)
         
     except FileNotFoundError as e:
-        print(f"Erro: Arquivo não encontrado - {e}")
-        print("Certifique-se de que os arquivos de configuração existem:")
-        print("  - generate_ap002.json")
-        print("  - cnpjs_estabelecimentos.csv")
-        print("  - contas_bancarias.csv")
+        print(f"Erro: Arquivo não encontrado - {e}", file=sys.stderr)
+        print("Certifique-se de que os arquivos de configuração existem:", file=sys.stderr)
+        print("  - generate_ap002.json", file=sys.stderr)
+        print("  - cnpjs_estabelecimentos.csv", file=sys.stderr)
+        print("  - contas_bancarias.csv", file=sys.stderr)
     except Exception as e:
-        print(f"Erro ao gerar arquivo: {e}")
+        print(f"Erro ao gerar arquivo: {e}", file=sys.stderr)
         import traceback
         traceback.print_exc()
 
@@ -6,14 +6,67 @@ INFORMAÇÃO DE PÓS-CONTRATADAS
 """
 
 import csv
+import heapq
 import json
+import os
 import random
+import sys
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+from itertools import chain
+from multiprocessing import Pool
+from typing import Iterator, List, Dict, Optional, Tuple
 from pathlib import Path
 
+# Módulos compartilhados entre os geradores (pasta common/ na raiz do repositório)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from common.output import OutputFileMixin
 
-class AP003Generator:
+
+def sample_settled_chunk(tarefa: Tuple[str, int, int, bytes, int, int]) -> Tuple[int, List[Tuple[float, bytes]]]:
+    """
+    Lê um bloco de um arquivo AP002 e sorteia até k URs liquidadas (bottom-k)
+    
+    Executada nos processos de leitura. Cada UR com data_liquidacao (campo 7) até
+    a data limite recebe uma chave aleatória, e o bloco guarda apenas as k menores.
+    As k menores chaves da união dos blocos formam uma amostra uniforme de todas
+    as URs liquidadas, então a memória de cada processo é limitada por k.
+    
+    Uma linha pertence ao bloco em que começa: se o bloco não começa no início do
+    arquivo, a linha parcial inicial é descartada (ela é lida pelo bloco anterior).
+    
+    Args:
+        tarefa: Tupla (caminho, início, fim, data limite AAAA-MM-DD, k, semente)
+    
+    Returns:
+        Tupla (quantidade de URs liquidadas no bloco, lista de (chave, linha))
+    """
+    path, inicio, fim, data_limite, k, semente = tarefa
+    sorteio = random.Random(semente)
+    amostra = []  # heap de (-chave, linha): a raiz é a maior chave mantida
+    elegiveis = 0
+    with open(path, 'rb') as f:
+        posicao = inicio
+        if inicio > 0:
+            f.seek(inicio - 1)
+            posicao += len(f.readline()) - 1
+        while posicao < fim:
+            linha = f.readline()
+            if not linha:
+                break
+            posicao += len(linha)
+            campos = linha.split(b';', 7)
+            if len(campos) < 8 or campos[6] > data_limite:
+                continue
+            elegiveis += 1
+            chave = sorteio.random()
+            if len(amostra) < k:
+                heapq.heappush(amostra, (-chave, linha))
+            elif chave < -amostra[0][0]:
+                heapq.heapreplace(amostra, (-chave, linha))
+    return elegiveis, [(-chave, linha) for chave, linha in amostra]
+
+
+class AP003Generator(OutputFileMixin):
     """Gerador de arquivos AP003 da CERC"""
     
     def __init__(self, config_path: str = "generate_ap003.json"):
@@ -28,6 +81,8 @@ class AP003Generator:
         self.cnpj_raiz = self.cnpj_credenciadora[:8]
         self.sequence = 1
         self.tipo_leiaute = "CERC-AP003"
+        self.total_registros = 0
+        self.urs_liquidadas = 0
         
         # Carrega listas de dados
         self.cnpjs_ec = self._load_cnpjs_ec(self.config['arquivo_cnpjs_ec'])
@@ -81,9 +136,6 @@ class AP003Generator:
         date_str = date.strftime("%Y%m%d")
         seq_str = f"{self.sequence:07d}"
         
-        # Cria o diretório se não existir
-        Path(output_dir).mkdir(parents=True, exist_ok=True)
-        
         filename = f"{self.tipo_leiaute}_{self.cnpj_raiz}_{date_str}_{seq_str}.csv"
         return str(Path(output_dir) / filename)
     
@@ -148,6 +200,131 @@ class AP003Generator:
             'valor_pago': valor_pago,
         }
     
+    def _ap002_paths(self) -> List[str]:
+        """Arquivos AP002 configurados em arquivo_ap002 (caminho ou lista de caminhos)"""
+        arquivos = self.config['arquivo_ap002']
+        if isinstance(arquivos, str):
+            arquivos = [arquivos]
+        if not arquivos:
+            raise ValueError("arquivo_ap002 não informa nenhum arquivo")
+        return list(arquivos)
+    
+    def sample_settled_urs(self, k: int, date: datetime) -> List[bytes]:
+        """
+        Sorteia k URs liquidadas até date, lendo os arquivos AP002 em blocos paralelos
+        
+        Cada arquivo é dividido em blocos de tamanho_bloco_leitura_mb, distribuídos
+        entre processos_leitura processos (ver sample_settled_chunk). O total de URs
+        liquidadas encontradas fica em self.urs_liquidadas.
+        
+        Args:
+            k: Quantidade de URs a sortear
+            date: Data limite de liquidação
+        
+        Returns:
+            Linhas AP002 das URs sorteadas (todas, se houver k ou menos)
+        """
+        tamanho_bloco = int(self.config.get('tamanho_bloco_leitura_mb', 64) * 1024 * 1024)
+        processos = self.config.get('processos_leitura') or os.cpu_count() or 1
+        if tamanho_bloco < 1 or processos < 1:
+            raise ValueError("tamanho_bloco_leitura_mb e processos_leitura devem ser positivos")
+        data_limite = self.format_date(date).encode('ascii')
+        
+        tarefas = []
+        for path in self._ap002_paths():
+            tamanho = os.path.getsize(path)
+            for inicio in range(0, tamanho, tamanho_bloco):
+                fim = min(tamanho, inicio + tamanho_bloco)
+                tarefas.append((path, inicio, fim, data_limite, k, random.getrandbits(64)))
+        
+        if processos == 1 or len(tarefas) <= 1:
+            resultados = list(map(sample_settled_chunk, tarefas))
+        else:
+            with Pool(min(processos, len(tarefas))) as pool:
+                resultados = pool.map(sample_settled_chunk, tarefas)
+        
+        self.urs_liquidadas = sum(elegiveis for elegiveis, _ in resultados)
+        amostra = heapq.nsmallest(k, chain.from_iterable(parcial for _, parcial in resultados))
+        return [linha for _, linha in amostra]
+    
+    def _to_cents(self, valor: str) -> int:
+        """Converte um valor do leiaute (sempre com duas casas decimais) em centavos"""
+        return int(valor.replace('.', ''))
+    
+    def distribute_payment(self, valores: List[int], total_pago: int) -> List[int]:
+        """
+        Rateia total_pago entre os pagamentos, proporcionalmente aos valores, em centavos exatos
+        
+        Usa o método do maior resto: cada pagamento recebe o piso da sua cota e os
+        centavos que sobram vão para as maiores partes fracionárias.
+        """
+        total = sum(valores)
+        if total_pago >= total:
+            return list(valores)
+        if total <= 0:
+            return [0] * len(valores)
+        cotas = [divmod(valor * total_pago, total) for valor in valores]
+        pagos = [cota for cota, _ in cotas]
+        sobra = total_pago - sum(pagos)
+        for j in sorted(range(len(valores)), key=lambda j: cotas[j][1], reverse=True)[:sobra]:
+            pagos[j] += 1
+        return pagos
+    
+    def iter_random_records(self, num_records: int) -> Iterator[Dict]:
+        """Gera num_records registros aleatórios"""
+        for i in range(num_records):
+            yield self.generate_random_record(f"REF_{i+1:06d}")
+    
+    def iter_ap002_records(self, num_records: int, date: datetime) -> Iterator[Dict]:
+        """
+        Gera pós-contratadas a partir de URs liquidadas dos arquivos AP002
+        
+        Sorteia num_records URs com data_liquidacao até a data do arquivo e gera um
+        registro por pagamento do campo 15. valor_antecipado é o valor a pagar do
+        pagamento; valor_pago é limitado pelo valor livre da UR (campo 11): o que os
+        pagamentos excedem do valor livre não é pago, e a diferença é rateada entre
+        eles proporcionalmente.
+        
+        Args:
+            num_records: Quantidade de URs a sortear
+            date: Data do arquivo (data limite de liquidação)
+        
+        Yields:
+            Dicionários com os dados da pós-contratada
+        """
+        atraso_maximo = self.config.get('atraso_maximo_liquidacao', 0)
+        sequencial = 0
+        # O campo 15 (lista de pagamentos) tem ponto e vírgula internos e vem entre
+        # aspas; o módulo csv trata a citação como o csv.writer do AP002 a gerou
+        linhas = (linha.decode('utf-8') for linha in self.sample_settled_urs(num_records, date))
+        for campos in csv.reader(linhas, delimiter=';'):
+            pagamentos = [pagamento.split(';') for pagamento in campos[14].split('|')]
+            
+            valores = [self._to_cents(pagamento[6]) for pagamento in pagamentos]
+            total_pago = min(sum(valores), max(0, self._to_cents(campos[10])))
+            pagos = self.distribute_payment(valores, total_pago)
+            
+            data_liquidacao_prevista = datetime.strptime(campos[6], "%Y-%m-%d")
+            data_liquidacao_efetiva = min(date, data_liquidacao_prevista + timedelta(days=random.randint(0, atraso_maximo)))
+            for pagamento, valor, pago in zip(pagamentos, valores, pagos):
+                sequencial += 1
+                yield {
+                    'referencia_externa': f"REF_{sequencial:06d}",
+                    'data_liquidacao_prevista': data_liquidacao_prevista,
+                    'titular': campos[7],
+                    'usuario_final_recebedor': campos[4],
+                    'credenciadora': campos[2],
+                    'arranjo_pagamento': campos[5],
+                    'data_liquidacao_efetiva': data_liquidacao_efetiva,
+                    'valor_antecipado': valor / 100,
+                    'titular_conta': pagamento[0],
+                    'tipo_conta': pagamento[1],
+                    'ispb': pagamento[3],
+                    'agencia': pagamento[4],
+                    'numero_conta': pagamento[5],
+                    'valor_pago': pago / 100,
+                }
+    
     def generate_row(self, data: Dict) -> List[str]:
         """
         Gera uma linha do arquivo AP003
@@ -176,32 +353,41 @@ class AP003Generator:
         ]
     
     def generate_file(self, num_records: int, output_path: Optional[str] = None, 
-                     date: Optional[datetime] = None, output_dir: str = "ap003_output") -> str:
+                     date: Optional[datetime] = None, output_dir: str = "ap003_output",
+                     tamanho_estimado: Optional[int] = None) -> str:
         """
         Gera o arquivo AP003 com registros aleatórios
         
+        Com arquivo_ap002 configurado, num_records é a quantidade de URs liquidadas
+        sorteadas dos arquivos AP002 (ver iter_ap002_records); o total de registros
+        escrito fica em self.total_registros.
+        
         Args:
             num_records: Número de registros a gerar
             output_path: Caminho de saída (opcional, gera automaticamente se não informado)
             date: Data de referência (padrão: data atual)
             output_dir: Diretório de saída (padrão: ap003_output)
+            tamanho_estimado: Tamanho estimado em bytes para pré-alocação do arquivo (opcional)
         
         Returns:
             Caminho do arquivo gerado
         """
         if output_path is None:
             output_path = self.generate_filename(date, output_dir)
+        if not self._is_stream_output(output_path):
+            Path(output_path).parent.mkdir(parents=True, exist_ok=True)
         
         if date is None:
             date = datetime.now()
         
-        records = []
-        for i in range(num_records):
-            referencia_externa = f"REF_{i+1:06d}"
-            record = self.generate_random_record(referencia_externa)
-            records.append(record)
+        if self.config.get('arquivo_ap002'):
+            records = self.iter_ap002_records(num_records, date)
+        else:
+            records = self.iter_random_records(num_records)
         
-        with open(output_path, 'w', newline='', encoding='utf-8') as csvfile:
+        self.total_registros = 0
+        # Escreve em arquivo temporário e renomeia ao final (escrita atômica)
+        with self._open_output_atomic(output_path, tamanho_estimado) as csvfile:
             # Usa ponto e vírgula como delimitador conforme especificação CERC
             writer = csv.writer(csvfile, delimiter=';', quoting=csv.QUOTE_MINIMAL)
             
@@ -209,41 +395,65 @@ class AP003Generator:
             for record in records:
                 row = self.generate_row(record)
                 writer.writerow(row)
+                self.total_registros += 1
         
         return output_path
 
 
 def main():
     """Função principal"""
-    import sys
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Gera arquivo AP003 da CERC")
+    parser.add_argument('quantidade_registros', nargs='?', type=int,
+                        help="Quantidade de registros (padrão: valor do JSON ou 10)")
+    parser.add_argument('--output',
+                        help="Caminho de saída; '-' para stdout ou um pipe nomeado (padrão: ap003_output/<nome CERC>)")
+    parser.add_argument('--data',
+                        help="Data de referência do arquivo, AAAA-MM-DD (padrão: hoje); com arquivo_ap002, "
+                             "só URs com liquidação até essa data são usadas")
+    args = parser.parse_args()
+    
+    data_referencia = datetime.now()
+    if args.data is not None:
+        try:
+            data_referencia = datetime.strptime(args.data, "%Y-%m-%d")
+        except ValueError:
+            parser.error(f"--data inválida: {args.data} (formato AAAA-MM-DD)")
     
     try:
         # Inicializa o gerador com configuração
         generator = AP003Generator("generate_ap003.json")
         
         # Número de registros a gerar (prioridade: linha de comando > config > padrão 10)
-        if len(sys.argv) > 1:
-            num_records = int(sys.argv[1])
+        if args.quantidade_registros is not None:
+            num_records = args.quantidade_registros
         else:
             num_records = generator.config.get('quantidade_registros', 10)
         
         # Gera o arquivo
-        output_file = generator.generate_file(num_records)
+        output_file = generator.generate_file(num_records, output_path=args.output, date=data_referencia)
         
-        print(f"Arquivo AP003 gerado com sucesso: {output_file}")
-        print(f"Total de registros: {num_records}")
-        print(f"CNPJ Credenciadora: {generator.cnpj_credenciadora}")
-        print(f"CNPJs de EC disponíveis: {len(generator.cnpjs_ec)}")
-        print(f"Contas bancárias disponíveis: {len(generator.contas_bancarias)}")
+        print(f"Arquivo AP003 gerado com sucesso: {output_file}", file=sys.stderr)
+        print(f"Total de registros: {generator.total_registros}", file=sys.stderr)
+        if generator.config.get('arquivo_ap002'):
+            print(f"URs liquidadas encontradas no AP002: {generator.urs_liquidadas}", file=sys.stderr)
+            if generator.urs_liquidadas == 0:
+                print(f"Aviso: nenhuma UR do AP002 com liquidação até {generator.format_date(data_referencia)}; "
+                      "o arquivo foi gerado vazio. Use --data com uma data igual ou posterior às "
+                      "datas de liquidação do AP002", file=sys.stderr)
+        print(f"CNPJ Credenciadora: {generator.cnpj_credenciadora}", file=sys.stderr)
+        print(f"CNPJs de EC disponíveis: {len(generator.cnpjs_ec)}", file=sys.stderr)
+        print(f"Contas bancárias disponíveis: {len(generator.contas_bancarias)}", file=sys.stderr)
         
     except FileNotFoundError as e:
-        print(f"Erro: Arquivo não encontrado - {e}")
-        print("Certifique-se de que os arquivos de configuração existem:")
-        print("  - generate_ap003.json")
-        print("  - cnpjs_estabelecimentos.csv")
-        print("  - contas_bancarias.csv")
+        print(f"Erro: Arquivo não encontrado - {e}", file=sys.stderr)
+        print("Certifique-se de que os arquivos de configuração existem:", file=sys.stderr)
+        print("  - generate_ap003.json", file=sys.stderr)
+        print("  - cnpjs_estabelecimentos.csv", file=sys.stderr)
+        print("  - contas_bancarias.csv", file=sys.stderr)
     except Exception as e:
-        print(f"Erro ao gerar arquivo: {e}")
+        print(f"Erro ao gerar arquivo: {e}", file=sys.stderr)
         import traceback
         traceback.print_exc()
 
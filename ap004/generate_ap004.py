@@ -8,12 +8,18 @@ OPT-IN
 import csv
 import json
 import random
+import sys
 from datetime import datetime, timedelta
 from typing import List, Dict, Optional
 from pathlib import Path
 
+# Módulos compartilhados entre os geradores (pasta common/ na raiz do repositório)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from common.optin_registry import OptinRegistry
+from common.output import OutputFileMixin
 
-class AP004Generator:
+
+class AP004Generator(OutputFileMixin):
     """Gerador de arquivos AP004 da CERC"""
     
     def __init__(self, config_path: str = "generate_ap004.json"):
@@ -37,6 +43,10 @@ class AP004Generator:
         # Validações
         if not self.cnpjs_ec:
             raise ValueError(f"Nenhum CNPJ de EC encontrado em {self.config['arquivo_cnpjs_ec']}")
+        
+        # Registro compartilhado de opt-ins (None = protocolos aleatórios, sem registro)
+        arquivo_registro = self.config.get('arquivo_registro_optins')
+        self.registro = OptinRegistry(arquivo_registro) if arquivo_registro else None
     
     def _load_config(self, config_path: str) -> Dict:
         """Carrega configuração do arquivo JSON"""
@@ -71,9 +81,6 @@ class AP004Generator:
         date_str = date.strftime("%Y%m%d")
         seq_str = f"{self.sequence:07d}"
         
-        # Cria o diretório se não existir
-        Path(output_dir).mkdir(parents=True, exist_ok=True)
-        
         filename = f"{self.tipo_leiaute}_{self.cnpj_raiz}_{date_str}_{seq_str}.csv"
         return str(Path(output_dir) / filename)
     
@@ -138,7 +145,24 @@ class AP004Generator:
         # Protocolo (apenas se tipo de operação = A)
         protocolo = f"PROT_{random.randint(100000, 999999)}" if tipo_operacao == 'A' else ''
         
+        # Com registro: A atualiza um opt-in vivo e C registra um novo opt-in
+        optin_id = None
+        if self.registro is not None:
+            optin = None
+            if tipo_operacao == 'A':
+                optin = self.registro.sample_active(self.cnpj_solicitante, self.config.get('carteira_padrao', 'Carteira1'))
+            if optin is not None:
+                # A atualização mantém o início de vigência da criação e só estende o fim
+                optin_id, protocolo, cnpj_ec, inicio_original = optin
+                data_inicio = datetime.strptime(inicio_original, "%Y-%m-%d")
+            else:
+                tipo_operacao = 'C'
+                protocolo = ''
+                optin_id = self.registro.proximo_id
+                self.registro.proximo_id += 1
+        
         return {
+            'optin_id': optin_id,
             'tipo_operacao': tipo_operacao,
             'referencia_externa': referencia_externa,
             'solicitante': self.cnpj_solicitante,
@@ -193,7 +217,8 @@ class AP004Generator:
         ]
     
     def generate_file(self, num_records: int, output_path: Optional[str] = None, 
-                     date: Optional[datetime] = None, output_dir: str = "ap004_output") -> str:
+                     date: Optional[datetime] = None, output_dir: str = "ap004_output",
+                     tamanho_estimado: Optional[int] = None) -> str:
         """
         Gera o arquivo AP004 com registros aleatórios
         
@@ -202,65 +227,91 @@ class AP004Generator:
             output_path: Caminho de saída (opcional, gera automaticamente se não informado)
             date: Data de referência (padrão: data atual)
             output_dir: Diretório de saída (padrão: ap004_output)
+            tamanho_estimado: Tamanho estimado em bytes para pré-alocação do arquivo (opcional)
         
         Returns:
             Caminho do arquivo gerado
         """
         if output_path is None:
             output_path = self.generate_filename(date, output_dir)
+        if not self._is_stream_output(output_path):
+            Path(output_path).parent.mkdir(parents=True, exist_ok=True)
         
         if date is None:
             date = datetime.now()
         
-        records = []
-        for i in range(num_records):
-            referencia_externa = f"REF_{i+1:06d}"
-            record = self.generate_random_record(referencia_externa)
-            records.append(record)
-        
-        with open(output_path, 'w', newline='', encoding='utf-8') as csvfile:
-            # Usa ponto e vírgula como delimitador conforme especificação CERC
-            writer = csv.writer(csvfile, delimiter=';', quoting=csv.QUOTE_MINIMAL)
-            
-            # Escreve os registros
-            for record in records:
-                row = self.generate_row(record)
-                writer.writerow(row)
+        if self.registro is not None:
+            self.registro.refresh()
+        
+        try:
+            # Escreve em arquivo temporário e renomeia ao final (escrita atômica)
+            with self._open_output_atomic(output_path, tamanho_estimado) as csvfile:
+                # Usa ponto e vírgula como delimitador conforme especificação CERC
+                writer = csv.writer(csvfile, delimiter=';', quoting=csv.QUOTE_MINIMAL)
+                
+                # Registros gerados e escritos sob demanda
+                for i in range(num_records):
+                    record = self.generate_random_record(f"REF_{i+1:06d}")
+                    writer.writerow(self.generate_row(record))
+                    if self.registro is not None:
+                        if record['tipo_operacao'] == 'C':
+                            self.registro.add(record['optin_id'], record)
+                        else:
+                            self.registro.update_vigencia(record['optin_id'], record['data_fim'])
+        except BaseException:
+            # Arquivo descartado: desfaz também os opt-ins registrados
+            if self.registro is not None:
+                self.registro.conn.rollback()
+                self.registro.refresh()
+            raise
+        
+        # Opt-ins ficam visíveis para o AP006 junto com o arquivo
+        if self.registro is not None:
+            self.registro.conn.commit()
         
         return output_path
 
 
 def main():
     """Função principal"""
-    import sys
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Gera arquivo AP004 da CERC")
+    parser.add_argument('quantidade_registros', nargs='?', type=int,
+                        help="Quantidade de registros (padrão: valor do JSON ou 10)")
+    parser.add_argument('--output',
+                        help="Caminho de saída; '-' para stdout ou um pipe nomeado (padrão: ap004_output/<nome CERC>)")
+    args = parser.parse_args()
     
     try:
         # Inicializa o gerador com configuração
         generator = AP004Generator("generate_ap004.json")
         
         # Número de registros a gerar (prioridade: linha de comando > config > padrão 10)
-        if len(sys.argv) > 1:
-            num_records = int(sys.argv[1])
+        if args.quantidade_registros is not None:
+            num_records = args.quantidade_registros
         else:
             num_records = generator.config.get('quantidade_registros', 10)
         
         # Gera o arquivo
-        output_file = generator.generate_file(num_records)
+        output_file = generator.generate_file(num_records, output_path=args.output)
         
-        print(f"Arquivo AP004 gerado com sucesso: {output_file}")
-        print(f"Total de registros: {num_records}")
-        print(f"CNPJ Credenciadora: {generator.cnpj_credenciadora}")
-        print(f"CNPJ Solicitante: {generator.cnpj_solicitante}")
-        print(f"CNPJ Financiador: {generator.cnpj_financiador}")
-        print(f"CNPJs de EC disponíveis: {len(generator.cnpjs_ec)}")
+        print(f"Arquivo AP004 gerado com sucesso: {output_file}", file=sys.stderr)
+        print(f"Total de registros: {num_records}", file=sys.stderr)
+        print(f"CNPJ Credenciadora: {generator.cnpj_credenciadora}", file=sys.stderr)
+        print(f"CNPJ Solicitante: {generator.cnpj_solicitante}", file=sys.stderr)
+        print(f"CNPJ Financiador: {generator.cnpj_financiador}", file=sys.stderr)
+        print(f"CNPJs de EC disponíveis: {len(generator.cnpjs_ec)}", file=sys.stderr)
+        if generator.registro is not None:
+            print(f"Opt-ins registrados: {generator.registro.proximo_id - 1} ({generator.config['arquivo_registro_optins']})", file=sys.stderr)
         
     except FileNotFoundError as e:
-        print(f"Erro: Arquivo não encontrado - {e}")
-        print("Certifique-se de que os arquivos de configuração existem:")
-        print("  - generate_ap004.json")
-        print("  - cnpjs_estabelecimentos.csv")
+        print(f"Erro: Arquivo não encontrado - {e}", file=sys.stderr)
+        print("Certifique-se de que os arquivos de configuração existem:", file=sys.stderr)
+        print("  - generate_ap004.json", file=sys.stderr)
+        print("  - cnpjs_estabelecimentos.csv", file=sys.stderr)
     except Exception as e:
-        print(f"Erro ao gerar arquivo: {e}")
+        print(f"Erro ao gerar arquivo: {e}", file=sys.stderr)
         import traceback
         traceback.print_exc()
 
@@ -8,14 +8,92 @@ ENVIO DE INFORMAÇÕES DE AGENDAS POR FORÇA DE UM CONTRATO OU OPT-IN
 import csv
 import json
 import random
+import sys
+from array import array
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+from decimal import Decimal
+from typing import Iterator, List, Dict, Optional, Tuple
 from pathlib import Path
 
+# Módulos compartilhados entre os geradores (pasta common/ na raiz do repositório)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from common.output import OutputFileMixin, ShardedFileMixin
+from common.parquet import ParquetSink
+from common.payments import PaymentCentsMixin
+from common.pools import FixedWidthPool, FixedWidthRecordPool
+from common.profiles import ProfileSchedulerMixin
+from common.sampling import WeightedPoolMixin
+from common.settings import ConfigValidators
+from common.timestamps import TimestampGenerator
 
-class AP005Generator:
+
+@dataclass(frozen=True)
+class AP005Settings(ConfigValidators):
+    """
+    Configuração do AP005 compilada uma única vez, validada e imutável
+    
+    Os valores usados a cada linha ficam prontos (arranjos em tupla, valor máximo
+    em centavos, prazo de liquidação como timedelta), fora do dicionário do JSON.
+    Uma configuração inválida falha na inicialização, antes de qualquer escrita,
+    listando todos os problemas encontrados.
+    """
+    
+    cnpj_credenciadora: str
+    cnpj_entidade_registradora: str
+    arquivo_cnpjs_ec: str
+    arquivo_contas: str
+    arranjos_pagamento: Tuple[str, ...]
+    dias_futuros_liquidacao: int
+    prazo_liquidacao: timedelta
+    valor_maximo_centavos: int
+    carteira_padrao: str
+    
+    @classmethod
+    def from_config(cls, config: Dict) -> 'AP005Settings':
+        """
+        Valida a configuração e pré-calcula os valores derivados
+        
+        Raises:
+            ValueError: Configuração inválida (todos os problemas na mensagem)
+        """
+        erros = []
+        dias_futuros = cls._inteiro(config, 'dias_futuros_liquidacao', erros, 0)
+        settings = cls(
+            cnpj_credenciadora=cls._cnpj(config, 'cnpj_credenciadora', erros),
+            cnpj_entidade_registradora=cls._cnpj(config, 'cnpj_entidade_registradora', erros),
+            arquivo_cnpjs_ec=cls._texto(config, 'arquivo_cnpjs_ec', erros),
+            arquivo_contas=cls._texto(config, 'arquivo_contas', erros),
+            arranjos_pagamento=cls._arranjos(config, erros),
+            dias_futuros_liquidacao=dias_futuros,
+            prazo_liquidacao=timedelta(days=dias_futuros),
+            # Valores sorteados entre 100,00 e o máximo
+            valor_maximo_centavos=int(round(cls._valor(config, 'valor_maximo_transacao', erros, 100.0) * 100)),
+            carteira_padrao=cls._texto(config, 'carteira_padrao', erros, 'Carteira1'),
+        )
+        cls._raise_if_invalid(erros)
+        return settings
+
+
+class AP005Generator(OutputFileMixin, ShardedFileMixin, WeightedPoolMixin, PaymentCentsMixin,
+                     ProfileSchedulerMixin):
     """Gerador de arquivos AP005 da CERC"""
     
+    # Campos que um perfil (tenant) pode sobrepor à configuração base
+    CAMPOS_PERFIL = ('cnpj_credenciadora', 'cnpj_entidade_registradora', 'carteira_padrao', 'quantidade_registros')
+    CLASSE_SETTINGS = AP005Settings
+    
+    # Subcampos 1-16 de cada informação de pagamento do campo 12
+    CAMPOS_PAGAMENTO = (
+        'numero_documento_titular', 'tipo_conta', 'compe', 'ispb', 'agencia', 'numero_conta',
+        'valor_a_pagar', 'beneficiario', 'data_liquidacao_efetiva', 'valor_liquidacao_efetiva',
+        'regra_divisao', 'valor_onerado', 'tipo_informacao_pagamento', 'indicador_ordem_efeito',
+        'valor_constituido_efeito', 'identificador_contrato_cerc',
+    )
+    
+    # Linhas sorteadas por lote no modo padrão (valores e divisão dos pagamentos)
+    TAMANHO_LOTE_REGISTROS = 4096
+    
     def __init__(self, config_path: str = "generate_ap005.json"):
         """
         Inicializa o gerador com configuração do arquivo JSON
@@ -24,21 +102,67 @@ class AP005Generator:
             config_path: Caminho para o arquivo JSON de configuração
         """
         self.config = self._load_config(config_path)
-        self.cnpj_credenciadora = self.config['cnpj_credenciadora']
-        self.cnpj_entidade_registradora = self.config['cnpj_entidade_registradora']
+        self.settings = AP005Settings.from_config(self.config)
+        self.cnpj_credenciadora = self.settings.cnpj_credenciadora
+        self.cnpj_entidade_registradora = self.settings.cnpj_entidade_registradora
         self.cnpj_raiz = self.cnpj_credenciadora[:8]
         self.sequence = 1
         self.tipo_leiaute = "CERC-AP005"
         
         # Carrega listas de dados
-        self.cnpjs_ec = self._load_cnpjs_ec(self.config['arquivo_cnpjs_ec'])
-        self.contas_bancarias = self._load_contas_bancarias(self.config['arquivo_contas'])
+        self.cnpjs_ec = self._load_cnpjs_ec(self.settings.arquivo_cnpjs_ec)
+        self.contas_bancarias = self._load_contas_bancarias(self.settings.arquivo_contas)
+        
+        # Pools em memória compartilhada, lidos sem cópia pelos processos dos perfis
+        # (padrão: ativado quando há perfis configurados)
+        self.memoria_compartilhada = bool(self.config.get('memoria_compartilhada', bool(self.config.get('perfis'))))
+        if self.memoria_compartilhada:
+            self.cnpjs_ec = FixedWidthPool(self.cnpjs_ec)
+            self.contas_bancarias = FixedWidthRecordPool(self.contas_bancarias)
         
         # Validações
         if not self.cnpjs_ec:
-            raise ValueError(f"Nenhum CNPJ de EC encontrado em {self.config['arquivo_cnpjs_ec']}")
+            raise ValueError(f"Nenhum CNPJ de EC encontrado em {self.settings.arquivo_cnpjs_ec}")
         if not self.contas_bancarias:
-            raise ValueError(f"Nenhuma conta bancária encontrada em {self.config['arquivo_contas']}")
+            raise ValueError(f"Nenhuma conta bancária encontrada em {self.settings.arquivo_contas}")
+        
+        # Amostradores ponderados (None = seleção uniforme)
+        self.amostrador_ec = self._build_sampler(
+            self.config.get('distribuicao_cnpjs_ec'), len(self.cnpjs_ec),
+            self.settings.arquivo_cnpjs_ec, chave='cnpj'
+        )
+        self.amostrador_contas = self._build_sampler(
+            self.config.get('distribuicao_contas'), len(self.contas_bancarias),
+            self.settings.arquivo_contas
+        )
+        
+        # Gerador de horários (None = data/hora atual em cada registro)
+        distribuicao_horarios = self.config.get('distribuicao_horarios')
+        self.gerador_horarios = TimestampGenerator(distribuicao_horarios) if distribuicao_horarios else None
+        
+        # Divisão do valor entre as informações de pagamento do campo 12
+        divisao = self.config.get('divisao_pagamentos') or {}
+        self.tipo_divisao = divisao.get('tipo', 'igual')
+        self.concentracao_divisao = float(divisao.get('concentracao', 1.0))
+        if self.tipo_divisao not in ('igual', 'dirichlet') or self.concentracao_divisao <= 0:
+            raise ValueError("divisao_pagamentos: tipo deve ser 'igual' ou 'dirichlet' e concentracao > 0")
+        
+        # Cache de prefixos do leiaute AP005 (campo 12, subcampos 1-16): prefixo (1-6) de
+        # cada conta, indexado pela posição em contas_bancarias, e sufixo (8-16) comum
+        self.prefixos_pagamento, self.sufixo_pagamento = self._render_pagamento_prefixos()
+        if self.memoria_compartilhada:
+            self.prefixos_pagamento = FixedWidthPool(self.prefixos_pagamento)
+        
+        # Quantidade de registros do último arquivo gerado
+        self.total_registros = 0
+        
+        # Perfis (tenants) gerados por generate_profiles
+        self.perfis = self._load_perfis(self.config.get('perfis'))
+    
+    def _setup_profile(self, gerador: 'AP005Generator'):
+        """Ajusta o CNPJ da entidade registradora e os contadores do gerador de um perfil"""
+        gerador.cnpj_entidade_registradora = gerador.settings.cnpj_entidade_registradora
+        gerador.total_registros = 0
     
     def _load_config(self, config_path: str) -> Dict:
         """Carrega configuração do arquivo JSON"""
@@ -82,9 +206,6 @@ class AP005Generator:
         date_str = date.strftime("%Y%m%d")
         seq_str = f"{self.sequence:07d}"
         
-        # Cria o diretório se não existir
-        Path(output_dir).mkdir(parents=True, exist_ok=True)
-        
         filename = f"{self.tipo_leiaute}_{self.cnpj_raiz}_{date_str}_{seq_str}_ret.csv"
         return str(Path(output_dir) / filename)
     
@@ -108,129 +229,138 @@ class AP005Generator:
         """Formata valor decimal com número específico de casas decimais"""
         return f"{value:.{decimals}f}"
     
+    def format_pagamento_info(self, pagamento: Dict) -> List[str]:
+        """Formata os subcampos 1-16 de uma informação de pagamento do campo 12"""
+        return [
+            self.format_cpf(pagamento.get('numero_documento_titular', '11111111111')),
+            pagamento.get('tipo_conta', 'CC'),
+            pagamento.get('compe', '001').zfill(3) if pagamento.get('compe') else '',
+            pagamento.get('ispb', '00000001').zfill(8),
+            pagamento.get('agencia', '1234'),
+            pagamento.get('numero_conta', '123456-7'),
+            self.format_decimal(pagamento.get('valor_a_pagar', 0.0)),
+            pagamento.get('beneficiario', ''),
+            pagamento.get('data_liquidacao_efetiva', ''),
+            pagamento.get('valor_liquidacao_efetiva', ''),
+            pagamento.get('regra_divisao', ''),
+            pagamento.get('valor_onerado', ''),
+            pagamento.get('tipo_informacao_pagamento', '7'),
+            pagamento.get('indicador_ordem_efeito', ''),
+            pagamento.get('valor_constituido_efeito', ''),
+            pagamento.get('identificador_contrato_cerc', ''),
+        ]
+    
     def format_campo12_lista(self, data: Dict) -> str:
         """
         Formata o campo 12 como lista de Informações de Pagamento
         Campo 12 contém múltiplas informações de pagamento (subcampos 1-16)
         """
-        pagamentos = data.get('pagamentos', [])
-        if not pagamentos:
-            # Se não houver pagamentos, cria um padrão
-            conta = random.choice(self.contas_bancarias)
-            pagamentos = [{
-                'numero_documento_titular': conta.get('numero_documento_titular', '11111111111'),
-                'tipo_conta': conta.get('tipo_conta', 'CC'),
-                'compe': conta.get('compe', '001'),
-                'ispb': conta.get('ispb', '00000001'),
-                'agencia': conta.get('agencia', '1234'),
-                'numero_conta': conta.get('numero_conta', '123456-7'),
-                'valor_a_pagar': data.get('valor_constituido_total', 0.0),
-                'beneficiario': '',
-                'data_liquidacao_efetiva': '',
-                'valor_liquidacao_efetiva': '',
-                'regra_divisao': '',
-                'valor_onerado': '',
-                'tipo_informacao_pagamento': '7',  # 7 = Domicílio de pagamento
-                'indicador_ordem_efeito': '',
-                'valor_constituido_efeito': '',
-                'identificador_contrato_cerc': '',
-            }]
-        
-        # Formata cada informação de pagamento (subcampos 1-16)
-        pagamentos_formatados = []
-        for pagamento in pagamentos:
-            pagamento_info = [
-                self.format_cpf(pagamento.get('numero_documento_titular', '11111111111')),
-                pagamento.get('tipo_conta', 'CC'),
-                pagamento.get('compe', '001').zfill(3) if pagamento.get('compe') else '',
-                pagamento.get('ispb', '00000001').zfill(8),
-                pagamento.get('agencia', '1234'),
-                pagamento.get('numero_conta', '123456-7'),
-                self.format_decimal(pagamento.get('valor_a_pagar', 0.0)),
-                pagamento.get('beneficiario', ''),
-                pagamento.get('data_liquidacao_efetiva', ''),
-                pagamento.get('valor_liquidacao_efetiva', ''),
-                pagamento.get('regra_divisao', ''),
-                pagamento.get('valor_onerado', ''),
-                pagamento.get('tipo_informacao_pagamento', '7'),
-                pagamento.get('indicador_ordem_efeito', ''),
-                pagamento.get('valor_constituido_efeito', ''),
-                pagamento.get('identificador_contrato_cerc', ''),
-            ]
-            pagamentos_formatados.append(';'.join(pagamento_info))
+        contas = data.get('contas_pagamento')
+        valores = data.get('valores_pagamento')
+        if contas is None and not data.get('pagamentos'):
+            # Se não houver pagamentos, usa uma conta sorteada com o valor total
+            contas = self.choose_contas_indices(1)
+            valores = [self._to_cents(data.get('valor_constituido_total', 0.0))]
+        
+        if contas is not None:
+            # Apenas o valor é formatado por linha; o restante vem do cache de prefixos por conta
+            prefixos = self.prefixos_pagamento
+            sufixo = self.sufixo_pagamento
+            return '|'.join([prefixos[c] + self.format_cents(v) + sufixo for c, v in zip(contas, valores)])
+        
+        # Pagamentos informados como dicionários (subcampos 1-16)
+        pagamentos_formatados = [';'.join(self.format_pagamento_info(p)) for p in data['pagamentos']]
         
         # Junta todas as informações separadas por |
         campo12_completo = '|'.join(pagamentos_formatados)
         return campo12_completo
     
-    def generate_random_record(self, referencia_externa: str, num_pagamentos: int = None) -> Dict:
+    def build_pagamento(self, conta: Dict, valor_a_pagar: float) -> Dict:
+        """Monta uma informação de pagamento do campo 12 (domicílio) para a conta informada"""
+        return {
+            'numero_documento_titular': conta.get('numero_documento_titular', '11111111111'),
+            'tipo_conta': conta.get('tipo_conta', 'CC'),
+            'compe': conta.get('compe', '001'),
+            'ispb': conta.get('ispb', '00000001'),
+            'agencia': conta.get('agencia', '1234'),
+            'numero_conta': conta.get('numero_conta', '123456-7'),
+            'valor_a_pagar': valor_a_pagar,
+            'beneficiario': '',
+            'data_liquidacao_efetiva': '',
+            'valor_liquidacao_efetiva': '',
+            'regra_divisao': '',
+            'valor_onerado': '',
+            'tipo_informacao_pagamento': '7',  # 7 = Domicílio de pagamento
+            'indicador_ordem_efeito': '',
+            'valor_constituido_efeito': '',
+            'identificador_contrato_cerc': '',
+        }
+    
+    def get_pagamentos(self, data: Dict) -> List[Dict]:
+        """Retorna as informações de pagamento do registro como dicionários"""
+        contas = data.get('contas_pagamento')
+        if contas is None:
+            return data.get('pagamentos', [])
+        return [
+            self.build_pagamento(self.contas_bancarias[c], v / 100)
+            for c, v in zip(contas, data['valores_pagamento'])
+        ]
+    
+    def generate_random_record(self, referencia_externa: str, num_pagamentos: int = None,
+                               cnpj_ec: Optional[str] = None, arranjo_pagamento: Optional[str] = None,
+                               data_liquidacao: Optional[datetime] = None,
+                               valor_constituido_centavos: Optional[int] = None,
+                               valores_pagamento: Optional[List[int]] = None) -> Dict:
         """
         Gera um registro aleatório baseado na configuração
         
         Args:
             referencia_externa: Referência externa do registro
             num_pagamentos: Número de informações de pagamento (padrão: aleatório entre 1 e 2)
+            cnpj_ec: CNPJ do titular (padrão: sorteado)
+            arranjo_pagamento: Arranjo de pagamento (padrão: sorteado)
+            data_liquidacao: Data de liquidação (padrão: data atual + dias_futuros_liquidacao)
+            valor_constituido_centavos: Valor constituído total em centavos (padrão: sorteado)
+            valores_pagamento: Valores de cada pagamento em centavos, já divididos
+                (padrão: divisão de valor_constituido_centavos conforme divisao_pagamentos)
         
         Returns:
             Dicionário com os dados da agenda
         """
         # Seleciona CNPJ de EC aleatório
-        cnpj_ec = random.choice(self.cnpjs_ec)
+        if cnpj_ec is None:
+            cnpj_ec = self.choose_cnpj_ec()
         
         # Número de pagamentos (padrão: 1 a 2)
         if num_pagamentos is None:
             num_pagamentos = random.randint(1, 2)
         
         # Seleciona contas bancárias aleatórias para pagamentos
-        contas_pagamento = random.sample(self.contas_bancarias, min(num_pagamentos, len(self.contas_bancarias)))
+        contas_pagamento = self.choose_contas_indices(num_pagamentos)
         
         # Calcula data de liquidação (data atual + dias futuros)
-        data_liquidacao = datetime.now() + timedelta(days=self.config['dias_futuros_liquidacao'])
+        if data_liquidacao is None:
+            data_liquidacao = datetime.now() + self.settings.prazo_liquidacao
         
         # Gera valores aleatórios
-        valor_maximo = self.config['valor_maximo_transacao']
-        valor_constituido_total = round(random.uniform(100.00, valor_maximo), 2)
+        if valor_constituido_centavos is None:
+            valor_constituido_centavos = random.randint(10000, self.settings.valor_maximo_centavos)
+        valor_constituido_total = valor_constituido_centavos / 100
         valor_constituido_antecipacao = round(random.uniform(0.0, valor_constituido_total * 0.3), 2)
         valor_bloqueado = round(random.uniform(0.0, valor_constituido_total * 0.2), 2)
         valor_livre = round(valor_constituido_total - valor_bloqueado, 2)
         valor_total_ur = round(valor_constituido_total * random.uniform(1.0, 1.2), 2)
         
         # Arranjo de pagamento aleatório
-        arranjo_pagamento = random.choice(self.config['arranjos_pagamento'])
+        if arranjo_pagamento is None:
+            arranjo_pagamento = random.choice(self.settings.arranjos_pagamento)
         
         # Constituição (1 = Constituída, 2 = A constituir)
         constituicao = random.choice(['1', '2'])
         
-        # Prepara lista de pagamentos
-        pagamentos = []
-        valor_restante = valor_constituido_total
-        for i, conta in enumerate(contas_pagamento):
-            if i == len(contas_pagamento) - 1:
-                # Último pagamento recebe o valor restante
-                valor_pagamento = valor_restante
-            else:
-                # Divide o valor entre os pagamentos
-                valor_pagamento = round(valor_restante / (len(contas_pagamento) - i), 2)
-                valor_restante -= valor_pagamento
-            
-            pagamentos.append({
-                'numero_documento_titular': conta.get('numero_documento_titular', '11111111111'),
-                'tipo_conta': conta.get('tipo_conta', 'CC'),
-                'compe': conta.get('compe', '001'),
-                'ispb': conta.get('ispb', '00000001'),
-                'agencia': conta.get('agencia', '1234'),
-                'numero_conta': conta.get('numero_conta', '123456-7'),
-                'valor_a_pagar': valor_pagamento,
-                'beneficiario': '',
-                'data_liquidacao_efetiva': '',
-                'valor_liquidacao_efetiva': '',
-                'regra_divisao': '',
-                'valor_onerado': '',
-                'tipo_informacao_pagamento': '7',  # 7 = Domicílio de pagamento
-                'indicador_ordem_efeito': '',
-                'valor_constituido_efeito': '',
-                'identificador_contrato_cerc': '',
-            })
+        # Divide o valor constituído entre os pagamentos, em centavos exatos
+        if valores_pagamento is None or len(valores_pagamento) != len(contas_pagamento):
+            valores_pagamento = self.split_cents_batch([valor_constituido_centavos], [len(contas_pagamento)])[0]
         
         return {
             'referencia_externa': referencia_externa,
@@ -244,11 +374,12 @@ class AP005Generator:
             'valor_constituido_total': valor_constituido_total,
             'valor_constituido_antecipacao': valor_constituido_antecipacao,
             'valor_bloqueado': valor_bloqueado,
-            'carteira': self.config.get('carteira_padrao', 'Carteira1'),
+            'carteira': self.settings.carteira_padrao,
             'valor_livre': valor_livre,
             'valor_total_ur': valor_total_ur,
             'data_hora_ultima_atualizacao': datetime.now(),
-            'pagamentos': pagamentos,
+            'contas_pagamento': contas_pagamento,
+            'valores_pagamento': valores_pagamento,
         }
     
     def generate_row(self, data: Dict) -> List[str]:
@@ -281,84 +412,392 @@ class AP005Generator:
         
         # Campos 13 a 16
         campos_finais = [
-            data.get('carteira', self.config.get('carteira_padrao', 'Carteira1')),
+            data.get('carteira', self.settings.carteira_padrao),
             self.format_decimal(data.get('valor_livre', 0.0)),
             self.format_decimal(data.get('valor_total_ur', 0.0)),
+            data.get('data_hora_ultima_atualizacao_rfc3339') or
             self.format_datetime_rfc3339(data.get('data_hora_ultima_atualizacao', datetime.now())),
         ]
         
         return campos_base + [campo12] + campos_finais
     
+    def _parquet_schema(self, pa):
+        """Schema Parquet do AP005, com o campo 12 como list<struct>"""
+        valor = pa.decimal128(18, 2)
+        pagamento = pa.struct([
+            (nome, valor if nome == 'valor_a_pagar' else pa.string())
+            for nome in self.CAMPOS_PAGAMENTO
+        ])
+        return pa.schema([
+            ('referencia_externa', pa.string()),
+            ('entidade_registradora', pa.string()),
+            ('credenciadora', pa.string()),
+            ('usuario_final_recebedor', pa.string()),
+            ('arranjo_pagamento', pa.string()),
+            ('data_liquidacao', pa.date32()),
+            ('titular', pa.string()),
+            ('constituicao', pa.string()),
+            ('valor_constituido_total', valor),
+            ('valor_constituido_antecipacao', valor),
+            ('valor_bloqueado', valor),
+            ('pagamentos', pa.list_(pagamento)),
+            ('carteira', pa.string()),
+            ('valor_livre', valor),
+            ('valor_total_ur', valor),
+            ('data_hora_ultima_atualizacao', pa.timestamp('us')),
+        ])
+    
+    def generate_parquet_record(self, data: Dict) -> Dict:
+        """
+        Converte um registro para a representação colunar do Parquet
+        
+        Os valores são os mesmos escritos no CSV (CNPJs/CPFs formatados, valores com
+        2 casas decimais), porém tipados: datas como date32/timestamp e valores como decimal.
+        
+        Args:
+            data: Dicionário com os dados da agenda
+        
+        Returns:
+            Dicionário coluna -> valor
+        """
+        pagamentos = []
+        for pagamento in self.get_pagamentos(data):
+            info = dict(zip(self.CAMPOS_PAGAMENTO, self.format_pagamento_info(pagamento)))
+            info['valor_a_pagar'] = Decimal(info['valor_a_pagar'])
+            pagamentos.append(info)
+        
+        return {
+            'referencia_externa': data.get('referencia_externa', ''),
+            'entidade_registradora': self.format_cnpj(data.get('entidade_registradora', '')),
+            'credenciadora': self.format_cnpj(data.get('credenciadora', '')),
+            'usuario_final_recebedor': self.format_cpf(data.get('usuario_final_recebedor', '')),
+            'arranjo_pagamento': data.get('arranjo_pagamento', ''),
+            'data_liquidacao': data.get('data_liquidacao', datetime.now()).date(),
+            'titular': self.format_cpf(data.get('titular', '')),
+            'constituicao': data.get('constituicao', '1'),
+            'valor_constituido_total': Decimal(self.format_decimal(data.get('valor_constituido_total', 0.0))),
+            'valor_constituido_antecipacao': Decimal(self.format_decimal(data.get('valor_constituido_antecipacao', 0.0))),
+            'valor_bloqueado': Decimal(self.format_decimal(data.get('valor_bloqueado', 0.0))),
+            'pagamentos': pagamentos,
+            'carteira': data.get('carteira', self.settings.carteira_padrao),
+            'valor_livre': Decimal(self.format_decimal(data.get('valor_livre', 0.0))),
+            'valor_total_ur': Decimal(self.format_decimal(data.get('valor_total_ur', 0.0))),
+            'data_hora_ultima_atualizacao': data.get('data_hora_ultima_atualizacao', datetime.now()),
+        }
+    
+    def build_settlement_calendar(self, date: datetime) -> List[datetime]:
+        """
+        Pré-calcula o calendário de datas de liquidação do horizonte
+        
+        O calendário começa em date + dias_futuros_liquidacao e cobre dias_horizonte
+        dias corridos. Com apenas_dias_uteis, sábados, domingos e as datas de
+        feriados (AAAA-MM-DD) são descartados. É calculado uma única vez por arquivo
+        e compartilhado por todos os titulares.
+        
+        Args:
+            date: Data de referência do arquivo
+        
+        Returns:
+            Lista ordenada de datas de liquidação
+        """
+        modo = self.config['modo_horizonte']
+        dias_horizonte = int(modo.get('dias_horizonte', 360))
+        apenas_dias_uteis = modo.get('apenas_dias_uteis', True)
+        feriados = set(modo.get('feriados', []))
+        inicio = date + self.settings.prazo_liquidacao
+        
+        calendario = []
+        for d in range(dias_horizonte):
+            dia = inicio + timedelta(days=d)
+            if apenas_dias_uteis and (dia.weekday() >= 5 or self.format_date(dia) in feriados):
+                continue
+            calendario.append(dia)
+        
+        if not calendario:
+            raise ValueError("modo_horizonte: nenhuma data de liquidação no horizonte configurado")
+        return calendario
+    
+    def assign_settlement_periods(self) -> array:
+        """
+        Sorteia a periodicidade de liquidação de cada titular (calendário por EC)
+        
+        A periodicidade é o passo, em datas do calendário, entre duas liquidações
+        do titular: 1 = todas as datas, 5 = uma a cada cinco datas, etc. O sorteio
+        segue periodicidades_liquidacao (padrão: [1]) e é guardado em um array
+        compacto indexado pela posição do CNPJ.
+        
+        Returns:
+            Array com a periodicidade de cada titular
+        """
+        periodicidades = self.config['modo_horizonte'].get('periodicidades_liquidacao', [1])
+        if not periodicidades or any(int(p) < 1 for p in periodicidades):
+            raise ValueError("modo_horizonte: periodicidades_liquidacao deve conter inteiros >= 1")
+        periodicidades = [int(p) for p in periodicidades]
+        
+        if len(periodicidades) == 1:
+            return array('H', periodicidades * len(self.cnpjs_ec))
+        return array('H', (random.choice(periodicidades) for _ in range(len(self.cnpjs_ec))))
+    
+    def iter_horizon_cells(self, calendario: List[datetime],
+                           periodicidades: array) -> Iterator[Tuple[str, str, datetime]]:
+        """
+        Percorre sob demanda a grade titular x arranjo x data de liquidação
+        
+        Args:
+            calendario: Calendário de liquidação pré-calculado
+            periodicidades: Periodicidade de liquidação de cada titular
+        """
+        arranjos = self.settings.arranjos_pagamento
+        for i, cnpj_ec in enumerate(self.cnpjs_ec):
+            datas = calendario[::periodicidades[i]]
+            for arranjo in arranjos:
+                for data_liquidacao in datas:
+                    yield cnpj_ec, arranjo, data_liquidacao
+    
+    def _sample_cells(self, celulas: Iterator, total: int, quantidade: int) -> Iterator:
+        """
+        Seleciona exatamente `quantidade` células de `total`, em uma única passada
+        
+        Amostragem sequencial (seleção de Knuth): cada célula é escolhida com
+        probabilidade (faltantes / restantes), sem guardar a grade em memória e
+        preservando a ordem da grade no arquivo.
+        """
+        selecionadas = 0
+        for vistas, celula in enumerate(celulas):
+            if random.random() * (total - vistas) < quantidade - selecionadas:
+                yield celula
+                selecionadas += 1
+                if selecionadas == quantidade:
+                    return
+    
+    def plan_horizon(self, num_records: int, date: datetime) -> Tuple[Iterator, int]:
+        """
+        Prepara o modo horizonte: calendário, periodicidades e a grade de URs
+        
+        Com tipo "produto", a grade completa (produto cartesiano) é emitida e
+        num_records é ignorado. Com tipo "amostra", exatamente num_records células
+        são sorteadas uniformemente da grade (limitado ao tamanho da grade).
+        
+        Args:
+            num_records: Quantidade de registros pedida
+            date: Data de referência do arquivo
+        
+        Returns:
+            Tupla (iterador de células, quantidade de registros que serão gerados)
+        """
+        tipo = self.config['modo_horizonte'].get('tipo', 'produto')
+        if tipo not in ('produto', 'amostra'):
+            raise ValueError(f"modo_horizonte: tipo '{tipo}' inválido (use 'produto' ou 'amostra')")
+        
+        calendario = self.build_settlement_calendar(date)
+        periodicidades = self.assign_settlement_periods()
+        
+        # Tamanho da grade calculado sem percorrê-la
+        num_arranjos = len(self.settings.arranjos_pagamento)
+        total = num_arranjos * sum(
+            (len(calendario) + p - 1) // p for p in periodicidades
+        )
+        
+        celulas = self.iter_horizon_cells(calendario, periodicidades)
+        if tipo == 'produto':
+            return celulas, total
+        
+        quantidade = min(num_records, total)
+        return self._sample_cells(celulas, total, quantidade), quantidade
+    
+    def iter_random_records(self, num_records: int, inicio_referencia: int = 0) -> Iterator[Dict]:
+        """
+        Gera registros independentes (titular, arranjo e data sorteados ou fixos)
+        
+        Valores e quantidade de pagamentos são sorteados em lotes de
+        TAMANHO_LOTE_REGISTROS linhas, e a divisão em centavos é feita para o lote inteiro.
+        As referências externas são numeradas a partir de inicio_referencia + 1.
+        """
+        valor_maximo = self.settings.valor_maximo_centavos
+        max_pagamentos = min(2, len(self.contas_bancarias))
+        for inicio in range(0, num_records, self.TAMANHO_LOTE_REGISTROS):
+            quantidade = min(self.TAMANHO_LOTE_REGISTROS, num_records - inicio)
+            totais = [random.randint(10000, valor_maximo) for _ in range(quantidade)]
+            partes = [random.randint(1, max_pagamentos) for _ in range(quantidade)]
+            divisoes = self.split_cents_batch(totais, partes)
+            for j in range(quantidade):
+                yield self.generate_random_record(
+                    f"REF_{inicio_referencia+inicio+j+1:06d}", partes[j],
+                    valor_constituido_centavos=totais[j], valores_pagamento=divisoes[j],
+                )
+    
+    def iter_horizon_records(self, celulas: Iterator[Tuple[str, str, datetime]]) -> Iterator[Dict]:
+        """Gera um registro por célula (titular, arranjo, data de liquidação) da grade"""
+        for i, (cnpj_ec, arranjo, data_liquidacao) in enumerate(celulas):
+            yield self.generate_random_record(
+                f"REF_{i+1:06d}",
+                cnpj_ec=cnpj_ec,
+                arranjo_pagamento=arranjo,
+                data_liquidacao=data_liquidacao,
+            )
+    
+    def write_part(self, output_path: str, num_records: int, inicio_referencia: int,
+                   date: datetime, faixa_horarios: Optional[Tuple[float, float]] = None):
+        """
+        Grava uma parte de um arquivo gerado em partes, com registros aleatórios
+        
+        Args:
+            output_path: Caminho do arquivo da parte
+            num_records: Quantidade de registros da parte
+            inicio_referencia: Quantidade de registros das partes anteriores (numera as referências externas)
+            date: Data de referência
+            faixa_horarios: Faixa da curva de horários da parte (ver TimestampGenerator.plan_parts)
+        """
+        horarios = None
+        if self.gerador_horarios is not None:
+            horarios = self.gerador_horarios.iter_timestamps(num_records, date, faixa_horarios)
+        tamanho_buffer = int(self.config.get('tamanho_buffer_saida_kb', 1024)) * 1024
+        with open(output_path, 'w', newline='', encoding='utf-8', buffering=tamanho_buffer) as f:
+            writer = csv.writer(f, delimiter=';', quoting=csv.QUOTE_MINIMAL)
+            for record in self.iter_random_records(num_records, inicio_referencia):
+                if horarios is not None:
+                    record['data_hora_ultima_atualizacao'], record['data_hora_ultima_atualizacao_rfc3339'] = next(horarios)
+                writer.writerow(self.generate_row(record))
+    
+    def _check_sharded_mode(self):
+        """Na geração em partes, só o modo padrão de registros aleatórios é suportado"""
+        if self.config.get('modo_horizonte') or self.config.get('gerar_parquet'):
+            raise ValueError("partes_arquivo não é suportado com modo_horizonte ou gerar_parquet")
+    
+    def _finish_sharded_file(self, num_records: int):
+        """Atualiza o total de registros do arquivo"""
+        self.total_registros = num_records
+    
     def generate_file(self, num_records: int, output_path: Optional[str] = None, 
-                     date: Optional[datetime] = None, output_dir: str = "ap005_output") -> str:
+                     date: Optional[datetime] = None, output_dir: str = "ap005_output",
+                     tamanho_estimado: Optional[int] = None) -> str:
         """
         Gera o arquivo AP005 com registros aleatórios
         
+        No modo horizonte, a quantidade efetivamente gerada fica em self.total_registros.
+        
         Args:
             num_records: Número de registros a gerar
             output_path: Caminho de saída (opcional, gera automaticamente se não informado)
             date: Data de referência (padrão: data atual)
             output_dir: Diretório de saída (padrão: ap005_output)
+            tamanho_estimado: Tamanho estimado em bytes para pré-alocação do arquivo (opcional)
         
         Returns:
             Caminho do arquivo gerado
         """
         if output_path is None:
             output_path = self.generate_filename(date, output_dir)
+        if not self._is_stream_output(output_path):
+            Path(output_path).parent.mkdir(parents=True, exist_ok=True)
         
         if date is None:
             date = datetime.now()
         
-        records = []
-        for i in range(num_records):
-            referencia_externa = f"REF_{i+1:06d}"
-            record = self.generate_random_record(referencia_externa)
-            records.append(record)
-        
-        with open(output_path, 'w', newline='', encoding='utf-8') as csvfile:
-            # Usa ponto e vírgula como delimitador conforme especificação CERC
-            writer = csv.writer(csvfile, delimiter=';', quoting=csv.QUOTE_MINIMAL)
-            
-            # Escreve os registros
-            for record in records:
-                row = self.generate_row(record)
-                writer.writerow(row)
+        # Geração em partes paralelas, concatenadas no arquivo final
+        if int(self.config.get('partes_arquivo', 1)) > 1:
+            return self.generate_sharded_file(num_records, output_path, date)
+        
+        # Registros gerados sob demanda (sem materializar a grade ou o arquivo em memória)
+        if self.config.get('modo_horizonte'):
+            celulas, num_records = self.plan_horizon(num_records, date)
+            records = self.iter_horizon_records(celulas)
+        else:
+            records = self.iter_random_records(num_records)
+        self.total_registros = num_records
+        
+        # Horários conforme a curva configurada, sorteados em blocos à medida que são escritos (data_hora_ultima_atualizacao)
+        horarios = None
+        if self.gerador_horarios is not None:
+            horarios = self.gerador_horarios.iter_timestamps(num_records, date)
+        
+        # Exportação colunar opcional, escrita na mesma passada do CSV
+        parquet_sink = None
+        if self.config.get('gerar_parquet', False):
+            if output_path == '-':
+                raise ValueError("gerar_parquet não é suportado com saída em stdout")
+            parquet_sink = ParquetSink(
+                str(Path(output_path).with_suffix('.parquet')),
+                self._parquet_schema,
+                self.config.get('tamanho_lote_parquet', 65536),
+            )
+        
+        try:
+            # Escreve em arquivo temporário e renomeia ao final (escrita atômica)
+            with self._open_output_atomic(output_path, tamanho_estimado) as csvfile:
+                # Usa ponto e vírgula como delimitador conforme especificação CERC
+                writer = csv.writer(csvfile, delimiter=';', quoting=csv.QUOTE_MINIMAL)
+                
+                # Escreve os registros
+                for record in records:
+                    if horarios is not None:
+                        record['data_hora_ultima_atualizacao'], record['data_hora_ultima_atualizacao_rfc3339'] = next(horarios)
+                    row = self.generate_row(record)
+                    writer.writerow(row)
+                    if parquet_sink is not None:
+                        parquet_sink.append(self.generate_parquet_record(record))
+        except BaseException:
+            if parquet_sink is not None:
+                parquet_sink.abort()
+            raise
+        
+        if parquet_sink is not None:
+            parquet_sink.close()
         
         return output_path
 
 
 def main():
     """Função principal"""
-    import sys
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Gera arquivo AP005 da CERC")
+    parser.add_argument('quantidade_registros', nargs='?', type=int,
+                        help="Quantidade de registros (padrão: valor do JSON ou 10)")
+    parser.add_argument('--output',
+                        help="Caminho de saída; '-' para stdout ou um pipe nomeado (padrão: ap005_output/<nome CERC>)")
+    args = parser.parse_args()
     
     try:
         # Inicializa o gerador com configuração
         generator = AP005Generator("generate_ap005.json")
         
+        # Modo multi-tenant: um arquivo por perfil, com as listas carregadas uma única vez
+        if generator.perfis:
+            if args.output is not None:
+                parser.error("--output não pode ser usado com perfis")
+            resultados = generator.generate_profiles(args.quantidade_registros)
+            for cnpj_credenciadora, output_file, total in resultados:
+                print(f"Arquivo AP005 gerado com sucesso: {output_file} ({total} registros, credenciadora {cnpj_credenciadora})", file=sys.stderr)
+            print(f"Perfis gerados: {len(resultados)}", file=sys.stderr)
+            return
+        
         # Número de registros a gerar (prioridade: linha de comando > config > padrão 10)
-        if len(sys.argv) > 1:
-            num_records = int(sys.argv[1])
+        if args.quantidade_registros is not None:
+            num_records = args.quantidade_registros
         else:
             num_records = generator.config.get('quantidade_registros', 10)
         
         # Gera o arquivo
-        output_file = generator.generate_file(num_records)
+        output_file = generator.generate_file(num_records, output_path=args.output)
         
-        print(f"Arquivo AP005 gerado com sucesso: {output_file}")
-        print(f"Total de registros: {num_records}")
-        print(f"CNPJ Credenciadora: {generator.cnpj_credenciadora}")
-        print(f"CNPJ Entidade Registradora: {generator.cnpj_entidade_registradora}")
-        print(f"CNPJs de EC disponíveis: {len(generator.cnpjs_ec)}")
-        print(f"Contas bancárias disponíveis: {len(generator.contas_bancarias)}")
+        print(f"Arquivo AP005 gerado com sucesso: {output_file}", file=sys.stderr)
+        print(f"Total de registros: {generator.total_registros}", file=sys.stderr)
+        if int(generator.config.get('partes_arquivo', 1)) > 1:
+            print(f"Partes concatenadas: {generator.config['partes_arquivo']} ({generator.metodo_concatenacao})", file=sys.stderr)
+        print(f"CNPJ Credenciadora: {generator.cnpj_credenciadora}", file=sys.stderr)
+        print(f"CNPJ Entidade Registradora: {generator.cnpj_entidade_registradora}", file=sys.stderr)
+        print(f"CNPJs de EC disponíveis: {len(generator.cnpjs_ec)}", file=sys.stderr)
+        print(f"Contas bancárias disponíveis: {len(generator.contas_bancarias)}", file=sys.stderr)
         
     except FileNotFoundError as e:
-        print(f"Erro: Arquivo não encontrado - {e}")
-        print("Certifique-se de que os arquivos de configuração existem:")
-        print("  - generate_ap005.json")
-        print("  - cnpjs_estabelecimentos.csv")
-        print("  - contas_bancarias.csv")
+        print(f"Erro: Arquivo não encontrado - {e}", file=sys.stderr)
+        print("Certifique-se de que os arquivos de configuração existem:", file=sys.stderr)
+        print("  - generate_ap005.json", file=sys.stderr)
+        print("  - cnpjs_estabelecimentos.csv", file=sys.stderr)
+        print("  - contas_bancarias.csv", file=sys.stderr)
     except Exception as e:
-        print(f"Erro ao gerar arquivo: {e}")
+        print(f"Erro ao gerar arquivo: {e}", file=sys.stderr)
         import traceback
         traceback.print_exc()
 
@@ -8,12 +8,18 @@ OPT-OUT
 import csv
 import json
 import random
+import sys
 from datetime import datetime
 from typing import List, Dict, Optional
 from pathlib import Path
 
+# Módulos compartilhados entre os geradores (pasta common/ na raiz do repositório)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from common.optin_registry import OptinRegistry
+from common.output import OutputFileMixin
 
-class AP006Generator:
+
+class AP006Generator(OutputFileMixin):
     """Gerador de arquivos AP006 da CERC"""
     
     def __init__(self, config_path: str = "generate_ap006.json"):
@@ -29,6 +35,13 @@ class AP006Generator:
         self.cnpj_raiz = self.cnpj_credenciadora[:8]
         self.sequence = 1
         self.tipo_leiaute = "CERC-AP006"
+        
+        # Registro compartilhado de opt-ins (None = protocolos aleatórios, sem registro)
+        arquivo_registro = self.config.get('arquivo_registro_optins')
+        self.registro = OptinRegistry(arquivo_registro) if arquivo_registro else None
+        
+        # Quantidade de registros do último arquivo gerado
+        self.total_registros = 0
     
     def _load_config(self, config_path: str) -> Dict:
         """Carrega configuração do arquivo JSON"""
@@ -52,9 +65,6 @@ class AP006Generator:
         date_str = date.strftime("%Y%m%d")
         seq_str = f"{self.sequence:07d}"
         
-        # Cria o diretório se não existir
-        Path(output_dir).mkdir(parents=True, exist_ok=True)
-        
         filename = f"{self.tipo_leiaute}_{self.cnpj_raiz}_{date_str}_{seq_str}.csv"
         return str(Path(output_dir) / filename)
     
@@ -62,18 +72,29 @@ class AP006Generator:
         """Formata CNPJ com zeros à esquerda até 14 dígitos"""
         return cnpj.zfill(14)
     
-    def generate_random_record(self, referencia_externa: str) -> Dict:
+    def generate_random_record(self, referencia_externa: str, date: Optional[datetime] = None) -> Optional[Dict]:
         """
         Gera um registro aleatório baseado na configuração
         
+        Com registro de opt-ins, o protocolo é sorteado entre os opt-ins vivos e o
+        opt-in é cancelado no registro (não é sorteado novamente).
+        
         Args:
             referencia_externa: Referência externa do registro
+            date: Data do opt-out (padrão: data atual)
         
         Returns:
-            Dicionário com os dados do opt-out
+            Dicionário com os dados do opt-out, ou None se não houver opt-ins vivos no registro
         """
-        # Gera protocolo de opt-in fictício
-        protocolo_optin = f"PROT_{random.randint(100000, 999999)}"
+        if self.registro is not None:
+            optin = self.registro.sample_active(self.cnpj_solicitante, self.config.get('carteira_padrao', 'Carteira1'))
+            if optin is None:
+                return None
+            optin_id, protocolo_optin, _, _ = optin
+            self.registro.opt_out(optin_id, date or datetime.now())
+        else:
+            # Gera protocolo de opt-in fictício
+            protocolo_optin = f"PROT_{random.randint(100000, 999999)}"
         
         return {
             'referencia_externa': referencia_externa,
@@ -100,71 +121,98 @@ class AP006Generator:
         ]
     
     def generate_file(self, num_records: int, output_path: Optional[str] = None, 
-                     date: Optional[datetime] = None, output_dir: str = "ap006_output") -> str:
+                     date: Optional[datetime] = None, output_dir: str = "ap006_output",
+                     tamanho_estimado: Optional[int] = None) -> str:
         """
         Gera o arquivo AP006 com registros aleatórios
         
+        Com registro de opt-ins, o arquivo pode ter menos de num_records registros se
+        os opt-ins vivos se esgotarem; a quantidade gerada fica em self.total_registros.
+        
         Args:
             num_records: Número de registros a gerar
             output_path: Caminho de saída (opcional, gera automaticamente se não informado)
             date: Data de referência (padrão: data atual)
             output_dir: Diretório de saída (padrão: ap006_output)
+            tamanho_estimado: Tamanho estimado em bytes para pré-alocação do arquivo (opcional)
         
         Returns:
             Caminho do arquivo gerado
         """
         if output_path is None:
             output_path = self.generate_filename(date, output_dir)
+        if not self._is_stream_output(output_path):
+            Path(output_path).parent.mkdir(parents=True, exist_ok=True)
         
         if date is None:
             date = datetime.now()
         
-        records = []
-        for i in range(num_records):
-            referencia_externa = f"REF_{i+1:06d}"
-            record = self.generate_random_record(referencia_externa)
-            records.append(record)
-        
-        with open(output_path, 'w', newline='', encoding='utf-8') as csvfile:
-            # Usa ponto e vírgula como delimitador conforme especificação CERC
-            writer = csv.writer(csvfile, delimiter=';', quoting=csv.QUOTE_MINIMAL)
-            
-            # Escreve os registros
-            for record in records:
-                row = self.generate_row(record)
-                writer.writerow(row)
-        
+        total_registros = 0
+        if self.registro is not None:
+            self.registro.refresh()
+        
+        try:
+            # Escreve em arquivo temporário e renomeia ao final (escrita atômica)
+            with self._open_output_atomic(output_path, tamanho_estimado) as csvfile:
+                # Usa ponto e vírgula como delimitador conforme especificação CERC
+                writer = csv.writer(csvfile, delimiter=';', quoting=csv.QUOTE_MINIMAL)
+                
+                # Registros gerados e escritos sob demanda
+                for i in range(num_records):
+                    record = self.generate_random_record(f"REF_{i+1:06d}", date)
+                    if record is None:
+                        break  # Não há mais opt-ins vivos no registro
+                    writer.writerow(self.generate_row(record))
+                    total_registros += 1
+        except BaseException:
+            # Arquivo descartado: os opt-ins voltam a ficar vivos
+            if self.registro is not None:
+                self.registro.conn.rollback()
+            raise
+        
+        # Opt-outs efetivados no registro junto com o arquivo
+        if self.registro is not None:
+            self.registro.conn.commit()
+        
+        self.total_registros = total_registros
         return output_path
 
 
 def main():
     """Função principal"""
-    import sys
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Gera arquivo AP006 da CERC")
+    parser.add_argument('quantidade_registros', nargs='?', type=int,
+                        help="Quantidade de registros (padrão: valor do JSON ou 10)")
+    parser.add_argument('--output',
+                        help="Caminho de saída; '-' para stdout ou um pipe nomeado (padrão: ap006_output/<nome CERC>)")
+    args = parser.parse_args()
     
     try:
         # Inicializa o gerador com configuração
         generator = AP006Generator("generate_ap006.json")
         
         # Número de registros a gerar (prioridade: linha de comando > config > padrão 10)
-        if len(sys.argv) > 1:
-            num_records = int(sys.argv[1])
+        if args.quantidade_registros is not None:
+            num_records = args.quantidade_registros
         else:
             num_records = generator.config.get('quantidade_registros', 10)
         
         # Gera o arquivo
-        output_file = generator.generate_file(num_records)
+        output_file = generator.generate_file(num_records, output_path=args.output)
         
-        print(f"Arquivo AP006 gerado com sucesso: {output_file}")
-        print(f"Total de registros: {num_records}")
-        print(f"CNPJ Credenciadora: {generator.cnpj_credenciadora}")
-        print(f"CNPJ Solicitante: {generator.cnpj_solicitante}")
+        print(f"Arquivo AP006 gerado com sucesso: {output_file}", file=sys.stderr)
+        print(f"Total de registros: {generator.total_registros}", file=sys.stderr)
+        print(f"CNPJ Credenciadora: {generator.cnpj_credenciadora}", file=sys.stderr)
+        print(f"CNPJ Solicitante: {generator.cnpj_solicitante}", file=sys.stderr)
         
     except FileNotFoundError as e:
-        print(f"Erro: Arquivo não encontrado - {e}")
-        print("Certifique-se de que o arquivo de configuração existe:")
-        print("  - generate_ap006.json")
+        print(f"Erro: Arquivo não encontrado - {e}", file=sys.stderr)
+        print("Certifique-se de que o arquivo de configuração existe:", file=sys.stderr)
+        print("  - generate_ap006.json", file=sys.stderr)
     except Exception as e:
-        print(f"Erro ao gerar arquivo: {e}")
+        print(f"Erro ao gerar arquivo: {e}", file=sys.stderr)
         import traceback
         traceback.print_exc()
 
@@ -6,16 +6,190 @@ ENVIO DE EFEITOS DE CONTRATOS APLICÁVEIS ÀS UNIDADES DE RECEBÍVEIS PARA FINS
 """
 
 import csv
+import itertools
 import json
+import math
 import random
+import sys
+from array import array
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+from typing import Iterator, List, Dict, Optional, Tuple
 from pathlib import Path
 
+# Módulos compartilhados entre os geradores (pasta common/ na raiz do repositório)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from common.continuous import ContinuousModeMixin, print_continuous_report
+from common.output import OutputFileMixin, ShardedFileMixin
+from common.pools import FixedWidthPool, FixedWidthRecordPool
+from common.profiles import ProfileSchedulerMixin
+from common.sampling import WeightedPoolMixin
+from common.settings import ConfigValidators
+from common.timestamps import TimestampGenerator
 
-class AP008Generator:
+
+class ContractPlan:
+    """
+    Plano de contratos do modo por contrato, mantido em arrays compactos
+    
+    Cada contrato ocupa 11 bytes (índice do EC, prioridade, regra de divisão,
+    quantidade de efeitos e efeitos já emitidos), o que permite planejar dezenas
+    de milhões de contratos em memória. O identificador do contrato é derivado
+    do seu índice e não precisa ser armazenado.
+    """
+    
+    def __init__(self):
+        self.ec = array('I')
+        self.prioridade = array('H')
+        self.regra_divisao = array('B')
+        self.efeitos = array('H')
+        self.emitidos = array('H')
+    
+    def __len__(self) -> int:
+        return len(self.efeitos)
+    
+    def add(self, ec: int, prioridade: int, regra_divisao: int, efeitos: int):
+        """Adiciona um contrato ao plano"""
+        self.ec.append(ec)
+        self.prioridade.append(prioridade)
+        self.regra_divisao.append(regra_divisao)
+        self.efeitos.append(efeitos)
+        self.emitidos.append(0)
+
+
+class ErrorInjector:
+    """
+    Injeção de erros com taxas controladas, para testes de caminho negativo
+    
+    As posições com erro são sorteadas uma única vez por arquivo (máscara de
+    linhas): para cada tipo, exatamente round(taxa * N) linhas distintas. Na
+    escrita, uma linha limpa custa apenas uma consulta ao dicionário da máscara,
+    então um arquivo com 0,1% de erros custa o mesmo que um arquivo limpo.
+    
+    Tipos suportados:
+        status_erro: status_operacao = 1, com código e descrição de erro
+        cnpj_tamanho_invalido: usuario_final_recebedor (campo 5) com 13 dígitos
+        arranjo_invalido: arranjo_pagamento (campo 6) fora da lista de arranjos
+        lista_contas_quebrada: lista de contas do campo 7 com um elemento vazio ao final
+    """
+    
+    TIPOS = ('status_erro', 'cnpj_tamanho_invalido', 'arranjo_invalido', 'lista_contas_quebrada')
+    
+    CODIGOS_ERRO = (
+        ('001', 'CNPJ do usuario final recebedor nao encontrado'),
+        ('002', 'Arranjo de pagamento nao credenciado'),
+        ('003', 'Valor onerado superior ao valor constituido'),
+        ('004', 'Conta de pagamento invalida'),
+        ('005', 'Contrato inexistente ou encerrado'),
+    )
+    
+    ARRANJO_INVALIDO = 'XXX'
+    
+    def __init__(self, taxas: Dict[str, float]):
+        """
+        Args:
+            taxas: Taxa de erro (0 a 1) por tipo, ex.: {"status_erro": 0.001}
+        """
+        for tipo, taxa in taxas.items():
+            if tipo not in self.TIPOS:
+                raise ValueError(f"Tipo de erro desconhecido: {tipo}")
+            if not 0.0 <= taxa <= 1.0:
+                raise ValueError(f"Taxa de erro de {tipo} deve estar entre 0 e 1")
+        self.taxas = {tipo: taxa for tipo, taxa in taxas.items() if taxa > 0}
+    
+    def build_mask(self, num_records: int) -> Dict[int, List[str]]:
+        """
+        Sorteia as linhas com erro de um arquivo
+        
+        Args:
+            num_records: Quantidade de linhas do arquivo
+        
+        Returns:
+            Dicionário posição da linha (a partir de 0) -> tipos de erro da linha
+        """
+        mascara = {}
+        for tipo, taxa in self.taxas.items():
+            for posicao in random.sample(range(num_records), round(taxa * num_records)):
+                mascara.setdefault(posicao, []).append(tipo)
+        return mascara
+    
+    def apply_record(self, record: Dict, tipos: List[str]):
+        """Aplica os erros de conteúdo (antes da formatação da linha)"""
+        if 'status_erro' in tipos:
+            record['status_operacao'] = '1'
+            record['codigo_erro'], record['descricao_erro'] = random.choice(self.CODIGOS_ERRO)
+    
+    def apply_row(self, row: List[str], tipos: List[str]):
+        """Aplica os erros de formato (sobre a linha já formatada)"""
+        if 'cnpj_tamanho_invalido' in tipos:
+            row[4] = row[4][1:]
+        if 'arranjo_invalido' in tipos:
+            row[5] = self.ARRANJO_INVALIDO
+        if 'lista_contas_quebrada' in tipos:
+            row[6] = row[6] + '|'
+
+
+@dataclass(frozen=True)
+class AP008Settings(ConfigValidators):
+    """
+    Configuração do AP008 compilada uma única vez, validada e imutável
+    
+    Os valores usados a cada linha ficam prontos (arranjos em tupla, prazo de
+    liquidação como timedelta, padrões das contas), fora do dicionário do JSON.
+    Uma configuração inválida falha na inicialização, antes de qualquer escrita,
+    listando todos os problemas encontrados.
+    """
+    
+    cnpj_credenciadora: str
+    entidade_registradora: str
+    arquivo_cnpjs_ec: str
+    arquivo_contas: str
+    arranjos_pagamento: Tuple[str, ...]
+    dias_futuros_liquidacao: int
+    prazo_liquidacao: timedelta
+    valor_maximo_pagamento: float
+    prioridade_maxima: int
+    tipo_conta_padrao: str
+    compe_padrao: str
+    ispb_padrao: str
+    
+    @classmethod
+    def from_config(cls, config: Dict) -> 'AP008Settings':
+        """
+        Valida a configuração e pré-calcula os valores derivados
+        
+        Raises:
+            ValueError: Configuração inválida (todos os problemas na mensagem)
+        """
+        erros = []
+        dias_futuros = cls._inteiro(config, 'dias_futuros_liquidacao', erros, 0)
+        settings = cls(
+            cnpj_credenciadora=cls._cnpj(config, 'cnpj_credenciadora', erros),
+            entidade_registradora=cls._cnpj(config, 'entidade_registradora', erros, '12345678000190'),
+            arquivo_cnpjs_ec=cls._texto(config, 'arquivo_cnpjs_ec', erros),
+            arquivo_contas=cls._texto(config, 'arquivo_contas', erros),
+            arranjos_pagamento=cls._arranjos(config, erros),
+            dias_futuros_liquidacao=dias_futuros,
+            prazo_liquidacao=timedelta(days=dias_futuros),
+            # Valores sorteados entre 100,00 e o máximo
+            valor_maximo_pagamento=cls._valor(config, 'valor_maximo_pagamento', erros, 100.0),
+            prioridade_maxima=cls._inteiro(config, 'prioridade_maxima', erros, 1),
+            tipo_conta_padrao=cls._texto(config, 'tipo_conta_padrao', erros, 'CC'),
+            compe_padrao=cls._texto(config, 'compe_padrao', erros, '001'),
+            ispb_padrao=cls._texto(config, 'ispb_padrao', erros, '12345678'),
+        )
+        cls._raise_if_invalid(erros)
+        return settings
+
+
+class AP008Generator(OutputFileMixin, ShardedFileMixin, WeightedPoolMixin, ContinuousModeMixin,
+                     ProfileSchedulerMixin):
     """Gerador de arquivos AP008 da CERC"""
     
+    # Campos que um perfil (tenant) pode sobrepor à configuração base
+    CAMPOS_PERFIL = ('cnpj_credenciadora', 'entidade_registradora', 'quantidade_registros')
+    CLASSE_SETTINGS = AP008Settings
+    
     def __init__(self, config_path: str = "generate_ap008.json"):
         """
         Inicializa o gerador com configuração do arquivo JSON
@@ -24,20 +198,59 @@ class AP008Generator:
             config_path: Caminho para o arquivo JSON de configuração
         """
         self.config = self._load_config(config_path)
-        self.cnpj_credenciadora = self.config['cnpj_credenciadora']
+        self.settings = AP008Settings.from_config(self.config)
+        self.cnpj_credenciadora = self.settings.cnpj_credenciadora
         self.cnpj_raiz = self.cnpj_credenciadora[:8]
         self.sequence = 1
         self.tipo_leiaute = "CERC-AP008"
         
         # Carrega listas de dados
-        self.cnpjs_ec = self._load_cnpjs_ec(self.config['arquivo_cnpjs_ec'])
-        self.contas_bancarias = self._load_contas_bancarias(self.config['arquivo_contas'])
+        self.cnpjs_ec = self._load_cnpjs_ec(self.settings.arquivo_cnpjs_ec)
+        self.contas_bancarias = self._load_contas_bancarias(self.settings.arquivo_contas)
+        
+        # Pools em memória compartilhada, lidos sem cópia pelos processos dos perfis
+        # (padrão: ativado quando há perfis configurados)
+        self.memoria_compartilhada = bool(self.config.get('memoria_compartilhada', bool(self.config.get('perfis'))))
+        if self.memoria_compartilhada:
+            self.cnpjs_ec = FixedWidthPool(self.cnpjs_ec)
+            self.contas_bancarias = FixedWidthRecordPool(self.contas_bancarias)
         
         # Validações
         if not self.cnpjs_ec:
-            raise ValueError(f"Nenhum CNPJ de EC encontrado em {self.config['arquivo_cnpjs_ec']}")
+            raise ValueError(f"Nenhum CNPJ de EC encontrado em {self.settings.arquivo_cnpjs_ec}")
         if not self.contas_bancarias:
-            raise ValueError(f"Nenhuma conta bancária encontrada em {self.config['arquivo_contas']}")
+            raise ValueError(f"Nenhuma conta bancária encontrada em {self.settings.arquivo_contas}")
+        
+        # Amostradores ponderados (None = seleção uniforme)
+        self.amostrador_ec = self._build_sampler(
+            self.config.get('distribuicao_cnpjs_ec'), len(self.cnpjs_ec),
+            self.settings.arquivo_cnpjs_ec, chave='cnpj'
+        )
+        self.amostrador_contas = self._build_sampler(
+            self.config.get('distribuicao_contas'), len(self.contas_bancarias),
+            self.settings.arquivo_contas
+        )
+        
+        # Gerador de horários (None = data/hora atual em cada registro)
+        distribuicao_horarios = self.config.get('distribuicao_horarios')
+        self.gerador_horarios = TimestampGenerator(distribuicao_horarios) if distribuicao_horarios else None
+        
+        # Cache de contas do leiaute AP008 (campos 7.16 a 7.22), indexado pela posição em contas_bancarias
+        self.contas_formatadas = [self.format_conta(conta) for conta in self.contas_bancarias]
+        if self.memoria_compartilhada:
+            self.contas_formatadas = FixedWidthPool(self.contas_formatadas)
+        
+        # Injeção de erros (None = arquivo limpo)
+        injecao_erros = self.config.get('injecao_erros')
+        self.injetor_erros = ErrorInjector(injecao_erros) if injecao_erros else None
+        self.erros_injetados = 0
+        
+        # Perfis (tenants) gerados por generate_profiles
+        self.perfis = self._load_perfis(self.config.get('perfis'))
+    
+    def _setup_profile(self, gerador: 'AP008Generator'):
+        """Zera o contador de erros injetados do gerador de um perfil"""
+        gerador.erros_injetados = 0
     
     def _load_config(self, config_path: str) -> Dict:
         """Carrega configuração do arquivo JSON"""
@@ -81,9 +294,6 @@ class AP008Generator:
         date_str = date.strftime("%Y%m%d")
         seq_str = f"{self.sequence:07d}"
         
-        # Cria o diretório se não existir
-        Path(output_dir).mkdir(parents=True, exist_ok=True)
-        
         filename = f"{self.tipo_leiaute}_{self.cnpj_raiz}_{date_str}_{seq_str}.csv"
         return str(Path(output_dir) / filename)
     
@@ -107,7 +317,11 @@ class AP008Generator:
         """Formata valor decimal com número específico de casas decimais"""
         return f"{value:.{decimals}f}"
     
-    def generate_random_record(self, referencia_externa: str, identificador_contrato: str, num_contas: int = None) -> Dict:
+    def generate_random_record(self, referencia_externa: str, identificador_contrato: str, num_contas: int = None,
+                               cnpj_ec: Optional[str] = None, prioridade: Optional[int] = None,
+                               regra_divisao: Optional[str] = None,
+                               data_liquidacao: Optional[datetime] = None,
+                               identificador_efeito: Optional[str] = None) -> Dict:
         """
         Gera um registro aleatório baseado na configuração
         
@@ -115,34 +329,44 @@ class AP008Generator:
             referencia_externa: Referência externa do registro
             identificador_contrato: Identificador do contrato
             num_contas: Número de contas para pagamento (padrão: aleatório entre 1 e 3)
+            cnpj_ec: CNPJ do EC (padrão: sorteado; informado no modo por contrato)
+            prioridade: Indicador de oneração (padrão: sorteado; informado no modo por contrato)
+            regra_divisao: Regra de divisão (padrão: sorteada; informada no modo por contrato)
+            data_liquidacao: Data de liquidação (padrão: data atual + dias_futuros_liquidacao)
+            identificador_efeito: Identificador do efeito (padrão: sorteado; derivado do
+                                  contrato e do índice do efeito no modo por contrato)
         
         Returns:
             Dicionário com os dados do efeito de contrato
         """
         # Seleciona CNPJ de EC aleatório
-        cnpj_ec = random.choice(self.cnpjs_ec)
+        if cnpj_ec is None:
+            cnpj_ec = self.choose_cnpj_ec()
         
         # Número de contas (padrão: 1 a 3)
         if num_contas is None:
             num_contas = random.randint(1, 3)
         
         # Seleciona contas bancárias aleatórias (pode ter múltiplas contas para a mesma UR)
-        contas = random.sample(self.contas_bancarias, min(num_contas, len(self.contas_bancarias)))
+        contas_pagamento = self.choose_contas_indices(num_contas)
         
         # Calcula data de liquidação (data atual + dias futuros)
-        data_liquidacao = datetime.now() + timedelta(days=self.config['dias_futuros_liquidacao'])
+        if data_liquidacao is None:
+            data_liquidacao = datetime.now() + self.settings.prazo_liquidacao
         
         # Gera valores aleatórios
-        valor_maximo = self.config['valor_maximo_pagamento']
+        valor_maximo = self.settings.valor_maximo_pagamento
         valor_pagamento = round(random.uniform(100.00, valor_maximo), 2)
         valor_constituido_total = round(valor_pagamento * random.uniform(1.0, 1.5), 2)
         valor_bloqueado = round(random.uniform(0.0, valor_constituido_total * 0.3), 2)
         
         # Prioridade aleatória (1 até prioridade_maxima)
-        prioridade = random.randint(1, self.config['prioridade_maxima'])
+        if prioridade is None:
+            prioridade = random.randint(1, self.settings.prioridade_maxima)
         
         # Regra de divisão (1 = Valor definido, 2 = Percentual)
-        regra_divisao = random.choice(['1', '2'])
+        if regra_divisao is None:
+            regra_divisao = random.choice(['1', '2'])
         
         if regra_divisao == '1':
             valor_onerado = valor_pagamento
@@ -150,16 +374,17 @@ class AP008Generator:
             valor_onerado = round(random.uniform(10.0, 100.0), 2)  # Percentual
         
         # Arranjo de pagamento aleatório
-        arranjo_pagamento = random.choice(self.config['arranjos_pagamento'])
+        arranjo_pagamento = random.choice(self.settings.arranjos_pagamento)
         
         # Gera protocolo único
         protocolo = f"PROT_{random.randint(100000, 999999)}"
-        identificador_efeito = f"EFEITO_{random.randint(100000, 999999)}"
+        if identificador_efeito is None:
+            identificador_efeito = f"EFEITO_{random.randint(100000, 999999)}"
         
         return {
             'referencia_externa': referencia_externa,
             'identificador_contrato': identificador_contrato,
-            'entidade_registradora': self.config.get('entidade_registradora', '12345678000190'),
+            'entidade_registradora': self.settings.entidade_registradora,
             'instituicao_credenciadora': self.cnpj_credenciadora,
             'usuario_final_recebedor': cnpj_ec,
             'arranjo_pagamento': arranjo_pagamento,
@@ -176,9 +401,26 @@ class AP008Generator:
             'data_hora_evento': datetime.now(),
             'status_operacao': '0',  # 0 = Sucesso
             'valor_constituido_efeito': valor_pagamento,
-            'contas': contas,  # Lista de contas bancárias
+            'contas_pagamento': contas_pagamento,  # Posições das contas bancárias em contas_bancarias
         }
     
+    def format_conta(self, conta: Dict) -> str:
+        """
+        Formata as informações bancárias de uma conta (campos 7.16 a 7.22)
+        
+        Formato: "7.16;7.17;7.18;7.19;7.20;7.21;7.22"
+        """
+        conta_info = [
+            self.format_cpf(conta.get('numero_documento_titular', '12345678901')),
+            conta.get('tipo_conta', self.settings.tipo_conta_padrao),
+            conta.get('compe', self.settings.compe_padrao).zfill(3) if conta.get('compe') else '',
+            conta.get('ispb', self.settings.ispb_padrao).zfill(8),
+            conta.get('agencia', '1234'),
+            conta.get('numero_conta', '123456-7'),
+            conta.get('nome_titular', 'Titular da Conta'),
+        ]
+        return ';'.join(conta_info)
+    
     def format_campo7_lista(self, data: Dict) -> str:
         """
         Formata o campo 7 como lista de contas de pagamento
@@ -199,6 +441,7 @@ class AP008Generator:
             str(data.get('regra_divisao', '')),
             self.format_decimal(data.get('valor_onerado', 0.0)),
             data.get('protocolo', ''),
+            data.get('data_hora_evento_rfc3339') or
             self.format_datetime_rfc3339(data.get('data_hora_evento', datetime.now())),
             str(data.get('status_operacao', '0')),
             str(data.get('codigo_erro', '')) if data.get('status_operacao') == '1' else '',
@@ -206,39 +449,136 @@ class AP008Generator:
             self.format_decimal(data.get('valor_constituido_efeito', 0.0)),
         ]
         
-        # Campos 7.16 a 7.22 (informações bancárias - podem se repetir)
+        # Campos 7.16 a 7.22 (informações bancárias - podem se repetir), já formatados por conta
+        contas_pagamento = data.get('contas_pagamento')
+        if contas_pagamento is not None:
+            contas_formatadas = [self.contas_formatadas[c] for c in contas_pagamento]
+            return ';'.join(campo7_base) + ';' + '|'.join(contas_formatadas)
+        
         contas = data.get('contas', [])
         if not contas:
             # Se não houver contas, cria uma padrão
             contas = [{
                 'numero_documento_titular': '12345678901',
-                'tipo_conta': self.config.get('tipo_conta_padrao', 'CC'),
-                'compe': self.config.get('compe_padrao', '001'),
-                'ispb': self.config.get('ispb_padrao', '12345678'),
+                'tipo_conta': self.settings.tipo_conta_padrao,
+                'compe': self.settings.compe_padrao,
+                'ispb': self.settings.ispb_padrao,
                 'agencia': '1234',
                 'numero_conta': '123456-7',
                 'nome_titular': 'Titular da Conta',
             }]
         
         # Formata cada conta (campos 7.16-7.22)
-        contas_formatadas = []
-        for conta in contas:
-            conta_info = [
-                self.format_cpf(conta.get('numero_documento_titular', '12345678901')),
-                conta.get('tipo_conta', self.config.get('tipo_conta_padrao', 'CC')),
-                conta.get('compe', self.config.get('compe_padrao', '001')).zfill(3) if conta.get('compe') else '',
-                conta.get('ispb', self.config.get('ispb_padrao', '12345678')).zfill(8),
-                conta.get('agencia', '1234'),
-                conta.get('numero_conta', '123456-7'),
-                conta.get('nome_titular', 'Titular da Conta'),
-            ]
-            contas_formatadas.append(';'.join(conta_info))
+        contas_formatadas = [self.format_conta(conta) for conta in contas]
         
         # Junta tudo: campos base + lista de contas separadas por |
         # O CSV writer adiciona aspas automaticamente quando detecta caracteres especiais como |
         campo7_completo = ';'.join(campo7_base) + ';' + '|'.join(contas_formatadas)
         return campo7_completo
     
+    def _expected_decimal_len(self, low: float, high: float) -> float:
+        """
+        Tamanho esperado (em caracteres) de format_decimal(x) para x uniforme em [low, high]
+        
+        Soma, para cada faixa de dígitos inteiros, a probabilidade da faixa vezes o
+        tamanho do texto formatado ("d...d.dd").
+        """
+        if high <= low:
+            return len(self.format_decimal(low))
+        esperado = 0.0
+        inicio = 0.0
+        digitos = 1
+        while inicio < high:
+            fim = 10.0 ** digitos
+            sobreposicao = min(fim, high) - max(inicio, low)
+            if sobreposicao > 0:
+                esperado += (sobreposicao / (high - low)) * (digitos + 3)
+            inicio = fim
+            digitos += 1
+        return esperado
+    
+    def estimate_row_size(self) -> float:
+        """
+        Estima o tamanho médio (em bytes) de uma linha do arquivo AP008
+        
+        A estimativa usa o leiaute (tamanhos fixos de CNPJ, datas, protocolos),
+        as médias dos arquivos de CNPJs e contas carregados, os limites de valores
+        da configuração e a distribuição de contas por efeito (1 a 3, uniforme).
+        
+        Returns:
+            Tamanho médio estimado de uma linha, em bytes (inclui aspas e fim de linha)
+        """
+        valor_maximo = self.settings.valor_maximo_pagamento
+        prioridade_maxima = self.settings.prioridade_maxima
+        arranjos = self.settings.arranjos_pagamento
+        
+        def media(valores: List[int]) -> float:
+            return sum(valores) / len(valores)
+        
+        tamanho_cnpj_ec = media([len(self.format_cnpj(c).encode('utf-8')) for c in self.cnpjs_ec])
+        tamanho_conta = media([len(c.encode('utf-8')) for c in self.contas_formatadas])
+        tamanho_arranjo = media([len(a.encode('utf-8')) for a in arranjos])
+        tamanho_prioridade = media([len(str(p)) for p in range(1, prioridade_maxima + 1)])
+        
+        # Valores monetários (valor_constituido_total usa o multiplicador médio de 1.25)
+        tamanho_pagamento = self._expected_decimal_len(100.00, valor_maximo)
+        tamanho_total = self._expected_decimal_len(125.00, valor_maximo * 1.25)
+        tamanho_bloqueado = self._expected_decimal_len(0.0, valor_maximo * 1.25 * 0.3)
+        # Regra 1 repete o valor do pagamento; regra 2 é um percentual entre 10 e 100
+        tamanho_onerado = (tamanho_pagamento + self._expected_decimal_len(10.0, 100.0)) / 2
+        
+        # Número esperado de contas por efeito: min(randint(1, 3), contas disponíveis)
+        num_contas = media([min(n, len(self.contas_bancarias)) for n in (1, 2, 3)])
+        
+        # Identificadores do contrato e do efeito (no modo por contrato, sequenciais:
+        # contrato com 9 dígitos e efeito = contrato + índice do efeito com 5 dígitos)
+        if self.config.get('modo_contratos'):
+            tamanho_contrato = len("CONTRATO_000000000")
+            tamanho_efeito = len("EFEITO_000000000_00000")
+        else:
+            tamanho_contrato = len("CONTRATO_00000")
+            tamanho_efeito = len("EFEITO_000000")
+        
+        # Campos 1 a 6 + 6 separadores
+        campos_base = (
+            len("REF_EXTERNA_000000") +
+            tamanho_contrato +
+            14 + 14 + tamanho_cnpj_ec + tamanho_arranjo + 6
+        )
+        
+        # Campos 7.1 a 7.15 + 15 separadores (o último antecede a lista de contas);
+        # código e descrição do erro ficam vazios pois status_operacao = 0
+        campo7_base = (
+            tamanho_efeito + len("AAAA-MM-DD") + tamanho_cnpj_ec + 1 +
+            tamanho_total + tamanho_bloqueado + tamanho_prioridade + 1 +
+            tamanho_onerado + len("PROT_000000") +
+            len(self.format_datetime_rfc3339(datetime(2000, 1, 1, 0, 0, 0, 1))) +
+            1 + tamanho_pagamento + 15
+        )
+        
+        # Campos 7.16 a 7.22 por conta, separados por |
+        campo7_contas = num_contas * tamanho_conta + (num_contas - 1)
+        
+        # Aspas do campo 7 e terminador de linha CRLF do csv.writer
+        return campos_base + campo7_base + campo7_contas + 2 + 2
+    
+    def estimate_file_size(self, num_records: int) -> int:
+        """
+        Estima o tamanho (em bytes) de um arquivo AP008 com num_records registros
+        
+        Args:
+            num_records: Número de registros
+        
+        Returns:
+            Tamanho estimado do arquivo, em bytes
+        """
+        # Ajusta para referências externas com mais de 6 dígitos (REF_EXTERNA_NNNNNN)
+        extra_referencia = sum(
+            num_records - 10 ** digitos + 1
+            for digitos in range(6, len(str(num_records)))
+        )
+        return int(round(self.estimate_row_size() * num_records + extra_referencia))
+    
     def generate_row(self, data: Dict) -> List[str]:
         """
         Gera uma linha do arquivo AP008
@@ -264,77 +604,313 @@ class AP008Generator:
         
         return campos_base + [campo7]
     
+    def _draw_fan_out(self, modo: Dict) -> int:
+        """Sorteia a quantidade de efeitos de um contrato conforme o modo por contrato"""
+        minimo = int(modo.get('efeitos_min', 1))
+        maximo = int(modo.get('efeitos_max', 12))
+        if modo.get('distribuicao_efeitos', 'uniforme') == 'geometrica':
+            # Geométrica truncada em [minimo, maximo] com média aproximada media_efeitos
+            excesso_medio = float(modo.get('media_efeitos', (minimo + maximo) / 2)) - minimo
+            if excesso_medio <= 0:
+                return minimo
+            p = 1.0 / (excesso_medio + 1.0)
+            excesso = int(math.log(1.0 - random.random()) / math.log(1.0 - p))
+            return min(maximo, minimo + excesso)
+        return random.randint(minimo, maximo)
+    
+    def plan_contracts(self, num_efeitos: int) -> ContractPlan:
+        """
+        Sorteia os contratos do modo por contrato até cobrir num_efeitos efeitos
+        
+        Cada contrato recebe um EC, uma prioridade (indicador_oneracao) e uma regra
+        de divisão, compartilhados por todos os seus efeitos, e a quantidade de efeitos
+        (fan-out). O último contrato é truncado para fechar exatamente num_efeitos.
+        
+        Args:
+            num_efeitos: Quantidade total de efeitos (linhas do arquivo)
+        
+        Returns:
+            Plano de contratos
+        """
+        modo = self.config['modo_contratos']
+        if int(modo.get('efeitos_max', 12)) > 65535 or int(modo.get('efeitos_min', 1)) < 1:
+            raise ValueError("efeitos_min deve ser >= 1 e efeitos_max <= 65535")
+        
+        plano = ContractPlan()
+        prioridade_maxima = self.settings.prioridade_maxima
+        restante = num_efeitos
+        while restante > 0:
+            efeitos = min(self._draw_fan_out(modo), restante)
+            plano.add(
+                self.choose_cnpj_ec_index(),
+                random.randint(1, prioridade_maxima),
+                random.randint(1, 2),
+                efeitos,
+            )
+            restante -= efeitos
+        return plano
+    
+    def iter_contract_effects(self, plano: ContractPlan) -> Iterator[Tuple[int, int]]:
+        """
+        Percorre os efeitos do plano na ordem de emissão configurada
+        
+        Na ordem "contigua", os efeitos de cada contrato saem em sequência; na ordem
+        "intercalada", efeitos de contratos diferentes são embaralhados no arquivo
+        (mantendo a numeração crescente dos efeitos de cada contrato).
+        
+        Yields:
+            Tuplas (índice do contrato, índice do efeito dentro do contrato)
+        """
+        ordem = self.config['modo_contratos'].get('ordem', 'contigua')
+        if ordem == 'contigua':
+            for contrato, efeitos in enumerate(plano.efeitos):
+                for efeito in range(efeitos):
+                    yield contrato, efeito
+        elif ordem == 'intercalada':
+            sequencia = array('I')
+            for contrato, efeitos in enumerate(plano.efeitos):
+                sequencia.extend(itertools.repeat(contrato, efeitos))
+            random.shuffle(sequencia)
+            emitidos = plano.emitidos
+            for contrato in sequencia:
+                efeito = emitidos[contrato]
+                emitidos[contrato] = efeito + 1
+                yield contrato, efeito
+        else:
+            raise ValueError(f"Ordem de emissão desconhecida: {ordem}")
+    
+    def iter_random_records(self, num_records: int, inicio_referencia: int = 0) -> Iterator[Dict]:
+        """Gera registros independentes (um contrato aleatório por efeito), com referências a partir de inicio_referencia + 1"""
+        for i in range(inicio_referencia, inicio_referencia + num_records):
+            referencia_externa = f"REF_EXTERNA_{i+1:06d}"
+            identificador_contrato = f"CONTRATO_{random.randint(10000, 99999)}"
+            yield self.generate_random_record(referencia_externa, identificador_contrato)
+    
+    def iter_contract_records(self, num_records: int, date: datetime) -> Iterator[Dict]:
+        """
+        Gera registros no modo por contrato (vários efeitos por contrato)
+        
+        Os efeitos de um contrato compartilham EC, indicador_oneracao e regra de
+        divisão, são identificados por EFEITO_<contrato>_<índice do efeito> (únicos no
+        arquivo), e se distribuem por datas de liquidação sucessivas a partir de
+        date + dias_futuros_liquidacao, espaçadas por intervalo_dias_liquidacao.
+        
+        Args:
+            num_records: Quantidade total de efeitos (linhas do arquivo)
+            date: Data de referência do arquivo
+        """
+        modo = self.config['modo_contratos']
+        intervalo = int(modo.get('intervalo_dias_liquidacao', 1))
+        primeira_liquidacao = date + self.settings.prazo_liquidacao
+        
+        plano = self.plan_contracts(num_records)
+        for i, (contrato, efeito) in enumerate(self.iter_contract_effects(plano)):
+            yield self.generate_random_record(
+                f"REF_EXTERNA_{i+1:06d}",
+                f"CONTRATO_{contrato+1:09d}",
+                cnpj_ec=self.cnpjs_ec[plano.ec[contrato]],
+                prioridade=plano.prioridade[contrato],
+                regra_divisao=str(plano.regra_divisao[contrato]),
+                data_liquidacao=primeira_liquidacao + timedelta(days=efeito * intervalo),
+                identificador_efeito=f"EFEITO_{contrato+1:09d}_{efeito+1:05d}",
+            )
+    
+    def write_error_sidecar(self, output_path: str, erros: List[Tuple[int, str, str]]):
+        """
+        Grava as posições dos erros injetados em <arquivo>.erros.csv
+        
+        Colunas: linha (a partir de 1), referencia_externa e tipo_erro, uma linha por
+        erro (uma linha do AP008 pode ter mais de um erro). A escrita é atômica, como
+        a do arquivo principal, e deve terminar antes de ele ser publicado (ver
+        generate_file), para que o AP008 nunca apareça sem o seu arquivo de erros.
+        """
+        with self._open_output_atomic(output_path + '.erros.csv', marcador_done=False) as f:
+            writer = csv.writer(f, delimiter=';')
+            writer.writerow(['linha', 'referencia_externa', 'tipo_erro'])
+            writer.writerows(erros)
+    
+    def write_part(self, output_path: str, num_records: int, inicio_referencia: int,
+                   date: datetime, faixa_horarios: Optional[Tuple[float, float]] = None):
+        """
+        Grava uma parte de um arquivo gerado em partes, com registros aleatórios
+        
+        Args:
+            output_path: Caminho do arquivo da parte
+            num_records: Quantidade de registros da parte
+            inicio_referencia: Quantidade de registros das partes anteriores (numera as referências externas)
+            date: Data de referência
+            faixa_horarios: Faixa da curva de horários da parte (ver TimestampGenerator.plan_parts)
+        """
+        horarios = None
+        if self.gerador_horarios is not None:
+            horarios = self.gerador_horarios.iter_timestamps(num_records, date, faixa_horarios)
+        tamanho_buffer = int(self.config.get('tamanho_buffer_saida_kb', 1024)) * 1024
+        with open(output_path, 'w', newline='', encoding='utf-8', buffering=tamanho_buffer) as f:
+            writer = csv.writer(f, delimiter=';', quoting=csv.QUOTE_MINIMAL)
+            for record in self.iter_random_records(num_records, inicio_referencia):
+                if horarios is not None:
+                    record['data_hora_evento'], record['data_hora_evento_rfc3339'] = next(horarios)
+                writer.writerow(self.generate_row(record))
+    
+    def _check_sharded_mode(self):
+        """Na geração em partes, só o modo padrão de registros aleatórios é suportado"""
+        if self.config.get('modo_contratos') or self.injetor_erros is not None:
+            raise ValueError("partes_arquivo não é suportado com modo_contratos ou injecao_erros")
+    
     def generate_file(self, num_records: int, output_path: Optional[str] = None, 
-                     date: Optional[datetime] = None, output_dir: str = "ap008_output") -> str:
+                     date: Optional[datetime] = None, output_dir: str = "ap008_output",
+                     tamanho_estimado: Optional[int] = None) -> str:
         """
         Gera o arquivo AP008 com registros aleatórios
         
+        Com injecao_erros configurado, parte das linhas recebe erros nas taxas
+        configuradas (ver ErrorInjector) e as posições são gravadas em
+        <arquivo>.erros.csv; a quantidade fica em self.erros_injetados.
+        
         Args:
             num_records: Número de registros a gerar
             output_path: Caminho de saída (opcional, gera automaticamente se não informado)
             date: Data de referência (padrão: data atual)
             output_dir: Diretório de saída (padrão: ap008_output)
+            tamanho_estimado: Tamanho estimado em bytes para pré-alocação do arquivo
+                (padrão: calculado por estimate_file_size)
         
         Returns:
             Caminho do arquivo gerado
         """
         if output_path is None:
             output_path = self.generate_filename(date, output_dir)
+        if not self._is_stream_output(output_path):
+            Path(output_path).parent.mkdir(parents=True, exist_ok=True)
         
         if date is None:
             date = datetime.now()
         
-        records = []
-        for i in range(num_records):
-            referencia_externa = f"REF_EXTERNA_{i+1:06d}"
-            identificador_contrato = f"CONTRATO_{random.randint(10000, 99999)}"
-            record = self.generate_random_record(referencia_externa, identificador_contrato)
-            records.append(record)
+        # Geração em partes paralelas, concatenadas no arquivo final
+        if int(self.config.get('partes_arquivo', 1)) > 1:
+            return self.generate_sharded_file(num_records, output_path, date)
         
-        with open(output_path, 'w', newline='', encoding='utf-8') as csvfile:
+        if tamanho_estimado is None:
+            tamanho_estimado = self.estimate_file_size(num_records)
+        
+        # Horários conforme a curva configurada, sorteados em blocos à medida que são escritos (data_hora_evento)
+        horarios = None
+        if self.gerador_horarios is not None:
+            horarios = self.gerador_horarios.iter_timestamps(num_records, date)
+        
+        # Registros gerados sob demanda (sem materializar o arquivo inteiro em memória)
+        if self.config.get('modo_contratos'):
+            records = self.iter_contract_records(num_records, date)
+        else:
+            records = self.iter_random_records(num_records)
+        
+        # Linhas com erro sorteadas antes da escrita (vazio = arquivo limpo)
+        if self.injetor_erros is not None and output_path == '-':
+            raise ValueError("injecao_erros não é suportado com saída em stdout (o arquivo .erros.csv acompanha a saída)")
+        mascara = self.injetor_erros.build_mask(num_records) if self.injetor_erros else {}
+        erros = []
+        
+        # Escreve em arquivo temporário e renomeia ao final (escrita atômica)
+        with self._open_output_atomic(output_path, tamanho_estimado) as csvfile:
             # Usa ponto e vírgula como delimitador conforme especificação CERC
             # QUOTE_MINIMAL adiciona aspas apenas quando necessário (ex: quando há | no campo)
             writer = csv.writer(csvfile, delimiter=';', quoting=csv.QUOTE_MINIMAL)
             
             # Escreve os registros
-            for record in records:
+            for i, record in enumerate(records):
+                if horarios is not None:
+                    record['data_hora_evento'], record['data_hora_evento_rfc3339'] = next(horarios)
+                tipos_erro = mascara.get(i)
+                if tipos_erro is None:
+                    writer.writerow(self.generate_row(record))
+                    continue
+                
+                self.injetor_erros.apply_record(record, tipos_erro)
                 row = self.generate_row(record)
+                self.injetor_erros.apply_row(row, tipos_erro)
                 writer.writerow(row)
+                erros.extend((i + 1, record['referencia_externa'], tipo) for tipo in tipos_erro)
+            
+            # Arquivo de erros publicado antes do AP008 (renomeado ao sair deste bloco)
+            if self.injetor_erros is not None:
+                self.write_error_sidecar(output_path, erros)
         
+        self.erros_injetados = len(erros)
         return output_path
 
 
 def main():
     """Função principal"""
-    import sys
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Gera arquivo AP008 da CERC")
+    parser.add_argument('quantidade_registros', nargs='?', type=int,
+                        help="Quantidade de registros (padrão: valor do JSON ou 10)")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="Apenas estima o tamanho do arquivo, sem gerá-lo")
+    parser.add_argument('--continuo', action='store_true',
+                        help="Gera arquivos continuamente na taxa de modo_continuo (Ctrl+C para parar)")
+    parser.add_argument('--output',
+                        help="Caminho de saída; '-' para stdout ou um pipe nomeado (padrão: ap008_output/<nome CERC>)")
+    args = parser.parse_args()
+    if args.output is not None and args.continuo:
+        parser.error("--output não pode ser usado com --continuo")
     
     try:
         # Inicializa o gerador com configuração
         generator = AP008Generator("generate_ap008.json")
         
         # Número de registros a gerar (prioridade: linha de comando > config > padrão 10)
-        if len(sys.argv) > 1:
-            num_records = int(sys.argv[1])
+        if args.quantidade_registros is not None:
+            num_records = args.quantidade_registros
         else:
             num_records = generator.config.get('quantidade_registros', 10)
         
-        # Gera o arquivo
-        output_file = generator.generate_file(num_records)
+        if args.dry_run:
+            tamanho_linha = generator.estimate_row_size()
+            tamanho_arquivo = generator.estimate_file_size(num_records)
+            print("Estimativa de tamanho do arquivo AP008 (nenhum arquivo gerado)", file=sys.stderr)
+            print(f"Total de registros: {num_records}", file=sys.stderr)
+            print(f"Tamanho médio por linha: {tamanho_linha:.1f} bytes", file=sys.stderr)
+            print(f"Tamanho estimado do arquivo: {tamanho_arquivo} bytes ({tamanho_arquivo / 1024 ** 2:.2f} MiB)", file=sys.stderr)
+            return
+        
+        # Modo contínuo: arquivos publicados na taxa de modo_continuo até Ctrl+C
+        if args.continuo:
+            print_continuous_report(generator.run_continuous(num_records, relatorio=print_continuous_report))
+            return
+        
+        # Modo multi-tenant: um arquivo por perfil, com as listas carregadas uma única vez
+        if generator.perfis:
+            if args.output is not None:
+                parser.error("--output não pode ser usado com perfis")
+            resultados = generator.generate_profiles(args.quantidade_registros)
+            for cnpj_credenciadora, output_file, total in resultados:
+                print(f"Arquivo AP008 gerado com sucesso: {output_file} ({total} registros, credenciadora {cnpj_credenciadora})", file=sys.stderr)
+            print(f"Perfis gerados: {len(resultados)}", file=sys.stderr)
+            return
         
-        print(f"Arquivo AP008 gerado com sucesso: {output_file}")
-        print(f"Total de registros: {num_records}")
-        print(f"CNPJ Credenciadora: {generator.cnpj_credenciadora}")
-        print(f"CNPJs de EC disponíveis: {len(generator.cnpjs_ec)}")
-        print(f"Contas bancárias disponíveis: {len(generator.contas_bancarias)}")
+        # Gera o arquivo
+        output_file = generator.generate_file(num_records, output_path=args.output)
+        
+        print(f"Arquivo AP008 gerado com sucesso: {output_file}", file=sys.stderr)
+        print(f"Total de registros: {num_records}", file=sys.stderr)
+        if int(generator.config.get('partes_arquivo', 1)) > 1:
+            print(f"Partes concatenadas: {generator.config['partes_arquivo']} ({generator.metodo_concatenacao})", file=sys.stderr)
+        print(f"CNPJ Credenciadora: {generator.cnpj_credenciadora}", file=sys.stderr)
+        print(f"CNPJs de EC disponíveis: {len(generator.cnpjs_ec)}", file=sys.stderr)
+        print(f"Contas bancárias disponíveis: {len(generator.contas_bancarias)}", file=sys.stderr)
+        if generator.injetor_erros is not None:
+            print(f"Erros injetados: {generator.erros_injetados} (posições em {output_file}.erros.csv)", file=sys.stderr)
         
     except FileNotFoundError as e:
-        print(f"Erro: Arquivo não encontrado - {e}")
-        print("Certifique-se de que os arquivos de configuração existem:")
-        print("  - generate_ap008.json")
-        print("  - cnpjs_estabelecimentos.csv")
-        print("  - contas_bancarias.csv")
+        print(f"Erro: Arquivo não encontrado - {e}", file=sys.stderr)
+        print("Certifique-se de que os arquivos de configuração existem:", file=sys.stderr)
+        print("  - generate_ap008.json", file=sys.stderr)
+        print("  - cnpjs_estabelecimentos.csv", file=sys.stderr)
+        print("  - contas_bancarias.csv", file=sys.stderr)
     except Exception as e:
-        print(f"Erro ao gerar arquivo: {e}")
+        print(f"Erro ao gerar arquivo: {e}", file=sys.stderr)
         import traceback
         traceback.print_exc()
 
@@ -6,16 +6,90 @@ RETORNO DE INFORMAÇÕES CONCILIADA DE AGENDA
 """
 
 import csv
+import heapq
 import json
+import math
 import random
+import sys
+import tempfile
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+from itertools import islice
+from typing import Iterable, Iterator, List, Dict, Optional
 from pathlib import Path
 
+# Módulos compartilhados entre os geradores (pasta common/ na raiz do repositório)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from common.output import OutputFileMixin
+from common.sampling import WeightedPoolMixin
 
-class AP010Generator:
+
+class SortedRunDeduplicator:
+    """
+    Deduplicação de chaves com memória limitada, por ordenação externa
+    
+    As chaves são acumuladas num conjunto em memória de até tamanho_lote itens;
+    ao encher, o conjunto é ordenado e gravado num arquivo temporário (run). Na
+    leitura, as runs são intercaladas (heapq.merge) e chaves repetidas entre runs
+    são descartadas, produzindo as chaves distintas em ordem crescente. Se tudo
+    couber num único lote, nenhum arquivo é gravado.
+    """
+    
+    def __init__(self, tamanho_lote: int = 1000000, diretorio_tmp: Optional[str] = None):
+        """
+        Args:
+            tamanho_lote: Máximo de chaves mantidas em memória
+            diretorio_tmp: Diretório das runs (padrão: diretório temporário do sistema)
+        """
+        if tamanho_lote < 1:
+            raise ValueError("tamanho_lote_deduplicacao deve ser maior ou igual a 1")
+        self.tamanho_lote = tamanho_lote
+        self.diretorio_tmp = diretorio_tmp
+        self.lote = set()
+        self.runs = []
+    
+    def add(self, chave: bytes):
+        """Acrescenta uma chave (sem quebra de linha)"""
+        self.lote.add(chave)
+        if len(self.lote) >= self.tamanho_lote:
+            self._flush()
+    
+    def _flush(self):
+        """Grava o lote atual, ordenado, numa run temporária"""
+        run = tempfile.TemporaryFile(mode='w+b', dir=self.diretorio_tmp)
+        run.writelines(chave + b'\n' for chave in sorted(self.lote))
+        run.seek(0)
+        self.runs.append(run)
+        self.lote = set()
+    
+    def __iter__(self) -> Iterator[bytes]:
+        """Chaves distintas em ordem crescente (as runs são fechadas ao final)"""
+        if not self.runs:
+            yield from sorted(self.lote)
+            self.lote = set()
+            return
+        
+        if self.lote:
+            self._flush()
+        try:
+            anterior = None
+            for linha in heapq.merge(*self.runs):
+                if linha != anterior:
+                    anterior = linha
+                    yield linha[:-1]
+        finally:
+            for run in self.runs:
+                run.close()
+            self.runs = []
+
+
+class AP010Generator(OutputFileMixin, WeightedPoolMixin):
     """Gerador de arquivos AP010 da CERC"""
     
+    # Divisões da linha AP005 necessárias para isolar os campos 4 a 7 da chave de agenda,
+    # e índice (a partir de 0) do campo 12, o primeiro que pode vir entre aspas
+    DIVISOES_CHAVE_AP005 = 7
+    INDICE_CAMPO12_AP005 = 11
+    
     def __init__(self, config_path: str = "generate_ap010.json"):
         """
         Inicializa o gerador com configuração do arquivo JSON
@@ -28,6 +102,7 @@ class AP010Generator:
         self.cnpj_raiz = self.cnpj_credenciadora[:8]
         self.sequence = 1
         self.tipo_leiaute = "CERC-AP010"
+        self.total_registros = 0
         
         # Carrega listas de dados
         self.cnpjs_ec = self._load_cnpjs_ec(self.config['arquivo_cnpjs_ec'])
@@ -35,6 +110,12 @@ class AP010Generator:
         # Validações
         if not self.cnpjs_ec:
             raise ValueError(f"Nenhum CNPJ de EC encontrado em {self.config['arquivo_cnpjs_ec']}")
+        
+        # Amostrador ponderado (None = seleção uniforme)
+        self.amostrador_ec = self._build_sampler(
+            self.config.get('distribuicao_cnpjs_ec'), len(self.cnpjs_ec),
+            self.config['arquivo_cnpjs_ec'], chave='cnpj'
+        )
     
     def _load_config(self, config_path: str) -> Dict:
         """Carrega configuração do arquivo JSON"""
@@ -69,9 +150,6 @@ class AP010Generator:
         date_str = date.strftime("%Y%m%d")
         seq_str = f"{self.sequence:07d}"
         
-        # Cria o diretório se não existir
-        Path(output_dir).mkdir(parents=True, exist_ok=True)
-        
         filename = f"{self.tipo_leiaute}_{self.cnpj_raiz}_{date_str}_{seq_str}_ret.csv"
         return str(Path(output_dir) / filename)
     
@@ -102,7 +180,7 @@ class AP010Generator:
             Dicionário com os dados da conciliação de agenda
         """
         # Seleciona CNPJ de EC aleatório
-        cnpj_ec = random.choice(self.cnpjs_ec)
+        cnpj_ec = self.choose_cnpj_ec()
         
         # Arranjo de pagamento aleatório
         arranjo_pagamento = random.choice(self.config['arranjos_pagamento'])
@@ -120,6 +198,117 @@ class AP010Generator:
             'titular': cnpj_ec,
         }
     
+    def _ap005_paths(self) -> List[str]:
+        """Arquivos AP005 configurados em arquivo_ap005 (caminho ou lista de caminhos)"""
+        arquivos = self.config['arquivo_ap005']
+        if isinstance(arquivos, str):
+            arquivos = [arquivos]
+        if not arquivos:
+            raise ValueError("arquivo_ap005 não informa nenhum arquivo")
+        return list(arquivos)
+    
+    def iter_ap005_keys(self, paths: Iterable[str]) -> Iterator[bytes]:
+        """
+        Lê arquivos AP005 em streaming e extrai a chave de agenda de cada UR
+        
+        A chave é formada pelos campos 4 a 7 do AP005 (usuario_final_recebedor,
+        arranjo_pagamento, data_liquidacao, titular), mantidos como bytes separados
+        por ponto e vírgula. Só o campo 12 (lista de informações de pagamento, com
+        ponto e vírgula internos) sai entre aspas do csv.writer; os campos 1 a 11 são
+        documentos, códigos, datas e valores, sem separador nem aspas. Por isso a
+        linha é dividida apenas até o campo 7, antes de qualquer campo entre aspas,
+        sem passar pelo módulo csv.
+        
+        Args:
+            paths: Caminhos dos arquivos AP005
+        
+        Yields:
+            Chave da UR (b"usuario;arranjo;data;titular")
+        """
+        divisoes = self.DIVISOES_CHAVE_AP005
+        # A divisão simples só vale enquanto não alcança o campo entre aspas
+        assert divisoes < self.INDICE_CAMPO12_AP005
+        for path in paths:
+            with open(path, 'rb') as f:
+                for linha in f:
+                    campos = linha.split(b';', divisoes)
+                    if len(campos) <= divisoes:
+                        continue  # Linha vazia ou truncada
+                    yield b';'.join(campos[3:7])
+    
+    def iter_unique_ap005_keys(self) -> Iterator[bytes]:
+        """Chaves de agenda distintas dos arquivos AP005, em ordem crescente"""
+        deduplicador = SortedRunDeduplicator(
+            self.config.get('tamanho_lote_deduplicacao', 1000000),
+            self.config.get('diretorio_temporario'),
+        )
+        for chave in self.iter_ap005_keys(self._ap005_paths()):
+            deduplicador.add(chave)
+        return iter(deduplicador)
+    
+    def reservoir_sample(self, itens: Iterator, k: int) -> List:
+        """
+        Amostra uniforme de k itens de um fluxo de tamanho desconhecido (Algoritmo L)
+        
+        Em vez de sortear um número por item, sorteia quantos itens pular até a
+        próxima substituição; os itens pulados são consumidos por islice.
+        
+        Args:
+            itens: Iterador de itens
+            k: Tamanho da amostra
+        
+        Returns:
+            Lista com até k itens (todos, se o fluxo tiver menos de k)
+        """
+        amostra = list(islice(itens, k))
+        if len(amostra) < k or k == 0:
+            return amostra
+        
+        peso = math.exp(math.log(1.0 - random.random()) / k)
+        while peso < 1.0:
+            salto = int(math.log(1.0 - random.random()) / math.log(1.0 - peso))
+            item = next(islice(itens, salto, None), None)
+            if item is None:
+                break
+            amostra[random.randrange(k)] = item
+            peso *= math.exp(math.log(1.0 - random.random()) / k)
+        return amostra
+    
+    def iter_random_records(self, num_records: int) -> Iterator[Dict]:
+        """Gera num_records registros aleatórios"""
+        for i in range(num_records):
+            yield self.generate_random_record(f"REF_{i+1:06d}")
+    
+    def iter_ap005_records(self, num_records: int, date: datetime) -> Iterator[Dict]:
+        """
+        Gera a conciliação das agendas efetivamente enviadas nos arquivos AP005
+        
+        Com emitir_todas_urs, concilia todas as URs distintas; caso contrário, uma
+        amostra uniforme de num_records URs distintas. A saída segue a ordem das chaves.
+        
+        Args:
+            num_records: Tamanho da amostra (ignorado com emitir_todas_urs)
+            date: Data de referência da conciliação
+        
+        Yields:
+            Dicionários com os dados da conciliação de agenda
+        """
+        chaves = self.iter_unique_ap005_keys()
+        if not self.config.get('emitir_todas_urs', False):
+            chaves = sorted(self.reservoir_sample(chaves, num_records))
+        
+        for i, chave in enumerate(chaves):
+            usuario, arranjo, data_liquidacao, titular = chave.decode('utf-8').split(';')
+            yield {
+                'referencia_externa': f"REF_{i+1:06d}",
+                'data_referencia': date,
+                'credenciadora': self.cnpj_credenciadora,
+                'usuario_final_recebedor': usuario,
+                'arranjo_pagamento': arranjo,
+                'data_liquidacao': datetime.fromisoformat(data_liquidacao),
+                'titular': titular,
+            }
+    
     def generate_row(self, data: Dict) -> List[str]:
         """
         Gera uma linha do arquivo AP010
@@ -141,32 +330,40 @@ class AP010Generator:
         ]
     
     def generate_file(self, num_records: int, output_path: Optional[str] = None, 
-                     date: Optional[datetime] = None, output_dir: str = "ap010_output") -> str:
+                     date: Optional[datetime] = None, output_dir: str = "ap010_output",
+                     tamanho_estimado: Optional[int] = None) -> str:
         """
         Gera o arquivo AP010 com registros aleatórios
         
+        Com arquivo_ap005 configurado, os registros conciliam URs lidas dos arquivos
+        AP005 (ver iter_ap005_records); o total escrito fica em self.total_registros.
+        
         Args:
             num_records: Número de registros a gerar
             output_path: Caminho de saída (opcional, gera automaticamente se não informado)
             date: Data de referência (padrão: data atual)
             output_dir: Diretório de saída (padrão: ap010_output)
+            tamanho_estimado: Tamanho estimado em bytes para pré-alocação do arquivo (opcional)
         
         Returns:
             Caminho do arquivo gerado
         """
         if output_path is None:
             output_path = self.generate_filename(date, output_dir)
+        if not self._is_stream_output(output_path):
+            Path(output_path).parent.mkdir(parents=True, exist_ok=True)
         
         if date is None:
             date = datetime.now()
         
-        records = []
-        for i in range(num_records):
-            referencia_externa = f"REF_{i+1:06d}"
-            record = self.generate_random_record(referencia_externa)
-            records.append(record)
+        if self.config.get('arquivo_ap005'):
+            records = self.iter_ap005_records(num_records, date)
+        else:
+            records = self.iter_random_records(num_records)
         
-        with open(output_path, 'w', newline='', encoding='utf-8') as csvfile:
+        self.total_registros = 0
+        # Escreve em arquivo temporário e renomeia ao final (escrita atômica)
+        with self._open_output_atomic(output_path, tamanho_estimado) as csvfile:
             # Usa ponto e vírgula como delimitador conforme especificação CERC
             writer = csv.writer(csvfile, delimiter=';', quoting=csv.QUOTE_MINIMAL)
             
@@ -174,39 +371,47 @@ class AP010Generator:
             for record in records:
                 row = self.generate_row(record)
                 writer.writerow(row)
+                self.total_registros += 1
         
         return output_path
 
 
 def main():
     """Função principal"""
-    import sys
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Gera arquivo AP010 da CERC")
+    parser.add_argument('quantidade_registros', nargs='?', type=int,
+                        help="Quantidade de registros (padrão: valor do JSON ou 10)")
+    parser.add_argument('--output',
+                        help="Caminho de saída; '-' para stdout ou um pipe nomeado (padrão: ap010_output/<nome CERC>)")
+    args = parser.parse_args()
     
     try:
         # Inicializa o gerador com configuração
         generator = AP010Generator("generate_ap010.json")
         
         # Número de registros a gerar (prioridade: linha de comando > config > padrão 10)
-        if len(sys.argv) > 1:
-            num_records = int(sys.argv[1])
+        if args.quantidade_registros is not None:
+            num_records = args.quantidade_registros
         else:
             num_records = generator.config.get('quantidade_registros', 10)
         
         # Gera o arquivo
-        output_file = generator.generate_file(num_records)
+        output_file = generator.generate_file(num_records, output_path=args.output)
         
-        print(f"Arquivo AP010 gerado com sucesso: {output_file}")
-        print(f"Total de registros: {num_records}")
-        print(f"CNPJ Credenciadora: {generator.cnpj_credenciadora}")
-        print(f"CNPJs de EC disponíveis: {len(generator.cnpjs_ec)}")
+        print(f"Arquivo AP010 gerado com sucesso: {output_file}", file=sys.stderr)
+        print(f"Total de registros: {generator.total_registros}", file=sys.stderr)
+        print(f"CNPJ Credenciadora: {generator.cnpj_credenciadora}", file=sys.stderr)
+        print(f"CNPJs de EC disponíveis: {len(generator.cnpjs_ec)}", file=sys.stderr)
         
     except FileNotFoundError as e:
-        print(f"Erro: Arquivo não encontrado - {e}")
-        print("Certifique-se de que os arquivos de configuração existem:")
-        print("  - generate_ap010.json")
-        print("  - cnpjs_estabelecimentos.csv")
+        print(f"Erro: Arquivo não encontrado - {e}", file=sys.stderr)
+        print("Certifique-se de que os arquivos de configuração existem:", file=sys.stderr)
+        print("  - generate_ap010.json", file=sys.stderr)
+        print("  - cnpjs_estabelecimentos.csv", file=sys.stderr)
     except Exception as e:
-        print(f"Erro ao gerar arquivo: {e}")
+        print(f"Erro ao gerar arquivo: {e}", file=sys.stderr)
         import traceback
         traceback.print_exc()
 
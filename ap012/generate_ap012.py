@@ -8,12 +8,118 @@ RETORNO DE INFORMAÇÕES CONCILIADA DE CONTRATOS
 import csv
 import json
 import random
+import sys
+import tempfile
+import zlib
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+from typing import Iterable, Iterator, List, Dict, Optional, Tuple
 from pathlib import Path
 
+# Módulos compartilhados entre os geradores (pasta common/ na raiz do repositório)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from common.output import OutputFileMixin
 
-class AP012Generator:
+
+class SpillingGroupBy:
+    """
+    Agregação por hash com derramamento em disco (grace hash)
+    
+    Cada grupo acumula a soma de valores em centavos e os conjuntos de contratos
+    e de contratantes distintos. Quando o total de entradas em memória (grupos
+    mais membros dos conjuntos) passa de limite_cardinalidade, os estados parciais
+    são gravados em num_particoes arquivos temporários, escolhidos pelo hash do
+    grupo, e a tabela é esvaziada. No final, cada partição é relida e consolidada
+    separadamente: um mesmo grupo sempre cai na mesma partição, então a memória
+    de pico é a de uma partição, não a do conjunto inteiro.
+    """
+    
+    def __init__(self, limite_cardinalidade: int = 1000000, num_particoes: int = 64,
+                 diretorio_tmp: Optional[str] = None):
+        """
+        Args:
+            limite_cardinalidade: Máximo de entradas mantidas em memória antes de derramar
+            num_particoes: Quantidade de partições em disco
+            diretorio_tmp: Diretório das partições (padrão: diretório temporário do sistema)
+        """
+        if limite_cardinalidade < 1 or num_particoes < 1:
+            raise ValueError("limite_cardinalidade_agregacao e particoes_agregacao devem ser maiores ou iguais a 1")
+        self.limite_cardinalidade = limite_cardinalidade
+        self.num_particoes = num_particoes
+        self.diretorio_tmp = diretorio_tmp
+        self.grupos = {}
+        self.tamanho = 0
+        self.particoes = None
+    
+    def add(self, grupo: bytes, contrato: bytes, contratante: bytes, centavos: int):
+        """Acumula um efeito no grupo"""
+        estado = self.grupos.get(grupo)
+        if estado is None:
+            estado = self.grupos[grupo] = [0, set(), set()]
+            self.tamanho += 1
+        estado[0] += centavos
+        if contrato not in estado[1]:
+            estado[1].add(contrato)
+            self.tamanho += 1
+        if contratante not in estado[2]:
+            estado[2].add(contratante)
+            self.tamanho += 1
+        if self.tamanho > self.limite_cardinalidade:
+            self._spill()
+    
+    def _spill(self):
+        """Grava os estados parciais nas partições e esvazia a tabela em memória"""
+        if self.particoes is None:
+            self.particoes = [
+                tempfile.TemporaryFile(mode='w+b', dir=self.diretorio_tmp)
+                for _ in range(self.num_particoes)
+            ]
+        for grupo, (centavos, contratos, contratantes) in self.grupos.items():
+            self.particoes[zlib.crc32(grupo) % self.num_particoes].write(
+                b'\t'.join((grupo, b'%d' % centavos, b','.join(contratos), b','.join(contratantes))) + b'\n'
+            )
+        self.grupos = {}
+        self.tamanho = 0
+    
+    @staticmethod
+    def _merge_partition(particao) -> Dict[bytes, list]:
+        """Consolida os estados parciais de uma partição"""
+        grupos = {}
+        particao.seek(0)
+        for linha in particao:
+            grupo, centavos, contratos, contratantes = linha[:-1].split(b'\t')
+            estado = grupos.get(grupo)
+            if estado is None:
+                estado = grupos[grupo] = [0, set(), set()]
+            estado[0] += int(centavos)
+            estado[1].update(contratos.split(b','))
+            estado[2].update(contratantes.split(b','))
+        return grupos
+    
+    def __iter__(self) -> Iterator[Tuple[bytes, int, int, int]]:
+        """
+        Grupos consolidados, ordenados dentro de cada partição
+        
+        Yields:
+            Tupla (grupo, quantidade de contratos, quantidade de contratantes, soma em centavos)
+        """
+        if self.particoes is None:
+            tabelas = [self.grupos]
+        else:
+            self._spill()
+            tabelas = (self._merge_partition(particao) for particao in self.particoes)
+        try:
+            for tabela in tabelas:
+                for grupo in sorted(tabela):
+                    centavos, contratos, contratantes = tabela[grupo]
+                    yield grupo, len(contratos), len(contratantes), centavos
+        finally:
+            for particao in self.particoes or []:
+                particao.close()
+            self.particoes = None
+            self.grupos = {}
+
+
+class AP012Generator(OutputFileMixin):
     """Gerador de arquivos AP012 da CERC"""
     
     def __init__(self, config_path: str = "generate_ap012.json"):
@@ -29,6 +135,11 @@ class AP012Generator:
         self.cnpj_raiz = self.cnpj_participante[:8]
         self.sequence = 1
         self.tipo_leiaute = "CERC-AP012"
+        self.total_registros = 0
+        
+        # Participantes e detentores distintos dos grupos agregados do AP008 (resumo da execução)
+        self.participantes_ap008 = set()
+        self.detentores_ap008 = set()
     
     def _load_config(self, config_path: str) -> Dict:
         """Carrega configuração do arquivo JSON"""
@@ -52,9 +163,6 @@ class AP012Generator:
         date_str = date.strftime("%Y%m%d")
         seq_str = f"{self.sequence:07d}"
         
-        # Cria o diretório se não existir
-        Path(output_dir).mkdir(parents=True, exist_ok=True)
-        
         filename = f"{self.tipo_leiaute}_{self.cnpj_raiz}_{date_str}_{seq_str}_ret.csv"
         return str(Path(output_dir) / filename)
     
@@ -109,6 +217,105 @@ class AP012Generator:
             'carteira': self.config.get('carteira_padrao', 'Carteira1'),
         }
     
+    def _ap008_paths(self) -> List[str]:
+        """Arquivos AP008 configurados em arquivo_ap008 (caminho ou lista de caminhos)"""
+        arquivos = self.config['arquivo_ap008']
+        if isinstance(arquivos, str):
+            arquivos = [arquivos]
+        if not arquivos:
+            raise ValueError("arquivo_ap008 não informa nenhum arquivo")
+        return list(arquivos)
+    
+    @staticmethod
+    def contract_classification(identificador_contrato: bytes) -> Tuple[bytes, bytes]:
+        """
+        Tipo de efeito e modalidade de um contrato
+        
+        O AP008 não informa tipo de efeito nem modalidade da operação; ambos são
+        derivados de forma determinística do identificador do contrato, de modo que
+        todos os efeitos de um contrato caem no mesmo grupo e reprocessar os mesmos
+        arquivos AP008 produz o mesmo AP012.
+        
+        Returns:
+            Tupla (tipo_efeito '1'-'4', modalidade_operacao '1'-'3')
+        """
+        h = zlib.crc32(identificador_contrato)
+        return b'1234'[h % 4:h % 4 + 1], b'123'[(h >> 8) % 3:(h >> 8) % 3 + 1]
+    
+    def iter_ap008_effects(self, paths: Iterable[str]) -> Iterator[Tuple[bytes, bytes, bytes, bytes, int]]:
+        """
+        Lê arquivos AP008 em streaming e extrai os dados de cada efeito aceito
+        
+        O campo 7 vem entre aspas por conter ponto e vírgula; como os demais campos
+        não contêm aspas, basta removê-las e dividir a linha. Efeitos com
+        status_operacao diferente de 0 (erro) não constituem contrato e são ignorados.
+        
+        Args:
+            paths: Caminhos dos arquivos AP008
+        
+        Yields:
+            Tupla (grupo, identificador_contrato, contratante, valor em centavos), com grupo = b"participante;detentor;tipo_efeito;modalidade"
+        """
+        for path in paths:
+            with open(path, 'rb') as f:
+                for linha in f:
+                    campos = linha.replace(b'"', b'').split(b';', 22)
+                    if len(campos) < 22 or campos[17] != b'0':
+                        continue  # Linha vazia/truncada ou efeito com erro
+                    contrato = campos[1]
+                    tipo_efeito, modalidade = self.contract_classification(contrato)
+                    # participante = credenciadora (campo 4); detentor = titular da UR (campo 7.3)
+                    grupo = b';'.join((campos[3], campos[8], tipo_efeito, modalidade))
+                    # valor_constituido_efeito (campo 7.15), sempre com duas casas decimais
+                    yield grupo, contrato, campos[4], int(campos[20].replace(b'.', b''))
+    
+    def iter_random_records(self, num_records: int) -> Iterator[Dict]:
+        """Gera num_records registros aleatórios"""
+        for i in range(num_records):
+            yield self.generate_random_record(f"REF_{i+1:06d}")
+    
+    def iter_ap008_records(self, date: datetime) -> Iterator[Dict]:
+        """
+        Gera a conciliação de contratos a partir dos efeitos enviados nos arquivos AP008
+        
+        Um registro por (participante, detentor, tipo_efeito, modalidade_operacao), com
+        a quantidade de contratos e de contratantes (usuários finais recebedores)
+        distintos e o saldo devedor total (soma de valor_constituido_efeito).
+        
+        Args:
+            date: Data de referência da conciliação
+        
+        Yields:
+            Dicionários com os dados da conciliação de contratos
+        """
+        agregacao = SpillingGroupBy(
+            self.config.get('limite_cardinalidade_agregacao', 1000000),
+            self.config.get('particoes_agregacao', 64),
+            self.config.get('diretorio_temporario'),
+        )
+        for grupo, contrato, contratante, centavos in self.iter_ap008_effects(self._ap008_paths()):
+            agregacao.add(grupo, contrato, contratante, centavos)
+        
+        carteira = self.config.get('carteira_padrao', 'Carteira1')
+        self.participantes_ap008 = set()
+        self.detentores_ap008 = set()
+        for i, (grupo, contratos, contratantes, centavos) in enumerate(agregacao):
+            participante, detentor, tipo_efeito, modalidade = grupo.decode('utf-8').split(';')
+            self.participantes_ap008.add(participante)
+            self.detentores_ap008.add(detentor)
+            yield {
+                'referencia_externa': f"REF_{i+1:06d}",
+                'data_referencia': date,
+                'participante': participante,
+                'detentor': detentor,
+                'tipo_efeito': tipo_efeito,
+                'modalidade_operacao': modalidade,
+                'quantidade_contratos': contratos,
+                'quantidade_contratantes': contratantes,
+                'saldo_devedor_total': centavos / 100,
+                'carteira': carteira,
+            }
+    
     def generate_row(self, data: Dict) -> List[str]:
         """
         Gera uma linha do arquivo AP012
@@ -133,32 +340,41 @@ class AP012Generator:
         ]
     
     def generate_file(self, num_records: int, output_path: Optional[str] = None, 
-                     date: Optional[datetime] = None, output_dir: str = "ap012_output") -> str:
+                     date: Optional[datetime] = None, output_dir: str = "ap012_output",
+                     tamanho_estimado: Optional[int] = None) -> str:
         """
         Gera o arquivo AP012 com registros aleatórios
         
+        Com arquivo_ap008 configurado, os registros são os agregados dos efeitos lidos
+        dos arquivos AP008 (ver iter_ap008_records) e num_records é ignorado; o total
+        escrito fica em self.total_registros.
+        
         Args:
             num_records: Número de registros a gerar
             output_path: Caminho de saída (opcional, gera automaticamente se não informado)
             date: Data de referência (padrão: data atual)
             output_dir: Diretório de saída (padrão: ap012_output)
+            tamanho_estimado: Tamanho estimado em bytes para pré-alocação do arquivo (opcional)
         
         Returns:
             Caminho do arquivo gerado
         """
         if output_path is None:
             output_path = self.generate_filename(date, output_dir)
+        if not self._is_stream_output(output_path):
+            Path(output_path).parent.mkdir(parents=True, exist_ok=True)
         
         if date is None:
             date = datetime.now()
         
-        records = []
-        for i in range(num_records):
-            referencia_externa = f"REF_{i+1:06d}"
-            record = self.generate_random_record(referencia_externa)
-            records.append(record)
+        if self.config.get('arquivo_ap008'):
+            records = self.iter_ap008_records(date)
+        else:
+            records = self.iter_random_records(num_records)
         
-        with open(output_path, 'w', newline='', encoding='utf-8') as csvfile:
+        self.total_registros = 0
+        # Escreve em arquivo temporário e renomeia ao final (escrita atômica)
+        with self._open_output_atomic(output_path, tamanho_estimado) as csvfile:
             # Usa ponto e vírgula como delimitador conforme especificação CERC
             writer = csv.writer(csvfile, delimiter=';', quoting=csv.QUOTE_MINIMAL)
             
@@ -166,38 +382,52 @@ class AP012Generator:
             for record in records:
                 row = self.generate_row(record)
                 writer.writerow(row)
+                self.total_registros += 1
         
         return output_path
 
 
 def main():
     """Função principal"""
-    import sys
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Gera arquivo AP012 da CERC")
+    parser.add_argument('quantidade_registros', nargs='?', type=int,
+                        help="Quantidade de registros (padrão: valor do JSON ou 10)")
+    parser.add_argument('--output',
+                        help="Caminho de saída; '-' para stdout ou um pipe nomeado (padrão: ap012_output/<nome CERC>)")
+    args = parser.parse_args()
     
     try:
         # Inicializa o gerador com configuração
         generator = AP012Generator("generate_ap012.json")
         
         # Número de registros a gerar (prioridade: linha de comando > config > padrão 10)
-        if len(sys.argv) > 1:
-            num_records = int(sys.argv[1])
+        if args.quantidade_registros is not None:
+            num_records = args.quantidade_registros
         else:
             num_records = generator.config.get('quantidade_registros', 10)
         
         # Gera o arquivo
-        output_file = generator.generate_file(num_records)
+        output_file = generator.generate_file(num_records, output_path=args.output)
         
-        print(f"Arquivo AP012 gerado com sucesso: {output_file}")
-        print(f"Total de registros: {num_records}")
-        print(f"CNPJ Participante: {generator.cnpj_participante}")
-        print(f"CNPJ Detentor: {generator.cnpj_detentor}")
+        print(f"Arquivo AP012 gerado com sucesso: {output_file}", file=sys.stderr)
+        print(f"Total de registros: {generator.total_registros}", file=sys.stderr)
+        if generator.config.get('arquivo_ap008'):
+            # Participante e detentor vêm dos efeitos do AP008, não da configuração
+            print(f"Grupos agregados do AP008: {generator.total_registros}", file=sys.stderr)
+            print(f"Participantes distintos: {len(generator.participantes_ap008)}", file=sys.stderr)
+            print(f"Detentores distintos: {len(generator.detentores_ap008)}", file=sys.stderr)
+        else:
+            print(f"CNPJ Participante: {generator.cnpj_participante}", file=sys.stderr)
+            print(f"CNPJ Detentor: {generator.cnpj_detentor}", file=sys.stderr)
         
     except FileNotFoundError as e:
-        print(f"Erro: Arquivo não encontrado - {e}")
-        print("Certifique-se de que o arquivo de configuração existe:")
-        print("  - generate_ap012.json")
+        print(f"Erro: Arquivo não encontrado - {e}", file=sys.stderr)
+        print("Certifique-se de que o arquivo de configuração existe:", file=sys.stderr)
+        print("  - generate_ap012.json", file=sys.stderr)
     except Exception as e:
-        print(f"Erro ao gerar arquivo: {e}")
+        print(f"Erro ao gerar arquivo: {e}", file=sys.stderr)
         import traceback
         traceback.print_exc()
 
@@ -7,13 +7,127 @@ RETORNO DE INFORMAÇÃO CONCILIADA DE OPT-IN
 
 import csv
 import json
+import os
 import random
-from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+import sqlite3
+import sys
+from bisect import bisect_right
+from datetime import date as Date, datetime, timedelta
+from itertools import accumulate
+from typing import Iterator, List, Dict, Optional, Tuple
 from pathlib import Path
 
+# Módulos compartilhados entre os geradores (pasta common/ na raiz do repositório)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from common.output import OutputFileMixin
 
-class AP023Generator:
+
+class ActiveOptinIndex:
+    """
+    Índice de intervalos de vigência dos opt-ins, por chave de conciliação
+    
+    Cada opt-in do registro (AP004 / AP006) está ativo de data_inicio até
+    data_fim, inclusive, ou até a véspera de data_optout, o que vier antes. O
+    índice guarda, por chave (financiador, instituicao_recebedora_agenda,
+    carteira), as datas de início e de fim exclusivo já ordenadas, com as
+    contagens acumuladas. A quantidade ativa numa data é então
+    
+        inícios <= data  -  fins <= data
+    
+    obtida com duas buscas binárias, sem nova varredura do registro por data.
+    A agregação por data é feita no próprio SQLite, percorrendo em ordem os
+    índices idx_optins_inicio / idx_optins_fim mantidos pelo AP004 / AP006.
+    """
+    
+    # Fim exclusivo: menor entre o dia seguinte a data_fim e data_optout (NULL = sem fim),
+    # nunca anterior ao início (opt-out antes da vigência não conta em nenhuma data).
+    # Deve ser idêntica à expressão do índice idx_optins_fim, senão o SQLite ordena o registro
+    FIM_EXCLUSIVO = """
+        MAX(data_inicio, CASE
+            WHEN data_optout IS NULL THEN date(data_fim, '+1 day')
+            WHEN data_fim IS NULL THEN data_optout
+            ELSE MIN(data_optout, date(data_fim, '+1 day'))
+        END)
+    """
+    
+    def __init__(self, db_path: str, solicitante: str):
+        """
+        Args:
+            db_path: Caminho do banco SQLite do registro de opt-ins
+            solicitante: CNPJ do solicitante cujos opt-ins serão conciliados
+        """
+        if not os.path.exists(db_path):
+            raise FileNotFoundError(db_path)
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        try:
+            inicios = self._load_events(conn, "data_inicio", solicitante)
+            fins = self._load_events(conn, self.FIM_EXCLUSIVO, solicitante)
+        finally:
+            conn.close()
+        
+        self.inicios = {chave: self._cumulative(eventos) for chave, eventos in inicios.items()}
+        self.fins = {chave: self._cumulative(eventos) for chave, eventos in fins.items()}
+    
+    @staticmethod
+    def _load_events(conn: sqlite3.Connection, expressao: str, solicitante: str) -> Dict[Tuple[str, str, str], List[Tuple[int, int]]]:
+        """
+        Agrega os eventos (data, quantidade) por chave, ordenados por data
+        
+        Args:
+            conn: Conexão com o registro
+            expressao: Expressão SQL da data do evento (NULL = evento inexistente)
+            solicitante: CNPJ do solicitante
+        
+        Returns:
+            Dicionário chave -> lista de (ordinal da data, quantidade)
+        """
+        consulta = (
+            f"SELECT financiador, instituicao_recebedora_agenda, carteira, {expressao} AS dia, COUNT(*) "
+            "FROM optins WHERE solicitante = ? GROUP BY 1, 2, 3, 4 ORDER BY 1, 2, 3, 4"
+        )
+        eventos = {}
+        for financiador, instituicao, carteira, dia, quantidade in conn.execute(consulta, (solicitante,)):
+            lista = eventos.setdefault((financiador, instituicao, carteira), [])
+            if dia is not None:
+                lista.append((Date.fromisoformat(dia).toordinal(), quantidade))
+        return eventos
+    
+    @staticmethod
+    def _cumulative(eventos: List[Tuple[int, int]]) -> Tuple[List[int], List[int]]:
+        """Separa datas e contagens acumuladas de uma lista de eventos ordenada por data"""
+        return [dia for dia, _ in eventos], list(accumulate(quantidade for _, quantidade in eventos))
+    
+    @staticmethod
+    def _count_until(eventos: Tuple[List[int], List[int]], dia: int) -> int:
+        """Quantidade de eventos com data <= dia"""
+        dias, acumulado = eventos
+        posicao = bisect_right(dias, dia)
+        return acumulado[posicao - 1] if posicao else 0
+    
+    def keys(self) -> List[Tuple[str, str, str]]:
+        """Chaves (financiador, instituicao_recebedora_agenda, carteira) presentes no registro"""
+        return sorted(self.inicios)
+    
+    def count_active(self, chave: Tuple[str, str, str], data_referencia: datetime) -> int:
+        """
+        Quantidade de opt-ins ativos de uma chave numa data de referência
+        
+        Args:
+            chave: Tupla (financiador, instituicao_recebedora_agenda, carteira)
+            data_referencia: Data de referência
+        
+        Returns:
+            Número de opt-ins vigentes e sem opt-out na data
+        """
+        dia = data_referencia.toordinal()
+        ativos = self._count_until(self.inicios[chave], dia)
+        fins = self.fins.get(chave)
+        if fins:
+            ativos -= self._count_until(fins, dia)
+        return ativos
+
+
+class AP023Generator(OutputFileMixin):
     """Gerador de arquivos AP023 da CERC"""
     
     def __init__(self, config_path: str = "generate_ap023.json"):
@@ -29,6 +143,7 @@ class AP023Generator:
         self.cnpj_raiz = self.cnpj_solicitante[:8]
         self.sequence = 1
         self.tipo_leiaute = "CERC-AP023"
+        self.total_registros = 0
     
     def _load_config(self, config_path: str) -> Dict:
         """Carrega configuração do arquivo JSON"""
@@ -52,9 +167,6 @@ class AP023Generator:
         date_str = date.strftime("%Y%m%d")
         seq_str = f"{self.sequence:07d}"
         
-        # Cria o diretório se não existir
-        Path(output_dir).mkdir(parents=True, exist_ok=True)
-        
         filename = f"{self.tipo_leiaute}_{self.cnpj_raiz}_{date_str}_{seq_str}_ret.csv"
         return str(Path(output_dir) / filename)
     
@@ -92,6 +204,60 @@ class AP023Generator:
             'carteira': self.config.get('carteira_padrao', 'Carteira1'),
         }
     
+    def reference_dates(self, date: datetime) -> List[datetime]:
+        """
+        Datas de referência conciliadas no arquivo: os dias_referencia dias até a data do arquivo
+        
+        Args:
+            date: Data do arquivo (última data de referência)
+        
+        Returns:
+            Lista de datas em ordem crescente
+        """
+        dias = self.config.get('dias_referencia', 1)
+        if dias < 1:
+            raise ValueError("dias_referencia deve ser maior ou igual a 1")
+        return [date - timedelta(days=offset) for offset in range(dias - 1, -1, -1)]
+    
+    def iter_random_records(self, num_records: int) -> Iterator[Dict]:
+        """Gera num_records registros aleatórios"""
+        for i in range(num_records):
+            yield self.generate_random_record(f"REF_{i+1:06d}")
+    
+    def iter_reconciled_records(self, date: datetime) -> Iterator[Dict]:
+        """
+        Gera a conciliação a partir do registro de opt-ins (arquivo_registro_optins)
+        
+        Um registro por chave (financiador, instituicao_recebedora_agenda, carteira) e
+        data de referência com ao menos um opt-in ativo. O registro é lido uma
+        única vez para montar o índice de intervalos; cada data custa apenas
+        buscas binárias por chave.
+        
+        Args:
+            date: Data do arquivo
+        
+        Yields:
+            Dicionários com os dados da conciliação de opt-in
+        """
+        indice = ActiveOptinIndex(self.config['arquivo_registro_optins'], self.cnpj_solicitante)
+        chaves = indice.keys()
+        sequencial = 0
+        for data_referencia in self.reference_dates(date):
+            for financiador, instituicao, carteira in chaves:
+                quantidade = indice.count_active((financiador, instituicao, carteira), data_referencia)
+                if quantidade <= 0:
+                    continue
+                sequencial += 1
+                yield {
+                    'referencia_externa': f"REF_{sequencial:06d}",
+                    'data_referencia': data_referencia,
+                    'solicitante': self.cnpj_solicitante,
+                    'financiador': financiador,
+                    'instituicao_recebedora_agenda': instituicao,
+                    'quantidade_optins_ativos': quantidade,
+                    'carteira': carteira,
+                }
+    
     def generate_row(self, data: Dict) -> List[str]:
         """
         Gera uma linha do arquivo AP023
@@ -113,32 +279,41 @@ class AP023Generator:
         ]
     
     def generate_file(self, num_records: int, output_path: Optional[str] = None, 
-                     date: Optional[datetime] = None, output_dir: str = "ap023_output") -> str:
+                     date: Optional[datetime] = None, output_dir: str = "ap023_output",
+                     tamanho_estimado: Optional[int] = None) -> str:
         """
         Gera o arquivo AP023 com registros aleatórios
         
+        Com arquivo_registro_optins configurado, as quantidades vêm do registro de
+        opt-ins compartilhado com AP004 / AP006 e num_records é ignorado; o total
+        escrito fica em self.total_registros.
+        
         Args:
             num_records: Número de registros a gerar
             output_path: Caminho de saída (opcional, gera automaticamente se não informado)
             date: Data de referência (padrão: data atual)
             output_dir: Diretório de saída (padrão: ap023_output)
+            tamanho_estimado: Tamanho estimado em bytes para pré-alocação do arquivo (opcional)
         
         Returns:
             Caminho do arquivo gerado
         """
         if output_path is None:
             output_path = self.generate_filename(date, output_dir)
+        if not self._is_stream_output(output_path):
+            Path(output_path).parent.mkdir(parents=True, exist_ok=True)
         
         if date is None:
             date = datetime.now()
         
-        records = []
-        for i in range(num_records):
-            referencia_externa = f"REF_{i+1:06d}"
-            record = self.generate_random_record(referencia_externa)
-            records.append(record)
+        if self.config.get('arquivo_registro_optins'):
+            records = self.iter_reconciled_records(date)
+        else:
+            records = self.iter_random_records(num_records)
         
-        with open(output_path, 'w', newline='', encoding='utf-8') as csvfile:
+        self.total_registros = 0
+        # Escreve em arquivo temporário e renomeia ao final (escrita atômica)
+        with self._open_output_atomic(output_path, tamanho_estimado) as csvfile:
             # Usa ponto e vírgula como delimitador conforme especificação CERC
             writer = csv.writer(csvfile, delimiter=';', quoting=csv.QUOTE_MINIMAL)
             
@@ -146,38 +321,46 @@ class AP023Generator:
             for record in records:
                 row = self.generate_row(record)
                 writer.writerow(row)
+                self.total_registros += 1
         
         return output_path
 
 
 def main():
     """Função principal"""
-    import sys
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Gera arquivo AP023 da CERC")
+    parser.add_argument('quantidade_registros', nargs='?', type=int,
+                        help="Quantidade de registros (padrão: valor do JSON ou 10)")
+    parser.add_argument('--output',
+                        help="Caminho de saída; '-' para stdout ou um pipe nomeado (padrão: ap023_output/<nome CERC>)")
+    args = parser.parse_args()
     
     try:
         # Inicializa o gerador com configuração
         generator = AP023Generator("generate_ap023.json")
         
         # Número de registros a gerar (prioridade: linha de comando > config > padrão 10)
-        if len(sys.argv) > 1:
-            num_records = int(sys.argv[1])
+        if args.quantidade_registros is not None:
+            num_records = args.quantidade_registros
         else:
             num_records = generator.config.get('quantidade_registros', 10)
         
         # Gera o arquivo
-        output_file = generator.generate_file(num_records)
+        output_file = generator.generate_file(num_records, output_path=args.output)
         
-        print(f"Arquivo AP023 gerado com sucesso: {output_file}")
-        print(f"Total de registros: {num_records}")
-        print(f"CNPJ Solicitante: {generator.cnpj_solicitante}")
-        print(f"CNPJ Financiador: {generator.cnpj_financiador}")
+        print(f"Arquivo AP023 gerado com sucesso: {output_file}", file=sys.stderr)
+        print(f"Total de registros: {generator.total_registros}", file=sys.stderr)
+        print(f"CNPJ Solicitante: {generator.cnpj_solicitante}", file=sys.stderr)
+        print(f"CNPJ Financiador: {generator.cnpj_financiador}", file=sys.stderr)
         
     except FileNotFoundError as e:
-        print(f"Erro: Arquivo não encontrado - {e}")
-        print("Certifique-se de que o arquivo de configuração existe:")
-        print("  - generate_ap023.json")
+        print(f"Erro: Arquivo não encontrado - {e}", file=sys.stderr)
+        print("Certifique-se de que o arquivo de configuração existe:", file=sys.stderr)
+        print("  - generate_ap023.json", file=sys.stderr)
     except Exception as e:
-        print(f"Erro ao gerar arquivo: {e}")
+        print(f"Erro ao gerar arquivo: {e}", file=sys.stderr)
         import traceback
         traceback.print_exc()
 
@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+"""
+Módulos compartilhados entre os geradores de arquivos CERC
+
+Os scripts de cada pasta (apXXX/generate_apXXX.py) continuam sendo executados de
+dentro da própria pasta; cada um inclui a raiz do repositório no sys.path antes de
+importar daqui.
+"""
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+Modo contínuo (AP002 / AP008): publicação de arquivos em uma taxa alvo
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+
+class TokenBucket:
+    """
+    Limitador de taxa por balde de fichas (token bucket)
+    
+    O balde recebe taxa fichas por segundo, até capacidade, e cada arquivo consome
+    uma ficha. Uma capacidade maior que 1 permite rajadas curtas para recuperar
+    atrasos (ex.: após um arquivo mais lento que o intervalo) sem exceder a taxa média.
+    """
+    
+    def __init__(self, taxa: float, capacidade: float = 1.0):
+        """
+        Args:
+            taxa: Fichas por segundo
+            capacidade: Máximo de fichas acumuladas
+        """
+        if taxa <= 0 or capacidade < 1:
+            raise ValueError("modo_continuo: arquivos_por_hora deve ser positivo e rajada >= 1")
+        self.taxa = taxa
+        self.capacidade = capacidade
+        self.fichas = 1.0
+        self.atualizado = time.monotonic()
+    
+    def acquire(self) -> float:
+        """
+        Aguarda até haver uma ficha e a consome
+        
+        Returns:
+            Tempo de espera em segundos
+        """
+        espera_total = 0.0
+        while True:
+            agora = time.monotonic()
+            self.fichas = min(self.capacidade, self.fichas + (agora - self.atualizado) * self.taxa)
+            self.atualizado = agora
+            if self.fichas >= 1.0:
+                self.fichas -= 1.0
+                return espera_total
+            espera = (1.0 - self.fichas) / self.taxa
+            time.sleep(espera)
+            espera_total += espera
+
+
+class ContinuousModeMixin:
+    """
+    Modo contínuo dos geradores, configurado em modo_continuo
+    
+    Usa do gerador self.config, self.perfis, self.sequence, generate_filename e
+    generate_file.
+    """
+    
+    def _publish_staged(self, staging: Path, nome: str, output_dir: str):
+        """
+        Move um arquivo preparado em staging para output_dir, com renomeações atômicas
+        
+        Arquivos auxiliares (.parquet, .erros.csv) são movidos antes do CSV, e o
+        marcador .done por último, na mesma ordem em que o modo normal os cria.
+        
+        Args:
+            staging: Diretório de preparação (no mesmo sistema de arquivos de output_dir)
+            nome: Nome do arquivo CSV
+            output_dir: Diretório de saída
+        """
+        prefixo = Path(nome).stem + '.'
+        ordem = lambda arquivo: 2 if arquivo.endswith('.done') else 1 if arquivo == nome else 0
+        for arquivo in sorted((a for a in os.listdir(staging) if a.startswith(prefixo)), key=ordem):
+            os.replace(staging / arquivo, Path(output_dir) / arquivo)
+    
+    def _continuous_stats(self, estatisticas: Dict, inicio: float, publicacoes: Tuple[float, float]) -> Dict:
+        """
+        Acrescenta às estatísticas do modo contínuo o tempo decorrido e as taxas alcançadas
+        
+        A taxa de arquivos é medida entre a primeira publicação (que não espera pelo
+        balde) e a última, dadas em publicacoes, para não distorcer o início e o fim.
+        """
+        decorrido = max(time.monotonic() - inicio, 1e-9)
+        intervalo = publicacoes[1] - publicacoes[0]
+        return {
+            **estatisticas,
+            'decorrido': decorrido,
+            'taxa_alcancada': (estatisticas['arquivos'] - 1) * 3600 / intervalo if intervalo > 0 else 0.0,
+            'registros_por_segundo': estatisticas['registros'] / decorrido,
+        }
+    
+    def run_continuous(self, num_records: int, output_dir: Optional[str] = None,
+                       relatorio: Optional[Callable[[Dict], None]] = None) -> Dict:
+        """
+        Modo contínuo: publica arquivos em output_dir na taxa configurada em modo_continuo
+        
+        O gerador e as listas ficam carregados entre os arquivos. Enquanto um arquivo
+        aguarda sua ficha no balde (TokenBucket), o próximo já é gerado em segundo
+        plano em output_dir/.pronto-XXXXXXXX; na hora de publicar, basta renomeá-lo. A
+        sequência do nome do arquivo é incrementada a cada arquivo. Termina após
+        max_arquivos arquivos ou com Ctrl+C.
+        
+        Args:
+            num_records: Registros por arquivo
+            output_dir: Diretório de saída (padrão: o mesmo de generate_filename)
+            relatorio: Função chamada a cada intervalo_relatorio_segundos com as estatísticas
+        
+        Returns:
+            Estatísticas finais (arquivos, registros, tempos, taxa alvo e alcançada em arquivos/hora)
+        """
+        if output_dir is None:
+            output_dir = os.path.dirname(self.generate_filename())
+        if self.perfis:
+            raise ValueError("O modo contínuo não suporta perfis; use uma configuração por credenciadora")
+        modo = self.config.get('modo_continuo') or {}
+        taxa_alvo = float(modo.get('arquivos_por_hora', 60))
+        balde = TokenBucket(taxa_alvo / 3600, float(modo.get('rajada', 1)))
+        max_arquivos = modo.get('max_arquivos')
+        if max_arquivos is not None and (not isinstance(max_arquivos, int) or isinstance(max_arquivos, bool)
+                                         or max_arquivos < 1):
+            raise ValueError(f"modo_continuo: max_arquivos deve ser um inteiro >= 1 ou null (recebido: {max_arquivos!r})")
+        intervalo_relatorio = float(modo.get('intervalo_relatorio_segundos', 60))
+        
+        # Diretório de preparação exclusivo desta execução: outra execução no mesmo
+        # output_dir tem o seu próprio e não apaga os arquivos desta ao terminar
+        Path(output_dir).mkdir(parents=True, exist_ok=True)
+        staging = Path(tempfile.mkdtemp(prefix='.pronto-', dir=output_dir))
+        
+        def preparar() -> Tuple[str, int, float]:
+            """Gera o próximo arquivo em staging e avança a sequência"""
+            inicio_geracao = time.monotonic()
+            nome = Path(self.generate_filename(output_dir=output_dir)).name
+            self.generate_file(num_records, output_path=str(staging / nome))
+            self.sequence += 1
+            # Geradores sem total_registros (AP008) geram exatamente num_records
+            return nome, getattr(self, 'total_registros', num_records), time.monotonic() - inicio_geracao
+        
+        estatisticas = {'arquivos': 0, 'registros': 0, 'tempo_geracao': 0.0, 'tempo_espera': 0.0,
+                        'taxa_alvo': taxa_alvo}
+        inicio = time.monotonic()
+        publicacoes = (0.0, 0.0)  # instantes da primeira e da última publicação
+        proximo_relatorio = inicio + intervalo_relatorio
+        executor = ThreadPoolExecutor(max_workers=1)
+        pendente = executor.submit(preparar)
+        try:
+            while pendente is not None:
+                nome, registros, duracao = pendente.result()
+                publicados = estatisticas['arquivos'] + 1
+                pendente = executor.submit(preparar) if max_arquivos is None or publicados < max_arquivos else None
+                
+                estatisticas['tempo_espera'] += balde.acquire()
+                self._publish_staged(staging, nome, output_dir)
+                agora = time.monotonic()
+                publicacoes = (publicacoes[0] if estatisticas['arquivos'] else agora, agora)
+                estatisticas['arquivos'] = publicados
+                estatisticas['registros'] += registros
+                estatisticas['tempo_geracao'] += duracao
+                
+                if relatorio is not None and time.monotonic() >= proximo_relatorio:
+                    relatorio(self._continuous_stats(estatisticas, inicio, publicacoes))
+                    proximo_relatorio += intervalo_relatorio
+        except KeyboardInterrupt:
+            pass
+        finally:
+            # Aguarda a geração em andamento e descarta os arquivos não publicados
+            executor.shutdown(wait=True)
+            shutil.rmtree(staging, ignore_errors=True)
+        
+        return self._continuous_stats(estatisticas, inicio, publicacoes)
+
+
+def print_continuous_report(estatisticas: Dict):
+    """Imprime o andamento do modo contínuo"""
+    geracao_media = estatisticas['tempo_geracao'] / max(estatisticas['arquivos'], 1)
+    print(f"[contínuo] {estatisticas['arquivos']} arquivos, {estatisticas['registros']} registros "
+          f"em {estatisticas['decorrido']:.0f}s - taxa alcançada {estatisticas['taxa_alcancada']:.1f} arquivos/h "
+          f"(alvo {estatisticas['taxa_alvo']:.1f}), {estatisticas['registros_por_segundo']:.0f} registros/s, "
+          f"geração média {geracao_media:.2f}s/arquivo", file=sys.stderr, flush=True)
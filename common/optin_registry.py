@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Registro compartilhado de opt-ins (AP004 / AP006 / AP023)
+"""
+
+import random
+import sqlite3
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+
+class OptinRegistry:
+    """
+    Registro compartilhado de opt-ins em SQLite (AP004 / AP006 / AP023)
+    
+    O AP004 registra cada opt-in criado, com o protocolo que a registradora
+    devolveria, e o AP006 sorteia opt-ins vivos para cancelar. Nenhum evento
+    apaga o passado: a atualização só altera o fim da vigência (o início continua
+    o da criação) e o opt-out preenche data_optout, então a linha continua
+    descrevendo todo o período em que o opt-in esteve ativo. Um
+    índice parcial sobre os opt-ins vivos, por solicitante e carteira, permite
+    sortear os opt-ins de quem gera o arquivo sem varrer a tabela, e
+    os índices de início e de fim de vigência por chave de conciliação deixam
+    o AP023 contar opt-ins ativos por data sem ordenar o registro.
+    
+    Pensado para um único gerador escrevendo por vez.
+    """
+    
+    ESQUEMA = """
+        CREATE TABLE IF NOT EXISTS optins (
+            id INTEGER PRIMARY KEY,
+            protocolo TEXT NOT NULL UNIQUE,
+            solicitante TEXT NOT NULL,
+            financiador TEXT NOT NULL,
+            instituicao_recebedora_agenda TEXT NOT NULL,
+            carteira TEXT NOT NULL,
+            usuario_final_recebedor TEXT NOT NULL,
+            data_inicio TEXT NOT NULL,
+            data_fim TEXT,
+            data_optout TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_optins_vivos_carteira ON optins(solicitante, carteira, id)
+            WHERE data_optout IS NULL;
+        CREATE INDEX IF NOT EXISTS idx_optins_inicio ON optins(
+            solicitante, financiador, instituicao_recebedora_agenda, carteira, data_inicio
+        );
+        -- Fim exclusivo da vigência: mesma expressão de ActiveOptinIndex.FIM_EXCLUSIVO (AP023)
+        CREATE INDEX IF NOT EXISTS idx_optins_fim ON optins(
+            solicitante, financiador, instituicao_recebedora_agenda, carteira,
+            MAX(data_inicio, CASE
+                WHEN data_optout IS NULL THEN date(data_fim, '+1 day')
+                WHEN data_fim IS NULL THEN data_optout
+                ELSE MIN(data_optout, date(data_fim, '+1 day'))
+            END)
+        );
+    """
+    
+    def __init__(self, db_path: str):
+        """
+        Args:
+            db_path: Caminho do banco SQLite (criado se não existir)
+        """
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.ESQUEMA)
+        self.refresh()
+    
+    def refresh(self):
+        """Relê o próximo identificador livre (o registro pode ter sido alterado por outro gerador)"""
+        self.proximo_id = self.conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM optins").fetchone()[0]
+    
+    @staticmethod
+    def format_protocolo(optin_id: int) -> str:
+        """Protocolo do opt-in, derivado do identificador sequencial"""
+        return f"PROT_{optin_id:09d}"
+    
+    def sample_active(self, solicitante: str, carteira: str) -> Optional[Tuple[int, str, str]]:
+        """
+        Sorteia um opt-in vivo (sem opt-out) do solicitante e da carteira informados
+        
+        Só os opt-ins registrados pelo próprio solicitante, na mesma carteira, podem
+        ser atualizados (AP004) ou cancelados (AP006); assim os arquivos gerados por
+        solicitantes diferentes sobre o mesmo registro continuam conciliando entre si.
+        
+        Args:
+            solicitante: CNPJ do solicitante, como gravado pelo AP004
+            carteira: Carteira do opt-in
+        
+        Returns:
+            Tupla (id, protocolo, usuario_final_recebedor, data_inicio em AAAA-MM-DD)
+            ou None se não houver opt-ins vivos
+        """
+        if self.proximo_id <= 1:
+            return None
+        alvo = random.randrange(1, self.proximo_id)
+        consulta = (
+            "SELECT id, protocolo, usuario_final_recebedor, data_inicio FROM optins "
+            "WHERE data_optout IS NULL AND solicitante = ? AND carteira = ? AND id {} ? ORDER BY id {} LIMIT 1"
+        )
+        parametros = (solicitante, carteira, alvo)
+        linha = self.conn.execute(consulta.format('>=', 'ASC'), parametros).fetchone()
+        if linha is None:
+            linha = self.conn.execute(consulta.format('<', 'DESC'), parametros).fetchone()
+        return linha
+    
+    def add(self, optin_id: int, data: Dict):
+        """Registra um opt-in criado (operação C) com o identificador informado"""
+        self.conn.execute(
+            "INSERT INTO optins (id, protocolo, solicitante, financiador, instituicao_recebedora_agenda, "
+            "carteira, usuario_final_recebedor, data_inicio, data_fim) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                optin_id, self.format_protocolo(optin_id), data['solicitante'], data['financiador'],
+                data.get('instituicao_recebedora_agenda', ''), data['carteira'],
+                data['usuario_final_recebedor'], data['data_inicio'].strftime("%Y-%m-%d"),
+                data['data_fim'].strftime("%Y-%m-%d") if data.get('data_fim') else None,
+            ),
+        )
+    
+    def update_vigencia(self, optin_id: int, data_fim: Optional[datetime]):
+        """
+        Atualiza o fim da vigência de um opt-in (operação A)
+        
+        data_inicio não muda: o opt-in esteve ativo desde a criação, e o AP023
+        continua contando esse período nas datas de referência anteriores.
+        """
+        self.conn.execute(
+            "UPDATE optins SET data_fim = ? WHERE id = ?",
+            (data_fim.strftime("%Y-%m-%d") if data_fim else None, optin_id),
+        )
+    
+    def opt_out(self, optin_id: int, data: datetime):
+        """Cancela um opt-in vivo, registrando a data do opt-out"""
+        self.conn.execute(
+            "UPDATE optins SET data_optout = ? WHERE id = ?", (data.strftime("%Y-%m-%d"), optin_id)
+        )
+    
+    def close(self):
+        """Fecha a conexão com o banco"""
+        self.conn.close()
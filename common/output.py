@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""
+Escrita dos arquivos gerados: atômica em disco ou direta em stdout / pipe nomeado, inteira
+ou em partes paralelas
+"""
+
+import errno
+import multiprocessing
+import os
+import random
+import shutil
+import stat
+import sys
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Optional, Tuple
+
+
+class OutputFileMixin:
+    """
+    Abertura do arquivo de saída, comum a todos os geradores
+    
+    Usa do gerador apenas self.config (tamanho_buffer_saida_kb e gerar_marcador_done).
+    """
+    
+    def _is_stream_output(self, output_path: str) -> bool:
+        """Indica se a saída é stdout ("-") ou um pipe nomeado (FIFO), em vez de um arquivo regular"""
+        if output_path == '-':
+            return True
+        try:
+            modo = os.stat(output_path).st_mode
+        except OSError:
+            return False
+        return stat.S_ISFIFO(modo) or stat.S_ISCHR(modo)
+    
+    @contextmanager
+    def _open_output_stream(self, output_path: str):
+        """
+        Abre stdout ("-") ou um pipe nomeado para escrita direta, com buffer grande
+        
+        O consumidor lê as linhas à medida que são geradas, sem arquivo intermediário
+        (e sem arquivo temporário, renomeação ou marcador .done, que não se aplicam
+        a pipes). O tamanho do buffer vem de tamanho_buffer_saida_kb (padrão: 1024).
+        
+        Args:
+            output_path: "-" (stdout) ou caminho do pipe nomeado
+        """
+        tamanho_buffer = int(self.config.get('tamanho_buffer_saida_kb', 1024)) * 1024
+        if output_path == '-':
+            sys.stdout.flush()
+            fd = os.dup(sys.stdout.fileno())
+        else:
+            fd = os.open(output_path, os.O_WRONLY)
+        try:
+            f = open(fd, 'w', newline='', encoding='utf-8', buffering=tamanho_buffer)
+        except BaseException:
+            os.close(fd)  # open ainda não assumiu o descritor
+            raise
+        with f:
+            yield f
+    
+    @contextmanager
+    def _open_output_atomic(self, output_path: str, tamanho_estimado: Optional[int] = None,
+                            marcador_done: bool = True):
+        """
+        Abre um arquivo temporário no diretório de destino e, ao final da escrita,
+        faz fsync e renomeia atomicamente para output_path
+        
+        Consumidores que monitoram o diretório de saída nunca veem um arquivo
+        parcialmente escrito: o nome final só aparece com o conteúdo completo.
+        Para stdout ("-") ou um pipe nomeado, a escrita é direta (ver _open_output_stream).
+        
+        Args:
+            output_path: Caminho final do arquivo
+            tamanho_estimado: Tamanho estimado em bytes para pré-alocação (opcional)
+            marcador_done: Cria o marcador .done se gerar_marcador_done estiver ativo
+                           (False para arquivos auxiliares, publicados junto com o principal)
+        """
+        if self._is_stream_output(output_path):
+            with self._open_output_stream(output_path) as f:
+                yield f
+            return
+        
+        diretorio = os.path.dirname(os.path.abspath(output_path))
+        tmp_path = os.path.join(diretorio, f".{os.path.basename(output_path)}.{os.getpid()}.tmp")
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+        try:
+            try:
+                if tamanho_estimado and hasattr(os, 'posix_fallocate'):
+                    try:
+                        os.posix_fallocate(fd, 0, tamanho_estimado)
+                    except OSError:
+                        pass  # Sistema de arquivos sem suporte: segue sem pré-alocação
+                f = os.fdopen(fd, 'w', newline='', encoding='utf-8')
+            except BaseException:
+                os.close(fd)  # os.fdopen ainda não assumiu o descritor
+                raise
+            with f:
+                yield f
+                f.flush()
+                f.truncate()  # Descarta o excedente da pré-alocação
+                os.fsync(f.fileno())
+            os.replace(tmp_path, output_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        
+        # Garante que a renomeação sobreviva a uma queda do sistema
+        try:
+            dir_fd = os.open(diretorio, os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+        except OSError:
+            pass
+        
+        # Marcador opcional de arquivo concluído
+        if marcador_done and self.config.get('gerar_marcador_done', False):
+            Path(output_path + '.done').touch()
+
+
+def append_file_contents(origem_fd: int, destino_fd: int, tamanho: int,
+                         tamanho_bloco: int = 8 * 1024 * 1024) -> str:
+    """
+    Copia os primeiros tamanho bytes de origem_fd para a posição atual de destino_fd
+    
+    Tenta, em ordem: os.copy_file_range (cópia dentro do kernel; em sistemas de
+    arquivos com reflink, como XFS e Btrfs, os blocos podem ser compartilhados em
+    vez de copiados), os.sendfile (aceita também pipes como destino) e, por fim,
+    leitura e escrita em blocos grandes. Se um método não é suportado para o par de
+    descritores, o seguinte continua de onde o anterior parou.
+    
+    Args:
+        origem_fd: Descritor do arquivo de origem (regular)
+        destino_fd: Descritor de destino (arquivo regular, pipe ou stdout)
+        tamanho: Quantidade de bytes a copiar
+        tamanho_bloco: Tamanho dos blocos da cópia por leitura e escrita
+    
+    Returns:
+        Nome do método que concluiu a cópia
+    """
+    copiados = 0
+    for metodo in ('copy_file_range', 'sendfile'):
+        if not hasattr(os, metodo):
+            continue
+        try:
+            while copiados < tamanho:
+                if metodo == 'copy_file_range':
+                    n = os.copy_file_range(origem_fd, destino_fd, tamanho - copiados, copiados)
+                else:
+                    n = os.sendfile(destino_fd, origem_fd, copiados, tamanho - copiados)
+                if n == 0:
+                    raise ValueError("Arquivo de origem menor que o tamanho informado")
+                copiados += n
+            return metodo
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP, errno.EBADF):
+                raise
+    
+    os.lseek(origem_fd, copiados, os.SEEK_SET)
+    while copiados < tamanho:
+        bloco = os.read(origem_fd, min(tamanho_bloco, tamanho - copiados))
+        if not bloco:
+            raise ValueError("Arquivo de origem menor que o tamanho informado")
+        restante = memoryview(bloco)
+        while restante:
+            restante = restante[os.write(destino_fd, restante):]
+        copiados += len(bloco)
+    return 'read/write'
+
+
+# Gerador, diretório das partes, data de referência e faixas de horários das partes (ou
+# None) da geração em partes, definidos antes de criar o Pool para que os processos
+# filhos (fork) os herdem
+_gerador_partes = None
+
+
+def generate_part_file(tarefa: Tuple[int, int, int, int]) -> int:
+    """
+    Grava uma parte de um arquivo gerado em partes (ver ShardedFileMixin.generate_sharded_file)
+    
+    Args:
+        tarefa: Tupla (índice da parte, índice do primeiro registro, quantidade, semente)
+    
+    Returns:
+        Índice da parte
+    """
+    indice, inicio, quantidade, semente = tarefa
+    gerador, diretorio, date, faixas = _gerador_partes
+    random.seed(semente)
+    gerador.write_part(
+        os.path.join(diretorio, f"parte_{indice:05d}.csv"), quantidade, inicio, date,
+        faixas[indice] if faixas is not None else None,
+    )
+    return indice
+
+
+class ShardedFileMixin:
+    """
+    Geração de um arquivo em partes paralelas (partes_arquivo), concatenadas no final
+    
+    Usa do gerador self.config, os métodos de OutputFileMixin e write_part(output_path,
+    num_records, inicio_referencia, date, faixa_horarios), que grava uma parte. Com
+    self.gerador_horarios, cada parte recebe uma faixa da curva de horários.
+    """
+    
+    gerador_horarios = None
+    
+    def _check_sharded_mode(self):
+        """Rejeita (ValueError) os modos do gerador que não suportam a geração em partes"""
+    
+    def _sharded_reference_start(self) -> int:
+        """Referências externas já emitidas antes deste arquivo (padrão: 0)"""
+        return 0
+    
+    def _finish_sharded_file(self, num_records: int):
+        """Atualiza os contadores do gerador após gerar um arquivo em partes"""
+    
+    def generate_sharded_file(self, num_records: int, output_path: str, date: datetime) -> str:
+        """
+        Gera o arquivo em partes paralelas e as concatena, em ordem, no arquivo final
+        
+        As partes (partes_arquivo) são gravadas por processos criados por fork
+        (processos_partes, padrão: número de CPUs), em um diretório temporário ao
+        lado do arquivo final. Cada parte usa uma semente própria sorteada aqui e
+        numera as referências externas a partir do seu primeiro registro (somado a
+        _sharded_reference_start), então, para a mesma semente e quantidade de
+        partes, o arquivo final é sempre o mesmo. A concatenação usa
+        append_file_contents (cópia dentro do kernel, sem passar os bytes pelo
+        processo), e o arquivo final continua sendo escrito de forma atômica. O
+        método usado fica em self.metodo_concatenacao.
+        
+        Args:
+            num_records: Número de registros do arquivo
+            output_path: Caminho de saída (arquivo, "-" ou pipe nomeado)
+            date: Data de referência
+        
+        Returns:
+            Caminho do arquivo gerado
+        """
+        global _gerador_partes
+        self._check_sharded_mode()
+        num_partes = int(self.config['partes_arquivo'])
+        processos = self.config.get('processos_partes') or os.cpu_count() or 1
+        if processos < 1:
+            raise ValueError("processos_partes deve ser positivo")
+        
+        tamanho_parte = -(-num_records // num_partes)
+        inicio_referencia = self._sharded_reference_start()
+        tarefas = [
+            (indice, inicio_referencia + inicio, min(tamanho_parte, num_records - inicio), random.getrandbits(64))
+            for indice, inicio in enumerate(range(0, num_records, tamanho_parte))
+        ]
+        
+        # Faixa da curva de horários de cada parte, para manter a ordem entre as partes;
+        # cada parte sorteia os próprios horários dentro da sua faixa
+        faixas = None
+        if self.gerador_horarios is not None:
+            faixas = self.gerador_horarios.plan_parts([quantidade for _, _, quantidade, _ in tarefas])
+        
+        # Partes no mesmo sistema de arquivos do destino, para a cópia ficar no kernel
+        base = None if self._is_stream_output(output_path) else os.path.dirname(os.path.abspath(output_path))
+        diretorio = tempfile.mkdtemp(prefix='.partes_', dir=base)
+        _gerador_partes = (self, diretorio, date, faixas)
+        try:
+            paralelo = (processos > 1 and len(tarefas) > 1 and not multiprocessing.current_process().daemon
+                        and 'fork' in multiprocessing.get_all_start_methods())
+            if paralelo:
+                with multiprocessing.get_context('fork').Pool(min(processos, len(tarefas))) as pool:
+                    pool.map(generate_part_file, tarefas, chunksize=1)
+            else:
+                list(map(generate_part_file, tarefas))
+            
+            caminhos = [os.path.join(diretorio, f"parte_{indice:05d}.csv") for indice, *_ in tarefas]
+            tamanhos = [os.path.getsize(caminho) for caminho in caminhos]
+            self.metodo_concatenacao = None
+            with self._open_output_atomic(output_path, sum(tamanhos)) as destino:
+                destino.flush()
+                for caminho, tamanho in zip(caminhos, tamanhos):
+                    with open(caminho, 'rb') as origem:
+                        self.metodo_concatenacao = append_file_contents(origem.fileno(), destino.fileno(), tamanho)
+        finally:
+            _gerador_partes = None
+            shutil.rmtree(diretorio, ignore_errors=True)
+        
+        self._finish_sharded_file(num_records)
+        return output_path
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Exportação opcional em Parquet (requer pyarrow, importado só quando usado)
+"""
+
+import os
+from typing import Callable, Dict
+
+
+class ParquetSink:
+    """
+    Escreve registros em Parquet (pyarrow) em lotes, na mesma passada da escrita do CSV
+    
+    O arquivo é escrito em um temporário oculto e renomeado ao final, assim como o CSV.
+    """
+    
+    def __init__(self, output_path: str, schema_factory: Callable, tamanho_lote: int = 65536):
+        """
+        Args:
+            output_path: Caminho final do arquivo Parquet
+            schema_factory: Função que recebe o módulo pyarrow e retorna o schema
+            tamanho_lote: Quantidade de registros por row group
+        """
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError(
+                "A exportação Parquet requer o pacote pyarrow (pip install pyarrow). "
+                "Para desativá-la, defina 'gerar_parquet' como false no JSON de configuração."
+            )
+        self.pa = pa
+        self.output_path = output_path
+        self.tmp_path = os.path.join(
+            os.path.dirname(os.path.abspath(output_path)),
+            f".{os.path.basename(output_path)}.{os.getpid()}.tmp"
+        )
+        self.schema = schema_factory(pa)
+        self.tamanho_lote = tamanho_lote
+        self.colunas = {nome: [] for nome in self.schema.names}
+        self.pendentes = 0
+        self.writer = pq.ParquetWriter(self.tmp_path, self.schema)
+    
+    def append(self, registro: Dict):
+        """Adiciona um registro (dicionário coluna -> valor) ao lote atual"""
+        for nome, valores in self.colunas.items():
+            valores.append(registro[nome])
+        self.pendentes += 1
+        if self.pendentes >= self.tamanho_lote:
+            self._flush()
+    
+    def _flush(self):
+        """Escreve o lote atual como um row group"""
+        if not self.pendentes:
+            return
+        tabela = self.pa.Table.from_pydict(self.colunas, schema=self.schema)
+        self.writer.write_table(tabela)
+        for valores in self.colunas.values():
+            valores.clear()
+        self.pendentes = 0
+    
+    def close(self):
+        """Escreve o lote pendente, fecha o arquivo e renomeia para o caminho final"""
+        self._flush()
+        self.writer.close()
+        os.replace(self.tmp_path, self.output_path)
+    
+    def abort(self):
+        """Descarta o arquivo temporário (usado quando a geração falha)"""
+        try:
+            self.writer.close()
+        finally:
+            if os.path.exists(self.tmp_path):
+                os.remove(self.tmp_path)
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Valores em centavos das informações de pagamento (AP002 / AP005)
+"""
+
+import random
+from typing import List, Tuple
+
+
+class PaymentCentsMixin:
+    """
+    Valores das informações de pagamento em centavos inteiros, sem erros de arredondamento
+    
+    Usa do gerador self.contas_bancarias, build_pagamento, format_pagamento_info e
+    self.tipo_divisao / self.concentracao_divisao (de divisao_pagamentos).
+    """
+    
+    def format_cents(self, centavos: int) -> str:
+        """Formata um valor em centavos inteiros com 2 casas decimais"""
+        return f"{centavos // 100}.{centavos % 100:02d}"
+    
+    def _to_cents(self, valor: float) -> int:
+        """Converte um valor em reais para centavos inteiros"""
+        return int(round(valor * 100))
+    
+    def _render_pagamento_prefixos(self) -> Tuple[List[str], str]:
+        """
+        Formata, uma única vez, as partes fixas das informações de pagamento
+        
+        Returns:
+            Tupla (prefixo "1;2;3;4;5;6;" de cada conta, na ordem de contas_bancarias,
+            sufixo com os subcampos a partir do 8, comum a todas as contas)
+        """
+        prefixos = []
+        sufixo = ''
+        for conta in self.contas_bancarias:
+            info = self.format_pagamento_info(self.build_pagamento(conta, 0.0))
+            prefixos.append(';'.join(info[:6]) + ';')
+            sufixo = ';' + ';'.join(info[7:])
+        return prefixos, sufixo
+    
+    def split_cents_batch(self, totais: List[int], partes: List[int]) -> List[List[int]]:
+        """
+        Divide, em lote, cada total em centavos em partes inteiras que somam exatamente o total
+        
+        Com divisao_pagamentos.tipo "igual", os centavos que sobram da divisão inteira
+        vão para as primeiras partes. Com "dirichlet", as proporções seguem uma
+        Dirichlet(concentracao) e os centavos são arredondados pelo maior resto.
+        
+        Args:
+            totais: Total de cada linha, em centavos
+            partes: Quantidade de partes de cada linha
+        
+        Returns:
+            Lista com os valores em centavos das partes de cada linha
+        """
+        resultado = []
+        if self.tipo_divisao == 'igual':
+            for total, k in zip(totais, partes):
+                base, resto = divmod(total, k)
+                resultado.append([base + 1] * resto + [base] * (k - resto))
+            return resultado
+        
+        gamma = random.gammavariate
+        alfa = self.concentracao_divisao
+        for total, k in zip(totais, partes):
+            if k == 1:
+                resultado.append([total])
+                continue
+            pesos = [gamma(alfa, 1.0) for _ in range(k)]
+            soma = sum(pesos) or 1.0
+            cotas = [total * p / soma for p in pesos]
+            valores = [int(c) for c in cotas]
+            # Distribui os centavos restantes pelos maiores restos (ajuste exato)
+            falta = total - sum(valores)
+            passo = 1 if falta > 0 else -1
+            ordem = sorted(range(k), key=lambda j: passo * (valores[j] - cotas[j]))
+            i = 0
+            while falta:
+                j = ordem[i % k]
+                if valores[j] + passo >= 0:
+                    valores[j] += passo
+                    falta -= passo
+                i += 1
+            resultado.append(valores)
+        return resultado
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Pools de referência (CNPJs de EC, contas etc.) em memória compartilhada entre processos
+"""
+
+import os
+import struct
+import sys
+import weakref
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional
+
+# Tamanho em bytes de cada item / campo, gravado antes do conteúdo
+_TAMANHO = struct.Struct('<I')
+
+# A partir do Python 3.13, um bloco pode ser reaberto pelo nome sem registrá-lo no
+# resource_tracker (track=False); antes disso, o processo que o reabre passaria a
+# ser tratado como dono do bloco e poderia removê-lo (ou avisar de vazamento) ao terminar
+_REABERTURA_SEM_RASTREIO = sys.version_info >= (3, 13)
+
+
+class FixedWidthPool:
+    """
+    Pool de textos em registros de largura fixa, em um bloco de memória compartilhada
+    
+    Cada item é gravado como tamanho (4 bytes) + texto UTF-8, completado até a largura
+    do maior item, em um único bloco de multiprocessing.shared_memory, em vez de um
+    objeto str por item no heap do processo. Processos filhos criados por fork herdam
+    o bloco e leem as mesmas páginas, sem duplicar o pool. O acesso não é gratuito:
+    cada leitura por índice decodifica o item em um novo str. Sem memória
+    compartilhada disponível, o bloco fica em um bytearray local.
+    
+    O bloco é criado e removido pelo processo que monta o pool. Na serialização
+    (pickle), a cópia só reabre o bloco pelo nome quando isso pode ser feito fora do
+    resource_tracker (ver _REABERTURA_SEM_RASTREIO); caso contrário, leva os bytes
+    do bloco e passa a ter um bytearray local.
+    """
+    
+    def __init__(self, textos: List[str]):
+        """
+        Args:
+            textos: Itens do pool, na ordem de acesso por índice
+        """
+        self._store([texto.encode('utf-8') for texto in textos])
+    
+    def _store(self, itens: List[bytes]):
+        """Grava os itens já codificados no bloco"""
+        self.tamanho = len(itens)
+        self.largura = _TAMANHO.size + max(map(len, itens), default=0)
+        self.criador = os.getpid()
+        dados = b''.join(
+            _TAMANHO.pack(len(item)) + item.ljust(self.largura - _TAMANHO.size, b'\0') for item in itens
+        )
+        try:
+            self._shm = shared_memory.SharedMemory(create=True, size=max(1, len(dados)))
+            self._buf = self._shm.buf
+            self._buf[:len(dados)] = dados
+            weakref.finalize(self, FixedWidthPool._release, self._shm, self.criador)
+        except OSError:
+            self._shm = None
+            self._buf = bytearray(dados)
+    
+    @staticmethod
+    def _release(shm: shared_memory.SharedMemory, criador: Optional[int]):
+        """Fecha o bloco; só o processo criador (no pool original) o remove do sistema"""
+        shm.close()
+        if os.getpid() == criador:
+            shm.unlink()
+    
+    def _item(self, indice: int):
+        """Bytes do item na posição indice (sem o tamanho e o preenchimento)"""
+        if indice < 0:
+            indice += self.tamanho
+        if not 0 <= indice < self.tamanho:
+            raise IndexError("índice fora do pool")
+        inicio = indice * self.largura
+        tamanho, = _TAMANHO.unpack_from(self._buf, inicio)
+        inicio += _TAMANHO.size
+        return self._buf[inicio:inicio + tamanho]
+    
+    def __len__(self) -> int:
+        return self.tamanho
+    
+    def __getitem__(self, indice: int) -> str:
+        return str(self._item(indice), 'utf-8')
+    
+    def __iter__(self):
+        for indice in range(self.tamanho):
+            yield self[indice]
+    
+    def __getstate__(self) -> Dict:
+        estado = {k: v for k, v in self.__dict__.items() if k not in ('_shm', '_buf')}
+        if self._shm is not None and _REABERTURA_SEM_RASTREIO:
+            estado['nome_bloco'] = self._shm.name
+        else:
+            estado['dados'] = bytes(self._buf[:self.tamanho * self.largura])
+        return estado
+    
+    def __setstate__(self, estado: Dict):
+        nome_bloco = estado.pop('nome_bloco', None)
+        dados = estado.pop('dados', None)
+        self.__dict__.update(estado)
+        if nome_bloco is not None:
+            self._shm = shared_memory.SharedMemory(name=nome_bloco, track=False)
+            self._buf = self._shm.buf
+            # Cópia reaberta pelo nome: nunca remove o bloco, mesmo no processo criador
+            weakref.finalize(self, FixedWidthPool._release, self._shm, None)
+        else:
+            self._shm = None
+            self._buf = bytearray(dados)
+
+
+class FixedWidthRecordPool(FixedWidthPool):
+    """
+    Pool de registros (dicionários com as mesmas chaves) em largura fixa
+    
+    Cada registro é gravado como a sequência dos valores das colunas, cada um
+    precedido do seu tamanho (ver FixedWidthPool), então qualquer caractere é
+    aceito nos valores, sem separador nem escape. Volta como um novo dicionário
+    no acesso por índice.
+    """
+    
+    def __init__(self, registros: List[Dict]):
+        """
+        Args:
+            registros: Linhas lidas pelo csv.DictReader (colunas do primeiro registro)
+        """
+        self.campos = tuple(c for c in registros[0] if c is not None) if registros else ()
+        itens = []
+        for registro in registros:
+            valores = [(registro.get(c) or '').encode('utf-8') for c in self.campos]
+            itens.append(b''.join(_TAMANHO.pack(len(v)) + v for v in valores))
+        self._store(itens)
+    
+    def __getitem__(self, indice: int) -> Dict:
+        bruto = self._item(indice)
+        registro = {}
+        posicao = 0
+        for campo in self.campos:
+            tamanho, = _TAMANHO.unpack_from(bruto, posicao)
+            posicao += _TAMANHO.size
+            registro[campo] = str(bruto[posicao:posicao + tamanho], 'utf-8')
+            posicao += tamanho
+        return registro
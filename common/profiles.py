@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Agendador de perfis (AP002 / AP005 / AP008): um arquivo por credenciadora em uma execução
+"""
+
+import copy
+import gc
+import multiprocessing
+import os
+import random
+from typing import Dict, List, Optional, Tuple
+
+
+# Gerador base do agendador de perfis. É definido antes de criar o Pool para que os
+# processos filhos (fork) o herdem com as listas de referência já carregadas
+_gerador_perfis = None
+
+
+def generate_profile_file(tarefa: Tuple[int, int, int]) -> Tuple[str, str, int]:
+    """
+    Gera o arquivo de um perfil (tenant) a partir do gerador base herdado
+    
+    Executada nos processos do agendador de perfis (ver ProfileSchedulerMixin.generate_profiles).
+    
+    Args:
+        tarefa: Tupla (índice do perfil, quantidade de registros, semente)
+    
+    Returns:
+        Tupla (CNPJ credenciadora, caminho do arquivo gerado, total de registros)
+    """
+    indice, num_records, semente = tarefa
+    gerador = _gerador_perfis.for_profile(_gerador_perfis.perfis[indice])
+    random.seed(semente)
+    output_file = gerador.generate_file(num_records)
+    # Geradores sem total_registros (AP008) geram exatamente num_records
+    return gerador.cnpj_credenciadora, output_file, getattr(gerador, 'total_registros', num_records)
+
+
+class ProfileSchedulerMixin:
+    """
+    Perfis (tenants) dos geradores, configurados em perfis
+    
+    Usa do gerador self.config e generate_file. Cada gerador define CAMPOS_PERFIL
+    (campos que um perfil pode sobrepor) e CLASSE_SETTINGS (validação da
+    configuração), e completa o gerador de cada perfil em _setup_profile.
+    """
+    
+    CAMPOS_PERFIL: Tuple[str, ...] = ()
+    CLASSE_SETTINGS = None
+    
+    def _load_perfis(self, perfis: Optional[List[Dict]]) -> List[Dict]:
+        """
+        Valida a lista de perfis (tenants) da configuração
+        
+        Cada perfil só pode sobrepor os campos de CAMPOS_PERFIL e deve formar, junto
+        com o restante da configuração, uma configuração válida. Perfis com a mesma
+        raiz de CNPJ da credenciadora gerariam arquivos com o mesmo nome.
+        
+        Args:
+            perfis: Valor de perfis na configuração (None ou lista de objetos)
+        
+        Returns:
+            Lista de perfis validados (vazia se não configurado)
+        """
+        if not perfis:
+            return []
+        if not isinstance(perfis, list):
+            raise ValueError("perfis deve ser uma lista de objetos")
+        
+        raizes = {}
+        for indice, perfil in enumerate(perfis):
+            if not isinstance(perfil, dict):
+                raise ValueError(f"perfis[{indice}] deve ser um objeto")
+            invalidos = sorted(set(perfil) - set(self.CAMPOS_PERFIL))
+            if invalidos:
+                raise ValueError(f"perfis[{indice}]: campos não permitidos em um perfil: {', '.join(invalidos)}")
+            quantidade = perfil.get('quantidade_registros', 1)
+            if not isinstance(quantidade, int) or isinstance(quantidade, bool) or quantidade < 1:
+                raise ValueError(f"perfis[{indice}]: quantidade_registros deve ser um inteiro >= 1")
+            try:
+                settings = self.CLASSE_SETTINGS.from_config({**self.config, **perfil})
+            except ValueError as e:
+                raise ValueError(f"perfis[{indice}]: {e}") from None
+            raiz = settings.cnpj_credenciadora[:8]
+            if raiz in raizes:
+                raise ValueError(
+                    f"perfis[{raizes[raiz]}] e perfis[{indice}] têm a mesma raiz de CNPJ da credenciadora ({raiz})"
+                )
+            raizes[raiz] = indice
+        return perfis
+    
+    def _setup_profile(self, gerador):
+        """Ajusta os campos próprios do gerador (CNPJs, contadores) ao criar o gerador de um perfil"""
+    
+    def for_profile(self, perfil: Dict):
+        """
+        Cria o gerador de um perfil (tenant) reaproveitando as listas já carregadas
+        
+        A cópia é rasa: CNPJs de EC, contas, amostradores e caches são compartilhados
+        com este gerador; só a configuração, os CNPJs de identificação e os
+        contadores do arquivo passam a ser do perfil.
+        
+        Args:
+            perfil: Campos do perfil (ver CAMPOS_PERFIL), sobrepostos à configuração
+        
+        Returns:
+            Gerador do perfil
+        """
+        gerador = copy.copy(self)
+        gerador.config = {**self.config, **perfil}
+        gerador.settings = self.CLASSE_SETTINGS.from_config(gerador.config)
+        gerador.cnpj_credenciadora = gerador.settings.cnpj_credenciadora
+        gerador.cnpj_raiz = gerador.cnpj_credenciadora[:8]
+        self._setup_profile(gerador)
+        return gerador
+    
+    def generate_profiles(self, num_records: Optional[int] = None) -> List[Tuple[str, str, int]]:
+        """
+        Gera um arquivo por perfil (tenant) configurado em perfis, em paralelo
+        
+        Os perfis são distribuídos entre processos_perfis processos criados por fork,
+        que herdam as listas de referência já carregadas por este gerador em vez de
+        relê-las. Cada perfil recebe uma semente própria, sorteada aqui, então os
+        arquivos não dependem da quantidade de processos. Sem fork disponível (ex.:
+        Windows) os perfis são gerados em sequência, no próprio processo.
+        
+        Args:
+            num_records: Registros por arquivo (padrão: quantidade_registros do perfil,
+                         da configuração ou 10)
+        
+        Returns:
+            Lista de (CNPJ credenciadora, caminho do arquivo, total de registros), na ordem dos perfis
+        """
+        global _gerador_perfis
+        processos = self.config.get('processos_perfis') or os.cpu_count() or 1
+        if processos < 1:
+            raise ValueError("processos_perfis deve ser positivo")
+        
+        tarefas = []
+        for indice, perfil in enumerate(self.perfis):
+            quantidade = num_records or perfil.get('quantidade_registros') or self.config.get('quantidade_registros', 10)
+            tarefas.append((indice, quantidade, random.getrandbits(64)))
+        
+        _gerador_perfis = self
+        try:
+            if processos == 1 or len(tarefas) <= 1 or 'fork' not in multiprocessing.get_all_start_methods():
+                return list(map(generate_profile_file, tarefas))
+            # Congela os objetos já carregados para que a coleta de lixo dos filhos
+            # não toque (e copie) as páginas herdadas
+            gc.freeze()
+            with multiprocessing.get_context('fork').Pool(min(processos, len(tarefas))) as pool:
+                return pool.map(generate_profile_file, tarefas, chunksize=1)
+        finally:
+            _gerador_perfis = None
+            gc.unfreeze()
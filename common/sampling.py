@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+Amostragem ponderada de itens dos pools de referência (ECs, contas etc.)
+"""
+
+import csv
+import random
+from typing import Dict, List, Optional
+
+
+class AliasSampler:
+    """
+    Amostragem ponderada em O(1) por sorteio, usando tabelas de alias (método de Vose)
+    
+    As tabelas são montadas uma única vez em O(n); cada sorteio usa apenas dois
+    números aleatórios e dois acessos a lista, independente do tamanho do pool.
+    """
+    
+    def __init__(self, pesos: List[float]):
+        """
+        Args:
+            pesos: Peso (não negativo) de cada item, na ordem do pool
+        """
+        n = len(pesos)
+        total = float(sum(pesos))
+        if n == 0 or total <= 0:
+            raise ValueError("A distribuição precisa ter ao menos um peso positivo")
+        
+        self.n = n
+        self.positivos = sum(1 for p in pesos if p > 0)
+        self.prob = [1.0] * n
+        self.alias = list(range(n))
+        
+        escala = [p * n / total for p in pesos]
+        pequenos = [i for i, p in enumerate(escala) if p < 1.0]
+        grandes = [i for i, p in enumerate(escala) if p >= 1.0]
+        while pequenos and grandes:
+            menor = pequenos.pop()
+            maior = grandes.pop()
+            self.prob[menor] = escala[menor]
+            self.alias[menor] = maior
+            escala[maior] = escala[maior] + escala[menor] - 1.0
+            if escala[maior] < 1.0:
+                pequenos.append(maior)
+            else:
+                grandes.append(maior)
+        # Sobras (erros de arredondamento) ficam com probabilidade 1
+    
+    def sample_index(self) -> int:
+        """Sorteia o índice de um item conforme os pesos"""
+        i = int(random.random() * self.n)
+        return i if random.random() < self.prob[i] else self.alias[i]
+    
+    def sample_distinct(self, k: int) -> List[int]:
+        """Sorteia até k índices distintos (sem reposição) conforme os pesos"""
+        k = min(k, self.positivos)
+        indices = []
+        while len(indices) < k:
+            i = self.sample_index()
+            if i not in indices:
+                indices.append(i)
+        return indices
+
+
+class WeightedPoolMixin:
+    """
+    Seleção ponderada de itens dos pools de ECs e de contas bancárias
+    
+    Usa do gerador self.cnpjs_ec, self.amostrador_ec e, quando houver pool de contas,
+    self.contas_bancarias e self.amostrador_contas (amostradores montados com
+    _build_sampler; None para seleção uniforme).
+    """
+    
+    def _load_weight_column(self, file_path: str, coluna: str, chave: Optional[str] = None) -> List[float]:
+        """
+        Carrega uma coluna de pesos de um arquivo CSV, alinhada ao pool carregado
+        
+        Args:
+            file_path: Caminho do arquivo CSV do pool
+            coluna: Nome da coluna com os pesos
+            chave: Coluna obrigatória (linhas com essa coluna vazia são ignoradas, como no pool)
+        """
+        pesos = []
+        with open(file_path, 'r', encoding='utf-8') as f:
+            reader = csv.DictReader(f)
+            for row in reader:
+                if chave and not row.get(chave, '').strip():
+                    continue
+                pesos.append(float(row.get(coluna) or 0))
+        return pesos
+    
+    def _load_histogram_weights(self, file_path: str, num_itens: int) -> List[float]:
+        """
+        Carrega pesos a partir de um histograma de concentração
+        
+        O arquivo CSV contém as colunas fracao_itens e fracao_volume. O pool (na ordem
+        do arquivo) é dividido em faixas consecutivas com fracao_itens dos itens, e
+        cada faixa recebe fracao_volume dos sorteios, dividida igualmente entre seus itens.
+        Exemplo: "0.01,0.50" faz 1% dos itens receberem 50% dos sorteios.
+        """
+        faixas = []
+        with open(file_path, 'r', encoding='utf-8') as f:
+            reader = csv.DictReader(f)
+            for row in reader:
+                faixas.append((float(row['fracao_itens']), float(row['fracao_volume'])))
+        if not faixas:
+            raise ValueError(f"Nenhuma faixa encontrada no histograma {file_path}")
+        
+        total_itens = sum(fracao for fracao, _ in faixas)
+        pesos = [0.0] * num_itens
+        acumulado = 0.0
+        inicio = 0
+        for j, (fracao_itens, fracao_volume) in enumerate(faixas):
+            acumulado += fracao_itens
+            if j == len(faixas) - 1:
+                fim = num_itens
+            else:
+                fim = min(num_itens, int(round(acumulado / total_itens * num_itens)))
+            if fim > inicio:
+                peso = fracao_volume / (fim - inicio)
+                for i in range(inicio, fim):
+                    pesos[i] = peso
+                inicio = fim
+        return pesos
+    
+    def _build_sampler(self, distribuicao: Optional[Dict], num_itens: int, file_path: str,
+                       chave: Optional[str] = None) -> Optional[AliasSampler]:
+        """
+        Monta o amostrador ponderado de um pool conforme a configuração
+        
+        Args:
+            distribuicao: Configuração da distribuição ({"tipo": "uniforme" | "zipf" | "coluna" | "histograma", ...})
+            num_itens: Tamanho do pool
+            file_path: Arquivo CSV do pool (usado pelo tipo "coluna")
+            chave: Coluna obrigatória do pool (usada pelo tipo "coluna")
+        
+        Returns:
+            AliasSampler, ou None para seleção uniforme
+        """
+        if not distribuicao or distribuicao.get('tipo', 'uniforme') == 'uniforme':
+            return None
+        
+        tipo = distribuicao['tipo']
+        if tipo == 'zipf':
+            # O i-ésimo item do arquivo recebe peso 1 / i^expoente
+            expoente = float(distribuicao.get('expoente', 1.0))
+            pesos = [1.0 / (rank ** expoente) for rank in range(1, num_itens + 1)]
+        elif tipo == 'coluna':
+            pesos = self._load_weight_column(file_path, distribuicao['coluna'], chave)
+        elif tipo == 'histograma':
+            pesos = self._load_histogram_weights(distribuicao['arquivo'], num_itens)
+        else:
+            raise ValueError(f"Tipo de distribuição desconhecido: {tipo}")
+        
+        if len(pesos) != num_itens:
+            raise ValueError(f"Quantidade de pesos ({len(pesos)}) difere do tamanho do pool ({num_itens})")
+        return AliasSampler(pesos)
+    
+    def choose_cnpj_ec(self) -> str:
+        """Seleciona um CNPJ de EC conforme a distribuição configurada"""
+        if self.amostrador_ec is None:
+            return random.choice(self.cnpjs_ec)
+        return self.cnpjs_ec[self.amostrador_ec.sample_index()]
+    
+    def choose_cnpj_ec_index(self) -> int:
+        """Seleciona o índice de um CNPJ de EC conforme a distribuição configurada"""
+        if self.amostrador_ec is None:
+            return random.randrange(len(self.cnpjs_ec))
+        return self.amostrador_ec.sample_index()
+    
+    def choose_contas(self, quantidade: int) -> List[Dict]:
+        """Seleciona contas bancárias distintas conforme a distribuição configurada"""
+        return [self.contas_bancarias[i] for i in self.choose_contas_indices(quantidade)]
+    
+    def choose_contas_indices(self, quantidade: int) -> List[int]:
+        """Seleciona posições de contas bancárias distintas conforme a distribuição configurada"""
+        if self.amostrador_contas is None:
+            return random.sample(range(len(self.contas_bancarias)), min(quantidade, len(self.contas_bancarias)))
+        return self.amostrador_contas.sample_distinct(quantidade)
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Validação dos campos comuns das configurações dos geradores (ver APXXXSettings.from_config)
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+
+class ConfigValidators:
+    """
+    Validadores de campos da configuração, usados pelas classes APXXXSettings
+    
+    Cada validador devolve o valor validado ou, se inválido, acrescenta a mensagem
+    em erros e devolve um valor neutro, para que todos os problemas sejam
+    informados juntos por _raise_if_invalid.
+    """
+    
+    @staticmethod
+    def _cnpj(config: Dict, chave: str, erros: List[str], padrao: Optional[str] = None) -> str:
+        """Valida um CNPJ da configuração (até 14 dígitos; completado com zeros na formatação)"""
+        valor = config.get(chave, padrao)
+        if not isinstance(valor, str) or not valor.isdigit() or len(valor) > 14:
+            erros.append(f"{chave} deve ser um CNPJ com até 14 dígitos (recebido: {valor!r})")
+            return ''
+        return valor
+    
+    @staticmethod
+    def _texto(config: Dict, chave: str, erros: List[str], padrao: Optional[str] = None) -> str:
+        """Valida um texto não vazio da configuração"""
+        valor = config.get(chave, padrao)
+        if not isinstance(valor, str) or not valor:
+            erros.append(f"{chave} deve ser um texto não vazio (recebido: {valor!r})")
+            return ''
+        return valor
+    
+    @staticmethod
+    def _inteiro(config: Dict, chave: str, erros: List[str], minimo: int) -> int:
+        """Valida um inteiro da configuração, maior ou igual a minimo"""
+        valor = config.get(chave)
+        if not isinstance(valor, int) or isinstance(valor, bool) or valor < minimo:
+            erros.append(f"{chave} deve ser um inteiro >= {minimo} (recebido: {valor!r})")
+            return minimo
+        return valor
+    
+    @staticmethod
+    def _valor(config: Dict, chave: str, erros: List[str], minimo: float) -> float:
+        """Valida um valor monetário da configuração, maior ou igual a minimo"""
+        valor = config.get(chave)
+        if not isinstance(valor, (int, float)) or isinstance(valor, bool) or valor < minimo:
+            erros.append(f"{chave} deve ser um número >= {minimo:.2f} (recebido: {valor!r})")
+            return float(minimo)
+        return float(valor)
+    
+    @staticmethod
+    def _arranjos(config: Dict, erros: List[str]) -> Tuple[str, ...]:
+        """Valida a lista de arranjos de pagamento"""
+        arranjos = config.get('arranjos_pagamento')
+        if not isinstance(arranjos, list) or not arranjos or not all(isinstance(a, str) and a for a in arranjos):
+            erros.append(f"arranjos_pagamento deve ser uma lista não vazia de códigos (recebido: {arranjos!r})")
+            return ()
+        return tuple(arranjos)
+    
+    @staticmethod
+    def _raise_if_invalid(erros: List[str]):
+        """Falha com todos os problemas encontrados de uma vez"""
+        if erros:
+            raise ValueError("Configuração inválida:\n  - " + "\n  - ".join(erros))
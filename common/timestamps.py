@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+Horários intradiários dos eventos (data_hora_evento / data_hora_ultima_atualizacao)
+"""
+
+import itertools
+import random
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+class TimestampGenerator:
+    """
+    Gera horários de eventos ao longo de um dia conforme uma curva de chegada configurável
+    
+    A curva é contínua por trechos (pesos por minuto do dia, instante uniforme dentro
+    do minuto). Sem ordenação, cada lote é sorteado de forma independente; com
+    ordenação, os horários saem já em ordem crescente, um de cada vez, sem ordenar
+    o arquivo em memória. Saem formatados em RFC3339 com cache do prefixo
+    "AAAA-MM-DDTHH:MM:SS" por segundo do dia.
+    """
+    
+    # Horários produzidos por vez
+    TAMANHO_LOTE = 65536
+    
+    # Peso relativo de cada hora do dia (0h a 23h) na curva de horário comercial
+    CURVA_COMERCIAL = (
+        1, 1, 1, 1, 1, 2, 4, 8, 14, 20, 24, 22,
+        18, 20, 22, 22, 18, 12, 8, 6, 4, 3, 2, 1,
+    )
+    
+    def __init__(self, config: Dict):
+        """
+        Args:
+            config: Configuração da distribuição (curva, pesos_horarios, rajadas, ordenado)
+        """
+        curva = config.get('curva', 'comercial')
+        if 'pesos_horarios' in config:
+            pesos_horas = [float(p) for p in config['pesos_horarios']]
+        elif curva == 'comercial':
+            pesos_horas = [float(p) for p in self.CURVA_COMERCIAL]
+        elif curva == 'uniforme':
+            pesos_horas = [1.0] * 24
+        else:
+            raise ValueError(f"Curva de horários desconhecida: {curva}")
+        if len(pesos_horas) != 24 or sum(pesos_horas) <= 0:
+            raise ValueError("pesos_horarios deve conter 24 pesos não negativos com soma positiva")
+        
+        # Rajadas concentram uma fração dos eventos em uma janela curta
+        rajadas = config.get('rajadas', [])
+        fracao_rajadas = sum(float(r['fracao']) for r in rajadas)
+        if not 0.0 <= fracao_rajadas < 1.0:
+            raise ValueError("A soma das frações das rajadas deve estar entre 0 e 1")
+        
+        total_horas = sum(pesos_horas)
+        pesos_minutos = [
+            pesos_horas[minuto // 60] / total_horas / 60 * (1.0 - fracao_rajadas)
+            for minuto in range(1440)
+        ]
+        for rajada in rajadas:
+            hora, minuto = (int(parte) for parte in rajada['inicio'].split(':'))
+            inicio = hora * 60 + minuto
+            fim = min(1440, inicio + int(rajada.get('duracao_minutos', 1)))
+            for m in range(inicio, fim):
+                pesos_minutos[m] += float(rajada['fracao']) / (fim - inicio)
+        
+        self.pesos_acumulados = list(itertools.accumulate(pesos_minutos))
+        self.ultimo_minuto = max(m for m, peso in enumerate(pesos_minutos) if peso > 0)
+        self.ordenado = bool(config.get('ordenado', True))
+        self._dia_cache = None
+        self._prefixos = {}
+    
+    def plan_parts(self, quantidades: List[int]) -> Optional[List[Tuple[float, float]]]:
+        """
+        Divide a curva do dia entre partes consecutivas de um arquivo ordenado
+        
+        Sorteia apenas o último horário de cada parte (como posição na curva, de 0 a
+        1): o k-ésimo menor dos horários restantes segue uma distribuição Beta. Cada
+        parte gera depois os seus próprios horários entre o fim da anterior e o seu
+        (ver iter_timestamps), e a concatenação das partes fica na mesma ordem e com
+        a mesma distribuição de um arquivo gerado de uma vez.
+        
+        Args:
+            quantidades: Quantidade de registros de cada parte, na ordem do arquivo
+        
+        Returns:
+            Faixa (início, fim) de cada parte, ou None se os horários não são ordenados
+        """
+        if not self.ordenado:
+            return None
+        faixas = []
+        restantes = sum(quantidades)
+        anterior = 0.0
+        for quantidade in quantidades:
+            restantes -= quantidade
+            fim = anterior + (1.0 - anterior) * random.betavariate(quantidade, restantes + 1)
+            faixas.append((anterior, fim))
+            anterior = fim
+        return faixas
+    
+    def _iter_positions(self, quantidade: int, faixa: Optional[Tuple[float, float]]) -> Iterator[float]:
+        """
+        Posições na curva (0 a 1) de quantidade horários ordenados, uma de cada vez
+        
+        Usa a recorrência das estatísticas de ordem da uniforme: o próximo valor é o
+        menor de k uniformes no intervalo que resta, então nada é guardado além do
+        valor atual. Com faixa, o último valor é o fim da faixa (ver plan_parts).
+        """
+        inicio, fim = faixa if faixa is not None else (0.0, 1.0)
+        sorteados = quantidade - 1 if faixa is not None else quantidade
+        posicao = inicio
+        for k in range(sorteados, 0, -1):
+            posicao = fim - (fim - posicao) * random.random() ** (1.0 / k)
+            yield posicao
+        if faixa is not None and quantidade > 0:
+            yield fim
+    
+    def _iter_offsets(self, quantidade: int, faixa: Optional[Tuple[float, float]]) -> Iterator[List[int]]:
+        """Microssegundos desde o início do dia, em lotes de até TAMANHO_LOTE horários"""
+        if not self.ordenado:
+            for inicio in range(0, quantidade, self.TAMANHO_LOTE):
+                lote = min(self.TAMANHO_LOTE, quantidade - inicio)
+                minutos = random.choices(range(1440), cum_weights=self.pesos_acumulados, k=lote)
+                yield [m * 60000000 + random.randrange(60000000) for m in minutos]
+            return
+        
+        # Inversa da distribuição acumulada: como as posições são crescentes, o minuto
+        # só avança (sem busca binária por horário)
+        acumulados = self.pesos_acumulados
+        escala = acumulados[-1]
+        minuto = 0
+        lote = []
+        for posicao in self._iter_positions(quantidade, faixa):
+            alvo = posicao * escala
+            while minuto < self.ultimo_minuto and alvo >= acumulados[minuto]:
+                minuto += 1
+            base = acumulados[minuto - 1] if minuto else 0.0
+            fracao = (alvo - base) / (acumulados[minuto] - base)
+            lote.append(minuto * 60000000 + min(59999999, max(0, int(fracao * 60000000))))
+            if len(lote) == self.TAMANHO_LOTE:
+                yield lote
+                lote = []
+        if lote:
+            yield lote
+    
+    def iter_timestamps(self, quantidade: int, dia: datetime,
+                        faixa: Optional[Tuple[float, float]] = None) -> Iterator[Tuple[datetime, str]]:
+        """
+        Gera os horários de um arquivo (ou de uma parte dele) dentro do dia informado
+        
+        Os horários são produzidos sob demanda, em lotes de TAMANHO_LOTE, então a
+        memória não cresce com a quantidade (arquivos de horizonte com centenas de
+        milhões de linhas incluídos).
+        
+        Args:
+            quantidade: Quantidade de horários
+            dia: Dia de referência dos horários
+            faixa: Faixa da parte, devolvida por plan_parts (None = arquivo inteiro)
+        
+        Returns:
+            Iterador de tuplas (data/hora, data/hora formatada em RFC3339)
+        """
+        inicio = datetime(dia.year, dia.month, dia.day)
+        if inicio != self._dia_cache:
+            self._dia_cache = inicio
+            self._prefixos = {}
+        prefixos = self._prefixos
+        
+        for offsets in self._iter_offsets(quantidade, faixa):
+            for offset in offsets:
+                segundo, micro = divmod(offset, 1000000)
+                prefixo = prefixos.get(segundo)
+                if prefixo is None:
+                    prefixo = (inicio + timedelta(seconds=segundo)).strftime("%Y-%m-%dT%H:%M:%S")
+                    prefixos[segundo] = prefixo
+                # Mesmo formato de isoformat() + "Z" (sem fração quando microssegundo = 0)
+                texto = f"{prefixo}.{micro:06d}Z" if micro else f"{prefixo}Z"
+                yield inicio + timedelta(microseconds=offset), texto